@@ -1,6 +1,6 @@
 import sys
 import os
-from flask import Flask, request, jsonify, Response, stream_with_context, make_response, send_file
+from flask import Flask, request, jsonify, Response, stream_with_context, make_response, send_file, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime
@@ -8,12 +8,23 @@ import asyncio
 import json
 import logging
 import traceback
+import uuid
 from werkzeug.utils import secure_filename
 from services.insights_service import InsightsService
 from services.document_service import DocumentService
 from models.market_research_agent import MarketResearchAgent
 from models.business_consultant_agent import BusinessConsultantAgent
 from models.multi_agent_system import MultiAgentSystem
+from models.rate_limiter import get_rate_limiter_stats
+from models.circuit_breaker import get_circuit_breaker_stats, OPEN
+from models.single_flight import get_single_flight_stats
+from models.model_router import get_routing_report
+from models.telemetry import set_request_context, llm_metrics
+from models.hedging import get_hedging_stats
+from models.search_cache import get_search_cache_stats
+from models.observation_compressor import get_observation_stats
+from models.run_log import get_run_stats
+from models.executor_pool import get_executor_pool_stats
 
 # Get the project root directory (one level up from api directory)
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -34,6 +45,7 @@ from api.routes.reports import reports_bp
 from api.routes.multi_agent import multi_agent_bp
 from api.routes.report_generator import report_generator_bp
 from api.routes.business_case import business_case_bp
+from api.routes.runs import runs_bp
 
 # Print debug information
 print(f"Current working directory: {os.getcwd()}")
@@ -51,17 +63,25 @@ print(f"ANTHROPIC_API_KEY exists: {'Yes' if os.getenv('ANTHROPIC_API_KEY') else
 
 def create_app():
     app = Flask(__name__)
+
+    # Tag every request, and the LLM calls it makes, with a request ID
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        set_request_context(g.request_id, request.endpoint or request.path)
     
     # Configure CORS
     @app.after_request
     def after_request(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
         origin = request.headers.get('Origin')
         if origin in ["http://localhost:3000", "http://127.0.0.1:3000"]:
             response.headers['Access-Control-Allow-Origin'] = origin
             response.headers['Access-Control-Allow-Credentials'] = 'true'
             response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-            response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Request-ID'
+            response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization, X-Request-ID'
             response.headers['Vary'] = 'Origin'
         return response
 
@@ -74,8 +94,8 @@ def create_app():
                 response.headers['Access-Control-Allow-Origin'] = origin
                 response.headers['Access-Control-Allow-Credentials'] = 'true'
                 response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-                response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-                response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization'
+                response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Request-ID'
+                response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization, X-Request-ID'
                 response.headers['Vary'] = 'Origin'
             return response
 
@@ -88,6 +108,7 @@ def create_app():
     app.register_blueprint(multi_agent_bp, url_prefix='/api/multi-agent')
     app.register_blueprint(report_generator_bp, url_prefix='/api/report-generator')
     app.register_blueprint(business_case_bp, url_prefix='/api/business-case')
+    app.register_blueprint(runs_bp, url_prefix='/api/runs')
 
     return app
 
@@ -329,7 +350,8 @@ async def get_answer():
         answer = consultant_agent.get_answer(
             query=query,
             user_id=user_id,
-            chat_history=chat_history
+            chat_history=chat_history,
+            thread_id=data.get('thread_id', 'default')
         )
         
         if not answer:
@@ -352,9 +374,38 @@ async def get_answer():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint for the API."""
+    circuit_breakers = get_circuit_breaker_stats()
+    degraded = any(breaker['state'] == OPEN for breaker in circuit_breakers.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'rate_limits': get_rate_limiter_stats(),
+        'circuit_breakers': circuit_breakers,
+        'single_flight': get_single_flight_stats(),
+        'search_cache': get_search_cache_stats()
+    })
+
+@app.route('/api/model-routing', methods=['GET'])
+def model_routing_report():
+    """Per-route report of model tiers used, latency and estimated savings."""
+    return jsonify({
+        'success': True,
+        'routes': get_routing_report()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def llm_call_metrics():
+    """LLM latency, TTFT, token and cost histograms per route, agent, step and model."""
+    if request.args.get('format') == 'prometheus':
+        return Response(llm_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
     return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
+        'success': True,
+        **llm_metrics.get_metrics(),
+        'hedging': get_hedging_stats(),
+        'search_cache': get_search_cache_stats(),
+        'observations': get_observation_stats(),
+        'runs': get_run_stats(),
+        'executor_pools': get_executor_pool_stats()
     })
 
 @app.route('/api/insights', methods=['GET'])
@@ -1,18 +1,92 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
 from models.business_case_agent import BusinessCaseAgent
+from models.circuit_breaker import error_event_fields
+from models.case_store import get_case_store, case_hash, RESULT_LIMIT
+from models.case_batch import CaseBatchQueue
+from models.run_log import get_run_manager, RUN_HEARTBEAT_SECONDS
+from models.deadline import Deadline, DeadlineExceeded, deadline_scope
+from api.routes.runs import run_stream_response, format_run_event
+from config.supabase_client import supabase
 import json
+import logging
 import traceback
 import time
 
+# Configure logging
+logger = logging.getLogger(__name__)
+
 business_case_bp = Blueprint('business_case', __name__)
 
 # Initialize the business case agent
 agent = BusinessCaseAgent()
 
+# Shared queue for batch case solving
+batch_queue = CaseBatchQueue(agent)
+
+# "pipeline" runs the step calls concurrently; "one_shot" gets the whole analysis in one structured call
+ANALYSIS_MODES = ('pipeline', 'one_shot')
+
+# Progress messages for the steps that run concurrently: (status, started, finished)
+STEP_MESSAGES = {
+    'problem_statement': ('analyzing', 'Identifying core business problem...', 'Problem identified'),
+    'key_factors': ('analyzing', 'Analyzing key factors...', 'Key factors analyzed'),
+    'constraints': ('analyzing', 'Identifying constraints...', 'Constraints identified'),
+    'solutions': ('solving', 'Generating potential solutions...', 'Solutions generated'),
+}
+
+# Section titles of the final analysis, by result key
+SECTION_TITLES = {
+    'problem_statement': 'Problem Statement',
+    'key_factors': 'Key Factors',
+    'constraints': 'Constraints',
+    'solutions': 'Solutions',
+    'recommendation': 'Recommendation',
+}
+
 def format_sse(data):
     """Format data as SSE."""
     return f"data: {json.dumps(data)}\n\n"
 
+def get_request_user_id():
+    """User ID from the bearer token, or None if the request is anonymous or the token is invalid."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    try:
+        response = supabase.auth.get_user(auth_header.split(' ')[1])
+        return response.user.id if response and response.user else None
+    except Exception as e:
+        logger.info(f"Not storing case results, token was not accepted: {str(e)}")
+        return None
+
+def step_event(event, key, value):
+    """
+    Event for a step's streamed progress, tagged with its section.
+
+    "delta" carries the next piece of the step's text, "reset" tells the
+    client to clear the section because the step is streaming again, and
+    "item" carries a complete key factor, constraint or solution.
+    """
+    if event == 'reset':
+        return {'type': 'delta', 'section': key, 'content': '', 'reset': True}
+    if event == 'item':
+        return {'type': 'item', 'section': key, 'content': value}
+    return {'type': 'delta', 'section': key, 'content': value}
+
+def format_step_event(event, key, value):
+    """SSE event for a step's streamed progress, see step_event."""
+    return format_sse(step_event(event, key, value))
+
+def describe_step_result(key, value):
+    """One-line summary of a finished step for the text stream."""
+    if key == 'problem_statement':
+        return f'Problem identified: {value}'
+    if key == 'key_factors':
+        return f'Key factors analyzed: {", ".join(value)}'
+    if key == 'constraints':
+        return f'Constraints identified: {", ".join(value)}'
+    return f'Generated {len(value)} potential solutions'
+
 @business_case_bp.route('/solve', methods=['POST'])
 def solve_case():
     try:
@@ -22,6 +96,12 @@ def solve_case():
         if not case_description:
             return jsonify({'error': 'No case description provided'}), 400
 
+        mode = data.get('mode', 'pipeline')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown analysis mode: {mode}'}), 400
+        # Signed-in users get their stored results back instead of a rerun
+        user_id = get_request_user_id()
+
         def generate():
             # Initial status
             yield format_sse({
@@ -29,60 +109,32 @@ def solve_case():
                 'message': 'Starting business case analysis...'
             })
 
-            # Problem identification
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Identifying core business problem...'
-            })
-            problem_statement = agent.identify_problem(case_description)
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Problem identified',
-                'data': {'problem_statement': problem_statement}
-            })
-
-            # Key factors analysis
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Analyzing key factors...'
-            })
-            key_factors = agent.analyze_key_factors(case_description)
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Key factors analyzed',
-                'data': {'key_factors': key_factors}
-            })
-
-            # Constraints analysis
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Identifying constraints...'
-            })
-            constraints = agent.identify_constraints(case_description)
-            yield format_sse({
-                'status': 'analyzing',
-                'message': 'Constraints identified',
-                'data': {'constraints': constraints}
-            })
-
-            # Solution generation
-            yield format_sse({
-                'status': 'solving',
-                'message': 'Generating potential solutions...'
-            })
-            solutions = agent.generate_solutions(case_description)
-            yield format_sse({
-                'status': 'solving',
-                'message': 'Solutions generated',
-                'data': {'solutions': solutions}
-            })
+            # The four independent steps run concurrently and report as each completes;
+            # in one-shot mode they arrive field by field from a single call
+            for status, started, _ in STEP_MESSAGES.values():
+                yield format_sse({
+                    'status': status,
+                    'message': started
+                })
+            results = {}
+            for key, value in agent.iter_case_results(case_description, mode, user_id):
+                results[key] = value
+                if key == 'recommendation':
+                    continue
+                status, _, finished = STEP_MESSAGES[key]
+                yield format_sse({
+                    'status': status,
+                    'message': finished,
+                    'data': {key: value}
+                })
+                # The recommendation starts as soon as the solutions are in
+                if key == 'solutions' and 'recommendation' not in results:
+                    yield format_sse({
+                        'status': 'recommending',
+                        'message': 'Formulating final recommendation...'
+                    })
+            recommendation = results['recommendation']
 
-            # Recommendation
-            yield format_sse({
-                'status': 'recommending',
-                'message': 'Formulating final recommendation...'
-            })
-            recommendation = agent.formulate_recommendation(solutions)
             yield format_sse({
                 'status': 'complete',
                 'message': 'Analysis complete',
@@ -124,13 +176,24 @@ def get_case_results():
                 'success': False
             }), 401
             
-        token = auth_header.split(' ')[1]
-        # TODO: Get user_id from token
-        
-        # For now, return empty results
+        user_id = get_request_user_id()
+        if not user_id:
+            return jsonify({
+                'error': 'Invalid or expired token',
+                'success': False
+            }), 401
+
+        store = get_case_store()
+        requested_hash = request.args.get('case_hash')
+        if requested_hash:
+            record = store.get(user_id, requested_hash)
+            results = [record] if record else []
+        else:
+            results = store.list_results(user_id, limit=min(request.args.get('limit', RESULT_LIMIT, type=int), RESULT_LIMIT))
+
         return jsonify({
             'success': True,
-            'results': []
+            'results': results
         })
     except Exception as e:
         print(f"Error in get_case_results: {str(e)}")
@@ -153,6 +216,12 @@ def stream_case_solution():
             
         case_text = data['case_text']
 
+        mode = data.get('mode', 'pipeline')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown analysis mode: {mode}'}), 400
+        # Signed-in users get their stored results back instead of a rerun
+        user_id = get_request_user_id()
+
         def generate():
             try:
                 # Initial status
@@ -161,56 +230,38 @@ def stream_case_solution():
                     'content': 'Starting business case analysis...'
                 })
 
-                # Problem identification
-                yield format_sse({
-                    'type': 'stream',
-                    'content': 'Identifying core business problem...'
-                })
-                problem_statement = agent.identify_problem(case_text)
-                yield format_sse({
-                    'type': 'stream',
-                    'content': f'Problem identified: {problem_statement}'
-                })
-
-                # Key factors analysis
-                yield format_sse({
-                    'type': 'stream',
-                    'content': 'Analyzing key factors...'
-                })
-                key_factors = agent.analyze_key_factors(case_text)
-                yield format_sse({
-                    'type': 'stream',
-                    'content': f'Key factors analyzed: {", ".join(key_factors)}'
-                })
-
-                # Constraints analysis
-                yield format_sse({
-                    'type': 'stream',
-                    'content': 'Identifying constraints...'
-                })
-                constraints = agent.identify_constraints(case_text)
-                yield format_sse({
-                    'type': 'stream',
-                    'content': f'Constraints identified: {", ".join(constraints)}'
-                })
-
-                # Solution generation
-                yield format_sse({
-                    'type': 'stream',
-                    'content': 'Generating potential solutions...'
-                })
-                solutions = agent.generate_solutions(case_text)
-                yield format_sse({
-                    'type': 'stream',
-                    'content': f'Generated {len(solutions)} potential solutions'
-                })
-
-                # Recommendation
-                yield format_sse({
-                    'type': 'stream',
-                    'content': 'Formulating final recommendation...'
-                })
-                recommendation = agent.formulate_recommendation(solutions)
+                # The four independent steps run concurrently and report as each completes;
+                # in one-shot mode they arrive field by field from a single call
+                for _, started, _ in STEP_MESSAGES.values():
+                    yield format_sse({
+                        'type': 'stream',
+                        'content': started
+                    })
+                results = {}
+                for event, key, value in agent.iter_case_events(case_text, mode, user_id):
+                    # Steps stream their text and complete items while they run
+                    if event != 'result':
+                        yield format_step_event(event, key, value)
+                        continue
+                    results[key] = value
+                    if key == 'recommendation':
+                        continue
+                    yield format_sse({
+                        'type': 'stream',
+                        'content': describe_step_result(key, value)
+                    })
+                    # The recommendation starts as soon as the solutions are in
+                    if key == 'solutions' and 'recommendation' not in results:
+                        yield format_sse({
+                            'type': 'stream',
+                            'content': 'Formulating final recommendation...'
+                        })
+                problem_statement = results['problem_statement']
+                key_factors = results['key_factors']
+                constraints = results['constraints']
+                solutions = results['solutions']
+
+                recommendation = results['recommendation']
 
                 # Final structured response
                 structured_response = {
@@ -249,7 +300,8 @@ def stream_case_solution():
                 print(traceback.format_exc())
                 yield format_sse({
                     'type': 'error',
-                    'content': str(e)
+                    'content': str(e),
+                    **error_event_fields(e)
                 })
 
         return Response(
@@ -269,6 +321,205 @@ def stream_case_solution():
             'success': False
         }), 500
 
+@business_case_bp.route('/edit', methods=['POST'])
+def edit_case():
+    """
+    Re-analyze a stored case after the user edits it.
+
+    The body names the base case by case_hash (a stored result) or case_text,
+    and carries edits: a new case_text and/or replacement step results, e.g.
+    edited solutions. Only the steps whose inputs changed are recomputed; each
+    step streams as a content event with its source ("edited", "reused" or
+    "computed").
+    """
+    try:
+        user_id = get_request_user_id()
+        if not user_id:
+            return jsonify({
+                'error': 'Sign in to edit stored cases',
+                'success': False
+            }), 401
+
+        data = request.get_json() or {}
+        edits = dict(data.get('edits') or {})
+        case_text = edits.pop('case_text', None) or data.get('case_text')
+        if not case_text and data.get('case_hash'):
+            record = get_case_store().get(user_id, data['case_hash'])
+            if not record:
+                return jsonify({
+                    'error': 'Case not found',
+                    'success': False
+                }), 404
+            case_text = record['case_text']
+        if not case_text:
+            return jsonify({
+                'error': 'Case text or case hash is required',
+                'success': False
+            }), 400
+        unknown = [key for key in edits if key not in STEP_MESSAGES and key != 'recommendation']
+        if unknown:
+            return jsonify({'error': f'Unknown edits: {", ".join(unknown)}'}), 400
+
+        def generate():
+            try:
+                results = {}
+                computed = []
+                for key, value, source in agent.iter_edited_case(case_text, edits, user_id):
+                    results[key] = value
+                    if source == 'computed':
+                        computed.append(key)
+                    yield format_sse({
+                        'type': 'content',
+                        'section': key,
+                        'source': source,
+                        'content': json.dumps(value)
+                    })
+
+                yield format_sse({
+                    'type': 'complete',
+                    'case_hash': case_hash(case_text, agent.edited_result_version(edits)),
+                    'recomputed': computed,
+                    'analysis': results
+                })
+            except Exception as e:
+                print(f"Error in edit generate: {str(e)}")
+                print(traceback.format_exc())
+                yield format_sse({
+                    'type': 'error',
+                    'content': str(e),
+                    **error_event_fields(e)
+                })
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except Exception as e:
+        print(f"Error in edit_case endpoint: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 500
+
+def get_user_batch(batch_id):
+    """The signed-in user's batch, or an error response."""
+    user_id = get_request_user_id()
+    if not user_id:
+        return None, (jsonify({'error': 'Sign in to run batches', 'success': False}), 401)
+    batch = batch_queue.get(user_id, batch_id)
+    if not batch:
+        return None, (jsonify({'error': 'Batch not found', 'success': False}), 404)
+    return batch, None
+
+@business_case_bp.route('/batch', methods=['POST'])
+def submit_batch():
+    """
+    Queue many cases for analysis.
+
+    The body carries cases, each a case text or {"case_text", "case_id"}, and
+    an optional mode. Results are read from /batch/<batch_id>/stream as each
+    case finishes.
+    """
+    try:
+        user_id = get_request_user_id()
+        if not user_id:
+            return jsonify({'error': 'Sign in to run batches', 'success': False}), 401
+
+        data = request.get_json() or {}
+        mode = data.get('mode', 'pipeline')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown analysis mode: {mode}'}), 400
+        cases = [
+            {'case_text': case} if isinstance(case, str) else case
+            for case in data.get('cases') or []
+        ]
+        try:
+            batch = batch_queue.submit(user_id, cases, mode)
+        except ValueError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
+
+        return jsonify({'success': True, **batch.summary()}), 202
+    except Exception as e:
+        print(f"Error in submit_batch endpoint: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 500
+
+@business_case_bp.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Status of every case in a batch, with the results finished so far."""
+    batch, error = get_user_batch(batch_id)
+    if error:
+        return error
+    with batch.cond:
+        cases = [
+            {
+                'index': case['index'],
+                'case_id': case['case_id'],
+                'status': case['status'],
+                'analysis': batch.results.get(case['index']),
+                'error': batch.errors.get(case['index'])
+            }
+            for case in batch.cases
+        ]
+        summary = batch.summary()
+    return jsonify({'success': True, **summary, 'cases': cases})
+
+@business_case_bp.route('/batch/<batch_id>/stream', methods=['GET'])
+def stream_batch(batch_id):
+    """
+    Stream a batch's case results as they finish.
+
+    Events already sent are skipped on reconnect, using Last-Event-ID or ?after=.
+    """
+    batch, error = get_user_batch(batch_id)
+    if error:
+        return error
+    after = request.headers.get('Last-Event-ID', request.args.get('after', '-1'))
+    try:
+        after = max(0, int(after) + 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid event ID'}), 400
+
+    def generate():
+        for position, event in batch.stream(after, heartbeat=RUN_HEARTBEAT_SECONDS):
+            yield format_run_event(position, event)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@business_case_bp.route('/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    """Skip a batch's queued cases and stop its running ones after their current step."""
+    batch, error = get_user_batch(batch_id)
+    if error:
+        return error
+    batch_queue.cancel(batch)
+    return jsonify({'success': True, **batch.summary()})
+
+@business_case_bp.route('/batch/<batch_id>/resume', methods=['POST'])
+def resume_batch(batch_id):
+    """Queue a batch's cancelled and failed cases again, reusing the steps they already finished."""
+    batch, error = get_user_batch(batch_id)
+    if error:
+        return error
+    queued = batch_queue.resume(batch)
+    return jsonify({'success': True, 'requeued': queued, **batch.summary()})
+
 @business_case_bp.route('/chat', methods=['POST'])
 def chat():
     """Handle chat-like interactions for business case analysis."""
@@ -279,76 +530,61 @@ def chat():
         if not query:
             return jsonify({'error': 'No query provided'}), 400
 
-        def generate():
+        mode = data.get('mode', 'pipeline')
+        if mode not in ANALYSIS_MODES:
+            return jsonify({'error': f'Unknown analysis mode: {mode}'}), 400
+        # Signed-in users get their stored results back instead of a rerun
+        user_id = get_request_user_id()
+
+        def chat_events():
+            results = {}
             try:
                 # Initial status
-                yield format_sse({
+                yield {
                     'type': 'status',
                     'content': 'Starting business case analysis...'
-                })
-
-                # Problem identification
-                yield format_sse({
-                    'type': 'status',
-                    'content': 'Identifying core business problem...'
-                })
-                problem_statement = agent.identify_problem(query)
-                yield format_sse({
-                    'type': 'content',
-                    'section': 'problem_statement',
-                    'content': json.dumps(problem_statement)
-                })
-
-                # Key factors analysis
-                yield format_sse({
-                    'type': 'status',
-                    'content': 'Analyzing key factors...'
-                })
-                key_factors = agent.analyze_key_factors(query)
-                yield format_sse({
-                    'type': 'content',
-                    'section': 'key_factors',
-                    'content': json.dumps(key_factors)
-                })
+                }
 
-                # Constraints analysis
-                yield format_sse({
-                    'type': 'status',
-                    'content': 'Identifying constraints...'
-                })
-                constraints = agent.identify_constraints(query)
-                yield format_sse({
-                    'type': 'content',
-                    'section': 'constraints',
-                    'content': json.dumps(constraints)
-                })
+                # The four independent steps run concurrently and report as each completes;
+                # in one-shot mode they arrive field by field from a single call
+                for _, started, _ in STEP_MESSAGES.values():
+                    yield {
+                        'type': 'status',
+                        'content': started
+                    }
+                for event, key, value in agent.iter_case_events(query, mode, user_id):
+                    # Steps stream their text and complete items while they run
+                    if event != 'result':
+                        yield step_event(event, key, value)
+                        continue
+                    results[key] = value
+                    if key == 'recommendation':
+                        continue
+                    yield {
+                        'type': 'content',
+                        'section': key,
+                        'content': json.dumps(value)
+                    }
+                    # The recommendation starts as soon as the solutions are in
+                    if key == 'solutions' and 'recommendation' not in results:
+                        yield {
+                            'type': 'status',
+                            'content': 'Formulating final recommendation...'
+                        }
+                problem_statement = results['problem_statement']
+                key_factors = results['key_factors']
+                constraints = results['constraints']
+                solutions = results['solutions']
 
-                # Solution generation
-                yield format_sse({
-                    'type': 'status',
-                    'content': 'Generating potential solutions...'
-                })
-                solutions = agent.generate_solutions(query)
-                yield format_sse({
-                    'type': 'content',
-                    'section': 'solutions',
-                    'content': json.dumps(solutions)
-                })
-
-                # Recommendation
-                yield format_sse({
-                    'type': 'status',
-                    'content': 'Formulating final recommendation...'
-                })
-                recommendation = agent.formulate_recommendation(solutions)
-                yield format_sse({
+                recommendation = results['recommendation']
+                yield {
                     'type': 'content',
                     'section': 'recommendation',
                     'content': json.dumps(recommendation)
-                })
+                }
 
                 # Final complete message
-                yield format_sse({
+                yield {
                     'type': 'final',
                     'content': {
                         'content': {
@@ -372,16 +608,40 @@ def chat():
                             }
                         ]
                     }
-                })
+                }
+
+            except DeadlineExceeded:
+                # Out of time: return the steps that finished
+                logger.warning(f"Business case analysis ran out of time with {len(results)} steps done")
+                yield {
+                    'type': 'final',
+                    'content': {
+                        'content': {
+                            'sections': [
+                                {'title': title, 'content': results[key]}
+                                for key, title in SECTION_TITLES.items() if key in results
+                            ]
+                        },
+                        'outputs': []
+                    },
+                    'partial': True
+                }
 
             except Exception as e:
                 print(f"Error in chat stream: {str(e)}")
-                yield format_sse({
+                yield {
                     'type': 'error',
-                    'content': str(e)
-                })
+                    'content': str(e),
+                    **error_event_fields(e)
+                }
 
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        # Closing the tab cancels the analysis, unless the client asked to be able to resume it
+        # from /api/runs/<run_id>/stream
+        with deadline_scope(Deadline.for_request(data.get('deadline_seconds'))):
+            run = get_run_manager().start(
+                'business_case_chat', user_id, chat_events, resumable=bool(data.get('resumable'))
+            )
+        return run_stream_response(run)
 
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
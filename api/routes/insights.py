@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from ..services.insights_service import InsightsService
 from ..utils import run_async
+from models.single_flight import get_single_flight, make_key
 import traceback
 import logging
 from functools import wraps
@@ -8,6 +9,9 @@ from functools import wraps
 insights_bp = Blueprint('insights', __name__)
 insights_service = InsightsService()
 
+# Identical insights requests in flight at the same time share one computation
+insights_flight = get_single_flight('insights')
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
@@ -44,7 +48,10 @@ def get_unified_insights():
             }), 400
 
         # Get unified insights
-        insights = run_async(insights_service.get_unified_insights(user_id))
+        insights = insights_flight.do(
+            make_key('insights.unified', user_id=user_id),
+            lambda: run_async(insights_service.get_unified_insights(user_id))
+        )
         
         return jsonify({
             'error': False,
@@ -62,7 +69,10 @@ def get_unified_insights():
 def get_market_overview():
     """Get market overview data"""
     try:
-        market_data = run_async(insights_service._get_market_overview())
+        market_data = insights_flight.do(
+            make_key('insights.market_overview'),
+            lambda: run_async(insights_service._get_market_overview())
+        )
         return jsonify({
             'error': False,
             'data': market_data
@@ -86,7 +96,10 @@ def get_document_insights():
                 'message': 'User ID is required'
             }), 400
 
-        doc_insights = run_async(insights_service._get_document_insights(user_id))
+        doc_insights = insights_flight.do(
+            make_key('insights.documents', user_id=user_id),
+            lambda: run_async(insights_service._get_document_insights(user_id))
+        )
         return jsonify({
             'error': False,
             'data': doc_insights
@@ -110,7 +123,10 @@ def get_ai_insights():
                 'message': 'User ID is required'
             }), 400
 
-        ai_insights = run_async(insights_service._get_ai_insights(user_id))
+        ai_insights = insights_flight.do(
+            make_key('insights.ai', user_id=user_id),
+            lambda: run_async(insights_service._get_ai_insights(user_id))
+        )
         return jsonify({
             'error': False,
             'data': ai_insights
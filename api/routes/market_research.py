@@ -1,6 +1,10 @@
-from flask import Blueprint, request, jsonify, Response, stream_with_context
-from models.market_research_agent import MarketResearchAgent
-import json
+from flask import Blueprint, request, jsonify, Response
+from models.market_research_agent import MarketResearchAgent, RESEARCH_MODES, HISTORY_CONTEXT_MESSAGES
+from models.session_history import get_session_history
+from models.single_flight import get_single_flight, make_key
+from models.run_log import get_run_manager
+from models.deadline import Deadline, deadline_scope
+from api.routes.runs import run_stream_response
 import traceback
 import logging
 from functools import wraps
@@ -11,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 market_research_bp = Blueprint('market_research', __name__)
 
+# Identical research requests in flight at the same time share one agent run
+research_flight = get_single_flight('market_research')
+
 def handle_api_error(f):
     """Decorator to handle API errors consistently."""
     @wraps(f)
@@ -58,38 +65,61 @@ def conduct_research():
             
         query = data['query']
         user_id = data.get('user_id')
+        thread_id = data.get('thread_id')
+        mode = data.get('mode', 'tools')
+        if mode not in RESEARCH_MODES:
+            return jsonify({
+                'status': 'error',
+                'message': f'Unknown research mode: {mode}'
+            }), 400
+
+        deadline_seconds = data.get('deadline_seconds')
+        # Only requests with the same recent history and deadline can share a run
+        chat_history = get_session_history().get(user_id, thread_id, limit=HISTORY_CONTEXT_MESSAGES)
 
-        def generate():
+        def research_events():
             try:
-                for chunk in agent.research_stream(query):
+                chunks = research_flight.stream(
+                    make_key('market_research', query=query, mode=mode, deadline=deadline_seconds,
+                             history=[(msg['role'], msg['content']) for msg in chat_history]),
+                    lambda: agent.research_stream(query, mode, chat_history)
+                )
+                for chunk in chunks:
                     if chunk.get('status') == 'error':
-                        yield f"data: {json.dumps(chunk)}\n\n"
+                        yield chunk
                         return
+                    if chunk.get('status') == 'complete':
+                        answer = chunk.get('content', '')
+                        if answer.startswith('Final Answer: '):
+                            answer = answer[len('Final Answer: '):]
+                        agent.record_exchange(user_id, thread_id, query, answer)
                     
-                    # Add metadata to each chunk
+                    # Add metadata to each chunk (copied, chunks are shared between subscribers)
+                    chunk = dict(chunk)
                     chunk['metadata'] = {
                         'timestamp': chunk.get('timestamp'),
                         'user_id': user_id,
                         'query': query
                     }
                     
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield chunk
             except Exception as e:
-                error_data = {
+                yield {
                     'status': 'error',
                     'type': 'error',
                     'message': str(e),
                     'traceback': traceback.format_exc()
                 }
-                yield f"data: {json.dumps(error_data)}\n\n"
 
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
+        # Closing the tab cancels the run, unless the client asked to be able to resume it
+        # from /api/runs/<run_id>/stream
+        with deadline_scope(Deadline.for_request(deadline_seconds)):
+            run = get_run_manager().start('market_research', user_id, research_events,
+                                          resumable=bool(data.get('resumable')))
+
+        return run_stream_response(
+            run,
             headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type'
@@ -123,7 +153,7 @@ def get_history():
     Endpoint to retrieve chat history with enhanced metadata
     """
     try:
-        history = agent.get_chat_history()
+        history = agent.get_chat_history(request.args.get('user_id'), request.args.get('thread_id'))
         return jsonify({
             'status': 'success',
             'history': history,
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
 from models.multi_agent_model import ResearchAssistantSystem
 from config.settings import ANTHROPIC_API_KEY
+from models.circuit_breaker import error_event_fields
+from models.run_log import get_run_manager
+from models.deadline import Deadline, deadline_scope
+from api.routes.runs import run_stream_response
 import json
 import logging
 from functools import wraps
@@ -79,7 +83,7 @@ def get_answer():
                 
             except Exception as e:
                 logger.error(f"Error generating response: {str(e)}")
-                error_response = {"type": "error", "content": str(e)}
+                error_response = {"type": "error", "content": str(e), **error_event_fields(e)}
                 yield f"data: {json.dumps(error_response)}\n\n"
             
             # Send end message
@@ -110,6 +114,7 @@ def chat():
         query = data['query']
         chat_history = data.get('chat_history', [])
         user_id = data.get('user_id', 'anonymous')
+        thread_id = data.get('thread_id')
 
         logger.info(f"Received query: {query}")
         logger.info(f"Chat history length: {len(chat_history) if chat_history else 0}")
@@ -117,41 +122,41 @@ def chat():
         if not research_system:
             return jsonify({"error": "Research assistant system not initialized"}), 500
 
-        def generate():
+        # Clients that do not send their history get the session's stored history
+        if not chat_history:
+            chat_history = research_system.get_chat_history(user_id, thread_id)
+
+        def chat_events():
             try:
                 # Initial status
-                yield f"data: {json.dumps({'type': 'status', 'content': 'Starting research design...'})}\n\n"
+                yield {'type': 'status', 'content': 'Starting research design...'}
 
                 # Use the research_stream method to get a comprehensive research design
                 for chunk in research_system.research_stream(query, chat_history):
                     if chunk:
+                        if chunk.get('type') == 'final':
+                            research_system.record_exchange(user_id, thread_id, query, chunk['content']['sections'])
                         # Log the chunk type for debugging
                         logger.info(f"Processing chunk type: {chunk.get('type')}")
                         
                         # Send the chunk directly - the model now returns properly formatted data
-                        sse_data = f"data: {json.dumps(chunk)}\n\n"
-                        logger.info(f"Sending SSE data: {sse_data[:100]}...")
-                        yield sse_data
+                        yield chunk
                 
                 # Send end message
                 logger.info("Sending [DONE] message")
-                yield "data: [DONE]\n\n"
+                yield "[DONE]"
                 
             except Exception as e:
                 logger.error(f"Error generating response: {str(e)}")
-                error_response = {"type": "error", "content": str(e)}
-                yield f"data: {json.dumps(error_response)}\n\n"
-                yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+                yield {"type": "error", "content": str(e), **error_event_fields(e)}
+                yield "[DONE]"
+
+        # Closing the tab cancels the run, unless the client asked to be able to resume it
+        # from /api/runs/<run_id>/stream
+        with deadline_scope(Deadline.for_request(data.get('deadline_seconds'))):
+            run = get_run_manager().start('multi_agent_chat', data.get('user_id'), chat_events,
+                                          resumable=bool(data.get('resumable')))
+        return run_stream_response(run)
     except Exception as e:
         logger.error(f"Error in chat route: {str(e)}")
         return jsonify({"error": str(e)}), 500
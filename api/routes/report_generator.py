@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, request, jsonify, Response
 from models.agent_teams import create_report_generator
-from langchain_anthropic import ChatAnthropic
-import json
+from models.llm_client import create_llm
+from models.run_log import get_run_manager
+from api.routes.runs import run_stream_response
 import traceback
 from supabase import create_client
 import os
@@ -10,7 +11,7 @@ from datetime import datetime
 report_generator_bp = Blueprint('report_generator', __name__)
 
 # Initialize the LLM and report generator
-llm = ChatAnthropic(
+llm = create_llm(
     model="claude-3-sonnet-20240229",
     anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
     temperature=0.7,
@@ -55,7 +56,7 @@ def generate_report():
             raise ValueError("Failed to create report record")
         report_id = result.data[0]['id']
 
-        def generate():
+        def report_events():
             try:
                 # Stream the report generation process with better recursion handling
                 for state in report_generator.stream(
@@ -83,7 +84,7 @@ def generate_report():
                         }
                         
                         # Send both the content and status message
-                        yield f"data: {json.dumps({'content': last_message, 'status': status_message, 'report_id': report_id})}\n\n"
+                        yield {'content': last_message, 'status': status_message, 'report_id': report_id}
                         
                         # Update report status in Supabase
                         try:
@@ -125,7 +126,7 @@ def generate_report():
                 error_message = f"Error during report generation: {str(e)}"
                 print(error_message)
                 print(traceback.format_exc())
-                yield f"data: {json.dumps({'error': error_message, 'report_id': report_id})}\n\n"
+                yield {'error': error_message, 'report_id': report_id}
                 
                 # Update report status to error
                 try:
@@ -136,15 +137,10 @@ def generate_report():
                 except Exception as update_error:
                     print(f"Error updating report error status: {str(update_error)}")
 
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+        # The run outlives this response, so a client that drops can reconnect to /api/runs/<run_id>/stream
+        # Reports are saved as they are written, so generation carries on for a while without a client
+        run = get_run_manager().start('report_generation', None, report_events, resumable=True)
+        return run_stream_response(run)
 
     except Exception as e:
         error_message = f"Error initiating report generation: {str(e)}"
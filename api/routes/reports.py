@@ -15,7 +15,7 @@ import io
 import json
 import logging
 import uuid
-from langchain_anthropic import ChatAnthropic
+from models.llm_client import create_llm
 from langchain.schema import HumanMessage
 
 # Load environment variables
@@ -54,7 +54,7 @@ except Exception as e:
     logger.warning(f"Could not set directory permissions: {str(e)}")
 
 # Initialize LLM
-llm = ChatAnthropic(
+llm = create_llm(
     model="claude-3-sonnet-20240229",
     anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
     temperature=0.7,
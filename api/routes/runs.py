@@ -0,0 +1,76 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from models.run_log import get_run_manager, Run, RUN_HEARTBEAT_SECONDS
+import json
+import logging
+from typing import Any, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+runs_bp = Blueprint('runs', __name__)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Expose-Headers': 'X-Run-ID'
+}
+
+
+def format_run_event(position: Optional[int], event: Any) -> str:
+    """Format a run event as SSE, with its position as the event ID. Strings are sent as they are."""
+    if position is None:
+        return ": keep-alive\n\n"
+    data = event if isinstance(event, str) else json.dumps(event)
+    return f"id: {position}\ndata: {data}\n\n"
+
+
+def run_stream_response(run: Run, after: int = 0, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Stream a run's events from position `after` as SSE."""
+    def generate():
+        for position, event in run.stream(after, heartbeat=RUN_HEARTBEAT_SECONDS):
+            yield format_run_event(position, event)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={**SSE_HEADERS, 'X-Run-ID': run.id, **(headers or {})}
+    )
+
+
+def get_user_run(run_id: str):
+    """Look up a run for the caller, returning (run, None) or (None, error response)."""
+    run = get_run_manager().get(run_id)
+    # Runs started for a user are only shown to that user
+    if run is None or (run.user_id and request.args.get('user_id') != run.user_id):
+        return None, (jsonify({'status': 'error', 'message': 'Run not found'}), 404)
+    return run, None
+
+
+@runs_bp.route('/<run_id>', methods=['GET'])
+def get_run(run_id):
+    """A run's status and how many events it has produced."""
+    run, error = get_user_run(run_id)
+    if error:
+        return error
+    return jsonify({'status': 'success', 'run': run.summary()})
+
+
+@runs_bp.route('/<run_id>/stream', methods=['GET'])
+def stream_run(run_id):
+    """
+    Reconnect to a run's event stream.
+
+    Events already received are skipped using Last-Event-ID or ?after=, then
+    the stream continues live until the run finishes.
+    """
+    run, error = get_user_run(run_id)
+    if error:
+        return error
+    after = request.headers.get('Last-Event-ID', request.args.get('after', '-1'))
+    try:
+        after = max(0, int(after) + 1)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid event ID'}), 400
+    logger.info(f"Client reconnected to run {run_id} from event {after}")
+    return run_stream_response(run, after)
@@ -5,8 +5,8 @@ import uuid
 from datetime import datetime
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_cohere import CohereEmbeddings
 from langchain_anthropic import ChatAnthropic
+from models.llm_client import create_embeddings
 from langchain.prompts import ChatPromptTemplate
 from supabase import create_client, Client
 
@@ -51,7 +51,7 @@ class DocumentService:
         # Set auth header explicitly for all requests
         self.supabase.postgrest.auth(self.supabase_service_key)
         
-        self.embeddings = CohereEmbeddings(
+        self.embeddings = create_embeddings(
             cohere_api_key=self.cohere_api_key,
             model="embed-multilingual-v3.0"
         )
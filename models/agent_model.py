@@ -1,9 +1,13 @@
 import time
 import os
 import json
-from langchain_anthropic import ChatAnthropic
+from models.llm_client import create_llm
 from config.settings import ANTHROPIC_API_KEY
 from config.supabase_client import supabase
+from models.token_budget import get_history_budget, trim_chat_history
+from models.conversation_memory import ConversationSummaryMemory
+from models.circuit_breaker import CircuitOpenError
+from models.telemetry import llm_step
 from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader,
     UnstructuredExcelLoader,
@@ -14,7 +18,7 @@ from langchain_community.document_loaders import (
 class ConsultantAgent:
     def __init__(self):
         # Initialize the ChatAnthropic model and pass API key explicitly
-        self.llm = ChatAnthropic(
+        self.llm = create_llm(
             model="claude-3-5-sonnet-20240620",
             temperature=0,
             max_tokens=4096,  # Increased for better context handling
@@ -22,6 +26,9 @@ class ConsultantAgent:
         )
         self.docs = []  # Initialize empty docs list
 
+        # Rolling per-thread summary of older turns, updated in the background
+        self.memory = ConversationSummaryMemory()
+
         # Enhanced system prompt to handle chat history
         self.system_prompt = """You are an expert business consultant with deep expertise in various business domains. Your role is to provide focused, actionable insights based on the specific needs of your client.
 
@@ -96,18 +103,25 @@ class ConsultantAgent:
             # Continue execution even if saving fails
             pass
 
-    def format_chat_history(self, chat_history):
-        """Format chat history for the prompt."""
-        if not chat_history:
+    def format_chat_history(self, chat_history, budget=None, summary=""):
+        """Format chat history for the prompt, trimmed to the route's token budget."""
+        if not chat_history and not summary:
             return "No previous conversation."
             
+        if budget is None:
+            budget = get_history_budget("consultant")
+        chat_history = trim_chat_history(chat_history, budget)
+            
         formatted_history = []
+        if summary:
+            formatted_history.append(f"Summary of earlier conversation: {summary}\n")
         for msg in chat_history:
             role = "User" if msg["role"] == "user" else "Assistant"
             formatted_history.append(f"{role}: {msg['content']}")
         
         return "\n".join(formatted_history)
 
+    @llm_step()
     def get_answer(self, query, user_id=None, chat_history=None, thread_id="default", context=""):
         """
         Enhanced method to answer user queries with chat history context.
@@ -131,8 +145,9 @@ class ConsultantAgent:
             if not isinstance(chat_history, list):
                 raise ValueError("Chat history must be a list")
             
-            # Format the chat history
-            formatted_history = self.format_chat_history(chat_history)
+            # Older turns are folded into a per-thread summary, recent ones stay verbatim
+            summary, recent_history = self.memory.get_context(f"{user_id}:{thread_id}", chat_history)
+            formatted_history = self.format_chat_history(recent_history, summary=summary)
             
             # Prepare the full context
             full_context = context if context else "\n".join([doc.page_content for doc in self.docs])
@@ -187,6 +202,9 @@ class ConsultantAgent:
                         "outputs": [structured_response]
                     }
                     
+                except CircuitOpenError:
+                    # The upstream is known to be down, retrying would only add latency
+                    raise
                 except Exception as e:
                     last_error = e
                     retry_count += 1
@@ -203,6 +221,7 @@ class ConsultantAgent:
             print(f"Error in get_answer: {str(e)}")
             raise
 
+    @llm_step()
     def get_advice(self, query, user_id=None, thread_id="default"):
         """
         Method to get advice based on the user's query.
@@ -1,7 +1,6 @@
 import os
 from typing import List, Dict, Any
-from langchain_anthropic import ChatAnthropic
-from langchain_cohere import CohereEmbeddings
+from models.llm_client import create_llm, create_embeddings
 from langchain.vectorstores.supabase import SupabaseVectorStore
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
@@ -42,7 +41,7 @@ class AgentService:
             
             # Initialize embeddings with error handling
             try:
-                self.embeddings = CohereEmbeddings(
+                self.embeddings = create_embeddings(
                     cohere_api_key=self.cohere_api_key,
                     model="embed-multilingual-v3.0"
                 )
@@ -51,7 +50,7 @@ class AgentService:
             
             # Initialize LLM with error handling
             try:
-                self.llm = ChatAnthropic(
+                self.llm = create_llm(
                     model="claude-3-5-sonnet-20240620",
                     anthropic_api_key=self.anthropic_api_key,
                     temperature=0,
@@ -1,19 +1,20 @@
 from typing import List, Optional, Literal, Dict, Any, TypedDict
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import HumanMessage, BaseMessage
-from langchain_community.utilities import SerpAPIWrapper
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_experimental.utilities import PythonREPL
 from langgraph.graph import StateGraph, MessagesState, START, END
 from langgraph.types import Command
 from langchain_core.tools import tool
+from models.search_tools import run_search_for_agent
+from models.observation_compressor import compress_observation, observation_focus
+from models.model_router import ModelRouter
 from pathlib import Path
 from tempfile import TemporaryDirectory
 import os
 import json
 
 # Initialize tools
-search = SerpAPIWrapper()
 _TEMP_DIRECTORY = TemporaryDirectory()
 WORKING_DIRECTORY = Path(_TEMP_DIRECTORY.name)
 repl = PythonREPL()
@@ -26,7 +27,7 @@ class Router(TypedDict):
 def search_web(query: str) -> str:
     """Search the web for information about a topic."""
     try:
-        results = search.run(query)
+        results = run_search_for_agent(query)
         return results
     except Exception as e:
         return f"Error performing web search: {str(e)}"
@@ -36,9 +37,10 @@ def scrape_webpages(urls: List[str]) -> str:
     """Use requests and bs4 to scrape the provided web pages for detailed information."""
     loader = WebBaseLoader(urls)
     docs = loader.load()
+    # Pages are long; keep what is relevant to the current research question
     return "\n\n".join(
         [
-            f'<Document name="{doc.metadata.get("title", "")}">\n{doc.page_content}\n</Document>'
+            f'<Document name="{doc.metadata.get("title", "")}">\n{compress_observation(doc.page_content)}\n</Document>'
             for doc in docs
         ]
     )
@@ -116,8 +118,19 @@ def python_repl_tool(code: str) -> str:
 class State(MessagesState):
     next: str
 
-def make_supervisor_node(llm: BaseChatModel, team_members: List[str]):
-    """Create a supervisor node that routes tasks to team members."""
+def _is_routing_decision(team_members: List[str]):
+    """Build a validator for the supervisor's JSON routing decision."""
+    def validate(response) -> bool:
+        decision = json.loads(response.content)
+        return decision.get("is_complete", False) or decision.get("next") in team_members
+    return validate
+
+def make_supervisor_node(router: ModelRouter, team_members: List[str]):
+    """Create a supervisor node that routes tasks to team members.
+
+    The routing decision is a small JSON object, so it runs on the fast tier
+    and only escalates when the output does not parse or names an unknown member.
+    """
     def supervisor_node(state: State) -> Command[Literal["supervisor"]]:
         messages = state["messages"]
         last_message = messages[-1].content
@@ -188,7 +201,12 @@ def make_supervisor_node(llm: BaseChatModel, team_members: List[str]):
 
         print(f"\n[Supervisor] Analyzing request and deciding next steps...")
         # Get the LLM's decision
-        response = llm.invoke(prompt)
+        response = router.invoke(
+            prompt,
+            step="supervisor",
+            tier="fast",
+            validate=_is_routing_decision(team_members)
+        )
         decision = json.loads(response.content)
         
         print(f"[Supervisor] Decision: {decision['reason']}")
@@ -228,7 +246,8 @@ def create_research_team(llm: BaseChatModel):
 
     def research_node(state: State) -> Command[Literal[END]]:
         print("\n[Researcher] Gathering key information...")
-        result = research_agent.invoke(state)
+        with observation_focus(str(state["messages"][-1].content)):
+            result = research_agent.invoke(state)
         print(f"[Researcher] Research completed: {result['messages'][-1].content[:100]}...")
         return Command(
             update={
@@ -1,14 +1,24 @@
-from typing import Dict, List, Any, Generator
-from langchain_anthropic import ChatAnthropic
+from typing import Dict, List, Any, Generator, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+from models.model_router import ModelRouter
+from models.telemetry import llm_step
+from models.case_analysis import CaseAnalysis, iter_completed_fields
+from models.case_store import get_case_store, case_hash
+from models.case_graph import CaseGraph, node_input_hash
+from models.cancellation import check_cancelled
+from models.deadline import DeadlineExceeded, check_deadline, sleep_within_deadline
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.tools import Tool
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+import contextvars
+import hashlib
 import json
 import os
+import queue
 from dotenv import load_dotenv
-import time
 import logging
 from anthropic._exceptions import OverloadedError, RateLimitError, APIError
 import requests
@@ -18,10 +28,86 @@ import re
 # Configure logging
 logger = logging.getLogger(__name__)
 
+ONE_SHOT_PROMPT = """You are an expert business case analyst. Analyze the case in full and record the analysis with the CaseAnalysis tool:
+the core problem, the key factors influencing the case, its key constraints and limitations, 3 potential solutions
+with their pros, cons, implementation and timeline, and a final recommendation based on those solutions with its
+rationale, implementation plan, timeline and success metrics."""
+
+# Bump when prompts or parsing change, so stored results are recomputed
+CASE_AGENT_VERSION = "1"
+
+# Every result a case analysis produces, in report order
+RESULT_KEYS = ['problem_statement', 'key_factors', 'constraints', 'solutions', 'recommendation']
+
+# Threads shared by all cases for the steps that run concurrently
+CASE_STEP_WORKERS = int(os.getenv("BUSINESS_CASE_STEP_WORKERS", "16"))
+_step_executor = ThreadPoolExecutor(max_workers=CASE_STEP_WORKERS, thread_name_prefix="business-case-step")
+
+# Relay for the tokens of the step running in this context; every LLM call made
+# inside the context reports to it without the step having to pass callbacks
+_step_token_relay: contextvars.ContextVar[Optional[BaseCallbackHandler]] = contextvars.ContextVar(
+    "business_case_step_token_relay", default=None
+)
+register_configure_hook(_step_token_relay, inheritable=True)
+
+
+class StepTokenRelay(BaseCallbackHandler):
+    """Puts one step's streamed tokens on a queue as (event, result key, payload) tuples."""
+
+    run_inline = True
+
+    def __init__(self, key: str, events: queue.Queue):
+        self.key = key
+        self.events = events
+        self.started = False
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        # A retry or fallback streams the step again from the start
+        if self.started:
+            self.events.put(('reset', self.key, None))
+        self.started = True
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.events.put(('delta', self.key, token))
+
+
+class StepItemParser:
+    """Finds the items of a step's output that are already complete while it streams."""
+
+    def __init__(self, key: str, parse_solutions):
+        self.key = key
+        self.parse_solutions = parse_solutions
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.emitted = 0
+
+    def feed(self, token: str) -> List[Any]:
+        """
+        Add a token and return the items it completed.
+
+        Key factors and constraints are one item per line, complete at the line
+        break. A solution is complete when the next one starts.
+        """
+        self.buffer += token
+        if self.key in ('key_factors', 'constraints'):
+            lines = self.buffer.split('\n')[:-1]
+            items = [line.strip() for line in lines if line.strip()]
+        elif self.key == 'solutions':
+            items = self.parse_solutions(self.buffer)[:-1]
+        else:
+            return []
+        completed = items[self.emitted:]
+        self.emitted = len(items)
+        return completed
+
 def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
-    """Execute a function with exponential backoff retry logic."""
+    """Execute a function with exponential backoff retry logic, within the request deadline."""
     last_error = None
     for attempt in range(max_retries):
+        check_deadline()
         try:
             return func()
         except Exception as e:
@@ -43,7 +129,7 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
                         if attempt < max_retries - 1:
                             delay = min(base_delay * (2 ** attempt), max_delay)
                             logger.warning(f"Attempt {attempt + 1} failed with overload error. Retrying in {delay} seconds...")
-                            time.sleep(delay)
+                            sleep_within_deadline(delay)
                             continue
                         else:
                             raise Exception("The AI service is currently experiencing high demand. Please try again in a few moments.")
@@ -51,13 +137,15 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
                         if attempt < max_retries - 1:
                             delay = min(base_delay * (2 ** attempt), max_delay)
                             logger.warning(f"Attempt {attempt + 1} failed with rate limit error. Retrying in {delay} seconds...")
-                            time.sleep(delay)
+                            sleep_within_deadline(delay)
                             continue
                         else:
                             raise Exception("Rate limit exceeded. Please try again in a few moments.")
                     else:
                         logger.error(f"API Error: {error_message}")
                         raise Exception(error_message)
+                except DeadlineExceeded:
+                    raise
                 except Exception as parse_error:
                     logger.error(f"Error parsing API response: {str(parse_error)}")
                     logger.error(f"Raw response: {str(e)}")
@@ -69,14 +157,27 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
     if last_error:
         raise last_error
 
+def _has_list_items(response, minimum=2):
+    """Validate that a list-style step returned at least a few non-empty lines."""
+    return len([line for line in response.content.split('\n') if line.strip()]) >= minimum
+
 class BusinessCaseAgent:
+    # Steps that depend only on the case description, by result key
+    INDEPENDENT_STEPS = {
+        'problem_statement': 'identify_problem',
+        'key_factors': 'analyze_key_factors',
+        'constraints': 'identify_constraints',
+        'solutions': 'generate_solutions',
+    }
+
     def __init__(self):
         print("\n🔄 Initializing Business Case Agent...")
         
         # Initialize the language model with better error handling
         try:
-            self.llm = ChatAnthropic(
-                model="claude-3-5-sonnet-20240620",
+            # Steps pick a model tier; list-style steps start on the fast tier
+            self.router = ModelRouter(
+                "business_case",
                 anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
                 temperature=0.7,
                 streaming=True,
@@ -84,11 +185,13 @@ class BusinessCaseAgent:
                 timeout=60,
                 max_retries=3
             )
+            self.llm = self.router.get_llm("balanced")
             print("✅ LLM initialized")
         except Exception as e:
             logger.error(f"Failed to initialize LLM: {str(e)}")
             raise
 
+    @llm_step()
     def identify_problem(self, case_description):
         """Identify the core business problem from the case description."""
         def _call():
@@ -97,7 +200,7 @@ class BusinessCaseAgent:
                     SystemMessage(content="You are an expert business case analyst. Analyze the case and identify the core problem."),
                     HumanMessage(content=case_description)
                 ]
-                response = self.llm.invoke(messages)
+                response = self.llm.invoke(messages, hedge=True)
                 return response.content
             except Exception as e:
                 logger.error(f"Error in identify_problem: {str(e)}")
@@ -105,6 +208,7 @@ class BusinessCaseAgent:
         
         return retry_with_backoff(_call)
 
+    @llm_step()
     def analyze_key_factors(self, case_description):
         """Analyze key factors that influence the business case."""
         def _call():
@@ -113,7 +217,9 @@ class BusinessCaseAgent:
                     SystemMessage(content="You are an expert business case analyst. Analyze the key factors influencing this case."),
                     HumanMessage(content=case_description)
                 ]
-                response = self.llm.invoke(messages)
+                response = self.router.invoke(
+                    messages, step="analyze_key_factors", tier="fast", validate=_has_list_items
+                )
                 return [factor.strip() for factor in response.content.split('\n') if factor.strip()]
             except Exception as e:
                 logger.error(f"Error in analyze_key_factors: {str(e)}")
@@ -121,6 +227,7 @@ class BusinessCaseAgent:
         
         return retry_with_backoff(_call)
 
+    @llm_step()
     def identify_constraints(self, case_description):
         """Identify constraints and limitations in the business case."""
         def _call():
@@ -129,7 +236,9 @@ class BusinessCaseAgent:
                     SystemMessage(content="You are an expert business case analyst. Identify the key constraints and limitations in this case."),
                     HumanMessage(content=case_description)
                 ]
-                response = self.llm.invoke(messages)
+                response = self.router.invoke(
+                    messages, step="identify_constraints", tier="fast", validate=_has_list_items
+                )
                 return [constraint.strip() for constraint in response.content.split('\n') if constraint.strip()]
             except Exception as e:
                 logger.error(f"Error in identify_constraints: {str(e)}")
@@ -137,6 +246,7 @@ class BusinessCaseAgent:
         
         return retry_with_backoff(_call)
 
+    @llm_step()
     def generate_solutions(self, case_description):
         """Generate potential solutions for the business case."""
         def _call():
@@ -189,6 +299,7 @@ class BusinessCaseAgent:
             
         return solutions
 
+    @llm_step()
     def formulate_recommendation(self, solutions):
         """Formulate a final recommendation based on the generated solutions."""
         def _call():
@@ -240,18 +351,247 @@ class BusinessCaseAgent:
         
         return recommendation
 
-    def solve_case(self, case_description):
+    def submit_step(self, method, argument, relay: Optional[StepTokenRelay] = None):
+        """
+        Start a step method on the shared step threads.
+
+        Args:
+            method: Name of the step method, e.g. "identify_problem"
+            argument: The step's single input
+            relay: Receives the step's tokens as they stream, if given
+
+        Returns:
+            Future: The step result
+        """
+        # Each step keeps the caller's context, e.g. its telemetry tags
+        context = contextvars.copy_context()
+        if relay is not None:
+            context.run(_step_token_relay.set, relay)
+        return _step_executor.submit(context.run, getattr(self, method), argument)
+
+    def stream_steps(self, case_description, keys, solutions=None,
+                     stream_tokens=True) -> Iterator[Tuple[str, str, Any]]:
+        """
+        Run pipeline steps concurrently, starting each as soon as its inputs are ready.
+
+        The four independent steps start immediately. The recommendation starts
+        as soon as solutions are available, either passed in or once
+        generate_solutions completes.
+
+        Args:
+            case_description: The business case text
+            keys: Result keys to compute
+            solutions: Solutions already known, if generate_solutions is not being run
+            stream_tokens: Also report each step's tokens and completed items as they stream
+
+        Yields:
+            Tuple[str, str, Any]: (event, result key, payload), where event is one of
+                "delta"  - a streamed token of the step's output
+                "reset"  - the step is streaming again from the start, e.g. after a retry
+                "item"   - a complete key factor, constraint or solution
+                "result" - the step's final result
+        """
+        events = queue.Queue()
+        pending = {}
+        parsers = {}
+
+        def submit(method, argument, key):
+            relay = None
+            if stream_tokens:
+                relay = StepTokenRelay(key, events)
+                parsers[key] = StepItemParser(key, self._parse_solutions)
+            future = self.submit_step(method, argument, relay)
+            pending[future] = key
+            # Tokens are queued by the step's thread before it finishes, so they precede its result
+            future.add_done_callback(events.put)
+
+        for key, method in self.INDEPENDENT_STEPS.items():
+            if key in keys:
+                submit(method, case_description, key)
+        if 'recommendation' in keys and solutions is not None:
+            submit('formulate_recommendation', solutions, 'recommendation')
+        try:
+            while pending:
+                event = events.get()
+                if not isinstance(event, Future):
+                    kind, key, payload = event
+                    yield event
+                    if kind == 'reset':
+                        parsers[key].reset()
+                    elif kind == 'delta':
+                        for item in parsers[key].feed(payload):
+                            yield 'item', key, item
+                    continue
+                key = pending.pop(event)
+                value = event.result()
+                if key == 'solutions' and 'recommendation' in keys:
+                    check_cancelled()
+                    submit('formulate_recommendation', value, 'recommendation')
+                yield 'result', key, value
+        finally:
+            # Drop steps that have not started if the caller stops early or a step failed
+            for future in pending:
+                future.cancel()
+
+    def run_steps(self, case_description, keys, solutions=None) -> Iterator[Tuple[str, Any]]:
+        """
+        Run pipeline steps concurrently; see stream_steps.
+
+        Yields:
+            Tuple[str, Any]: (result key, step result) for each step, in completion order
+        """
+        for _, key, value in self.stream_steps(case_description, keys, solutions, stream_tokens=False):
+            yield key, value
+
+    @llm_step()
+    def stream_case_one_shot(self, case_description) -> Iterator[Tuple[str, Any]]:
+        """
+        Analyze the whole case in a single structured-output call.
+
+        The model fills the CaseAnalysis tool, and each field is validated and
+        yielded as soon as it is complete, in the same format the step methods
+        return.
+
+        Args:
+            case_description: The business case text
+
+        Yields:
+            Tuple[str, Any]: (result key, result) for all five result keys, including recommendation
+        """
+        llm = self.llm.bind_tools([CaseAnalysis], tool_choice="CaseAnalysis")
+        messages = [
+            SystemMessage(content=ONE_SHOT_PROMPT),
+            HumanMessage(content=case_description)
+        ]
+        argument_chunks = (
+            tool_chunk.get("args") or ""
+            for chunk in llm.stream(messages)
+            for tool_chunk in chunk.tool_call_chunks
+        )
+        yield from iter_completed_fields(argument_chunks)
+
+    def result_version(self, mode="pipeline") -> str:
+        """Version stored results are keyed by; results from another version are not reused."""
+        return f"{CASE_AGENT_VERSION}:{mode}:{self.llm.model}"
+
+    def iter_case_events(self, case_description, mode="pipeline", user_id=None,
+                         stream_tokens=True) -> Iterator[Tuple[str, str, Any]]:
+        """
+        Run the case analysis in the requested mode, reporting progress as it streams.
+
+        With a user_id, steps already stored for the same case are reported
+        first without calling the model, and newly computed steps are saved.
+
+        Args:
+            case_description: The business case text
+            mode: "pipeline" for concurrent step calls, or "one_shot" for a single structured call
+            user_id: Owner of the stored results, or None to neither reuse nor save them
+            stream_tokens: Report pipeline steps' tokens and items; one-shot fields arrive whole
+
+        Yields:
+            Tuple[str, str, Any]: (event, result key, payload) as in stream_steps, with a
+            "result" event for each of the five result keys
+        """
+        if mode not in ("pipeline", "one_shot"):
+            raise ValueError(f"Unknown analysis mode: {mode}")
+
+        stored = {}
+        if user_id:
+            store = get_case_store()
+            version = self.result_version(mode)
+            key = case_hash(case_description, version)
+            record = store.get(user_id, key)
+            stored = record["steps"] if record else {}
+            if stored:
+                logger.info(f"Reusing {len(stored)} stored steps for case {key[:12]}")
+
+        for result_key in RESULT_KEYS:
+            if result_key in stored:
+                yield 'result', result_key, stored[result_key]
+        missing = [result_key for result_key in RESULT_KEYS if result_key not in stored]
+        if not missing:
+            return
+
+        if mode == "one_shot":
+            events = (('result', result_key, value) for result_key, value in self.stream_case_one_shot(case_description))
+        else:
+            events = self.stream_steps(case_description, missing, stored.get('solutions'), stream_tokens)
+        inputs = {'case_description': case_description, 'solutions': stored.get('solutions')}
+        for event, result_key, value in events:
+            if result_key in stored:
+                continue
+            if event != 'result':
+                yield event, result_key, value
+                continue
+            if user_id:
+                store.save_steps(user_id, key, version, case_description, {result_key: value})
+                if mode == "pipeline":
+                    # Memoize the step too, so later edits of this case can reuse it
+                    store.save_memo(user_id, result_key, node_input_hash(result_key, inputs, version), value)
+            inputs[result_key] = value
+            yield event, result_key, value
+
+    def iter_case_results(self, case_description, mode="pipeline", user_id=None) -> Iterator[Tuple[str, Any]]:
+        """
+        Run the case analysis in the requested mode, yielding results as they are ready; see iter_case_events.
+
+        Yields:
+            Tuple[str, Any]: (result key, result) for all five result keys
+        """
+        for _, key, value in self.iter_case_events(case_description, mode, user_id, stream_tokens=False):
+            yield key, value
+
+    def edited_result_version(self, edits) -> str:
+        """Version an edited case's results are stored under; unedited cases match the pipeline's."""
+        version = self.result_version("pipeline")
+        if not edits:
+            return version
+        edit_hash = hashlib.sha256(json.dumps(edits, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{version}:edited:{edit_hash[:12]}"
+
+    def iter_edited_case(self, case_description, edits, user_id) -> Iterator[Tuple[str, Any, str]]:
+        """
+        Re-evaluate a case after the user edits it, recomputing only the steps whose inputs changed.
+
+        Steps are memoized per user by a hash of their inputs, so an edited
+        case text re-runs the steps that read it, and edited solutions re-run
+        only the recommendation. Edited step results are used as given. The
+        complete analysis is stored like any other result, under a version
+        that records the edits.
+
+        Args:
+            case_description: The (possibly edited) business case text
+            edits: Step results supplied by the user, by result key
+            user_id: Owner of the memoized and stored results
+
+        Yields:
+            Tuple[str, Any, str]: (result key, result, source) in completion order, where
+            source is "edited", "reused" or "computed"
+        """
+        unknown = [result_key for result_key in edits if result_key not in RESULT_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown result keys: {', '.join(unknown)}")
+
+        store = get_case_store()
+        version = self.edited_result_version(edits)
+        key = case_hash(case_description, version)
+
+        graph = CaseGraph(self, store, user_id, self.result_version("pipeline"))
+        for result_key, value, source in graph.evaluate(case_description, edits):
+            store.save_steps(user_id, key, version, case_description, {result_key: value})
+            yield result_key, value, source
+
+    def solve_case(self, case_description, mode="pipeline", user_id=None):
         """Solve the entire business case and return a complete analysis."""
         try:
-            # Generate solutions once to avoid duplicate API calls
-            solutions = self.generate_solutions(case_description)
+            results = dict(self.iter_case_results(case_description, mode, user_id))
             
             return {
-                'problem_statement': self.identify_problem(case_description),
-                'key_factors': self.analyze_key_factors(case_description),
-                'constraints': self.identify_constraints(case_description),
-                'solutions': solutions,
-                'recommendation': self.formulate_recommendation(solutions)
+                'problem_statement': results['problem_statement'],
+                'key_factors': results['key_factors'],
+                'constraints': results['constraints'],
+                'solutions': results['solutions'],
+                'recommendation': results['recommendation']
             }
         except Exception as e:
             logger.error(f"Error in solve_case: {str(e)}")
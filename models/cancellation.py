@@ -0,0 +1,124 @@
+"""
+Cancellation of work whose client has gone away.
+
+A CancellationToken is made active for a block of work with
+cancellation_scope(). Everything run in that context, including threads
+started with a copy of it, sees the token:
+
+- model calls made through create_llm check it before they queue for the
+  rate limiter and on every streamed chunk, so an in-flight stream is
+  abandoned at its next token;
+- LangChain agents and chains check it when they start a chain, agent step
+  or tool, through a callback installed for the context;
+- pipelines check it between their own steps with check_cancelled().
+
+A cancelled block raises RunCancelled out of whatever it was doing.
+"""
+from typing import Callable, List, Optional
+from contextlib import contextmanager
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+import contextvars
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class RunCancelled(Exception):
+    """The work was cancelled, usually because its client disconnected."""
+
+
+class CancellationToken:
+    """A one-way cancelled flag with callbacks."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the work; later calls do nothing."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Cancelling run: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Call callback when the token is cancelled, or now if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RunCancelled(self.reason)
+
+
+class CancellationCallbackHandler(BaseCallbackHandler):
+    """Stops LangChain runs between steps once the token is cancelled."""
+
+    # Errors from this handler must reach the chain instead of being logged and ignored
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        self.token.raise_if_cancelled()
+
+    def on_agent_action(self, action, **kwargs):
+        self.token.raise_if_cancelled()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.token.raise_if_cancelled()
+
+
+_current_token: contextvars.ContextVar[Optional[CancellationToken]] = contextvars.ContextVar(
+    "cancellation_token", default=None
+)
+_cancellation_handler: contextvars.ContextVar[Optional[BaseCallbackHandler]] = contextvars.ContextVar(
+    "cancellation_handler", default=None
+)
+register_configure_hook(_cancellation_handler, inheritable=True)
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken):
+    """Make token the active cancellation token for the block."""
+    token_reset = _current_token.set(token)
+    handler_reset = _cancellation_handler.set(CancellationCallbackHandler(token))
+    try:
+        yield token
+    finally:
+        _cancellation_handler.reset(handler_reset)
+        _current_token.reset(token_reset)
+
+
+def current_token() -> Optional[CancellationToken]:
+    """The active cancellation token, if any."""
+    return _current_token.get()
+
+
+def check_cancelled():
+    """Raise RunCancelled if the active token has been cancelled."""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
@@ -0,0 +1,110 @@
+"""
+Typed schema for a complete business case analysis.
+
+Used by the one-shot mode of BusinessCaseAgent, where the model returns the
+whole analysis in a single tool call instead of five free-text steps. The
+tool's arguments stream in as partial JSON, so each top-level field can be
+validated and reported as soon as the model moves on to the next one.
+"""
+from typing import List, Any, Iterator, Tuple
+from pydantic import BaseModel, Field, TypeAdapter
+from langchain_core.utils.json import parse_partial_json
+import json
+
+
+class CaseSolution(BaseModel):
+    description: str = Field(description="What the solution is and how it addresses the problem")
+    pros: List[str] = Field(description="Advantages, one short phrase each")
+    cons: List[str] = Field(description="Drawbacks and risks, one short phrase each")
+    implementation: str = Field(description="How the solution would be implemented")
+    timeline: str = Field(description="Expected timeline")
+
+
+class CaseRecommendation(BaseModel):
+    solution: str = Field(description="Which solution is recommended")
+    rationale: str = Field(description="Why it is the best option")
+    implementation: str = Field(description="Implementation plan")
+    timeline: str = Field(description="Implementation timeline")
+    success_metrics: List[str] = Field(description="Metrics that show the recommendation is working")
+
+
+class CaseAnalysis(BaseModel):
+    """Record the complete analysis of a business case."""
+
+    problem_statement: str = Field(description="The core business problem")
+    key_factors: List[str] = Field(description="Key factors influencing the case")
+    constraints: List[str] = Field(description="Key constraints and limitations")
+    solutions: List[CaseSolution] = Field(description="Three potential solutions")
+    recommendation: CaseRecommendation = Field(description="Final recommendation based on the solutions")
+
+
+# Result keys in the order the model is asked to write them
+ANALYSIS_FIELDS = list(CaseAnalysis.model_fields)
+
+_field_adapters = {
+    name: TypeAdapter(field.annotation) for name, field in CaseAnalysis.model_fields.items()
+}
+
+
+def to_step_result(name: str, value: Any) -> Any:
+    """
+    Validate one analysis field and convert it to what the step-by-step pipeline returns.
+
+    Args:
+        name: Field name, e.g. "solutions"
+        value: Raw value from the tool arguments
+
+    Returns:
+        Any: The field in the pipeline's format (strings, lists and dicts)
+
+    Raises:
+        pydantic.ValidationError: If the value does not match the schema
+    """
+    validated = _field_adapters[name].validate_python(value)
+    if name == "solutions":
+        return [solution.model_dump() for solution in validated]
+    if name == "recommendation":
+        result = validated.model_dump(exclude={"success_metrics"})
+        result["successMetrics"] = validated.success_metrics
+        return result
+    return validated
+
+
+def iter_completed_fields(argument_chunks: Iterator[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield each top-level field of the streamed tool arguments once it is complete.
+
+    A field is complete when the model starts writing the next one, or when the
+    stream ends. Fields are validated and converted with to_step_result.
+
+    Args:
+        argument_chunks: Fragments of the tool call's JSON arguments
+
+    Yields:
+        Tuple[str, Any]: (field name, validated value)
+
+    Raises:
+        ValueError: If the finished arguments are missing fields or are not valid JSON
+    """
+    buffer = ""
+    emitted = set()
+    for fragment in argument_chunks:
+        if not fragment:
+            continue
+        buffer += fragment
+        partial = parse_partial_json(buffer) or {}
+        for name in list(partial)[:-1]:
+            if name not in emitted and name in _field_adapters:
+                emitted.add(name)
+                yield name, to_step_result(name, partial[name])
+
+    try:
+        arguments = json.loads(buffer) if buffer else {}
+    except ValueError:
+        raise ValueError("The model returned incomplete analysis JSON")
+    missing = [name for name in ANALYSIS_FIELDS if name not in arguments]
+    if missing:
+        raise ValueError(f"The analysis is missing: {', '.join(missing)}")
+    for name in ANALYSIS_FIELDS:
+        if name not in emitted:
+            yield name, to_step_result(name, arguments[name])
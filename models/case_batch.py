@@ -0,0 +1,257 @@
+"""
+Batch business case solving.
+
+A batch is a list of cases run through one shared job queue. At most
+BUSINESS_CASE_BATCH_CONCURRENCY cases from all batches are analyzed at
+once; every LLM call still goes through the Anthropic rate limiter, so the
+limit bounds how many cases hold queued calls rather than the call rate.
+Finished cases are stored per user like any other result, so a cancelled
+or failed batch can be resumed without recomputing the cases or steps that
+already completed.
+
+    BUSINESS_CASE_BATCH_CONCURRENCY  cases analyzed at once (default RPM / 10, at least 1)
+    BUSINESS_CASE_BATCH_MAX_CASES    most cases in one batch (default 200)
+    BUSINESS_CASE_BATCH_TTL_SECONDS  how long finished batches stay queryable (default 3600)
+"""
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from models.rate_limiter import PROVIDER_LIMITS
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_default_concurrency = max(1, PROVIDER_LIMITS["anthropic"]["requests_per_minute"] // 10)
+BATCH_CONCURRENCY = int(os.getenv("BUSINESS_CASE_BATCH_CONCURRENCY", str(_default_concurrency)))
+BATCH_MAX_CASES = int(os.getenv("BUSINESS_CASE_BATCH_MAX_CASES", "200"))
+BATCH_TTL_SECONDS = float(os.getenv("BUSINESS_CASE_BATCH_TTL_SECONDS", "3600"))
+
+# Case states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class _CaseStopped(Exception):
+    """The case's batch was cancelled while the case was running."""
+
+
+class CaseBatch:
+    """One batch of cases, with the events reported so far."""
+
+    def __init__(self, user_id: str, cases: List[Dict[str, Any]], mode: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.mode = mode
+        self.cases = [
+            {'index': index, 'case_id': case.get('case_id', index), 'case_text': case['case_text'], 'status': QUEUED}
+            for index, case in enumerate(cases)
+        ]
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.errors: Dict[int, str] = {}
+        self.cancelled = False
+        self.events: List[Dict[str, Any]] = []
+        self.cond = threading.Condition()
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return all(case['status'] not in (QUEUED, RUNNING) for case in self.cases)
+
+    def _emit(self, event: Dict[str, Any]):
+        """Record an event and wake the streams. Caller must hold the lock."""
+        self.events.append(event)
+        if self.finished and self.finished_at is None:
+            self.finished_at = time.time()
+            self.events.append({'type': 'complete', **self.summary()})
+        self.cond.notify_all()
+
+    def summary(self) -> Dict[str, Any]:
+        counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for case in self.cases:
+            counts[case['status']] += 1
+        return {'batch_id': self.id, 'mode': self.mode, 'total': len(self.cases), 'cancel_requested': self.cancelled, **counts}
+
+    def set_status(self, index: int, status: str, result: Any = None, error: Optional[str] = None,
+                   expected: Optional[str] = None) -> bool:
+        """
+        Move a case to a new state and report it.
+
+        Args:
+            expected: Only move the case if it is currently in this state
+
+        Returns:
+            bool: Whether the case was moved
+        """
+        with self.cond:
+            case = self.cases[index]
+            if expected is not None and case['status'] != expected:
+                return False
+            case['status'] = status
+            event = {'type': 'case', 'index': index, 'case_id': case['case_id'], 'status': status}
+            if status == DONE:
+                self.results[index] = result
+                event['analysis'] = result
+            elif status == FAILED:
+                self.errors[index] = error
+                event['error'] = error
+            self._emit(event)
+            return True
+
+    def stream(self, after: int = 0, heartbeat: Optional[float] = None) -> Iterator[Tuple[Optional[int], Any]]:
+        """
+        Yield the batch's events from position `after`, then live ones until the batch finishes.
+
+        Args:
+            after: Number of events the caller has already seen
+            heartbeat: Yield (None, None) after this many seconds without an event, so the
+                caller can write a keep-alive and notice a closed connection
+
+        Yields:
+            Tuple[Optional[int], Any]: Each event's position and the event
+        """
+        position = max(0, after)
+        while True:
+            with self.cond:
+                if position >= len(self.events):
+                    if self.finished_at is not None:
+                        return
+                    if not self.cond.wait(heartbeat):
+                        pending = None
+                    else:
+                        continue
+                else:
+                    pending = self.events[position:]
+            if pending is None:
+                yield None, None
+                continue
+            for event in pending:
+                yield position, event
+                position += 1
+
+
+class CaseBatchQueue:
+    """Runs the cases of every batch through one bounded pool of workers."""
+
+    def __init__(self, agent, concurrency: int = BATCH_CONCURRENCY):
+        """
+        Args:
+            agent: BusinessCaseAgent that analyzes the cases
+            concurrency: Cases analyzed at once, across all batches
+        """
+        self.agent = agent
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="business-case-batch")
+        self._batches: Dict[str, CaseBatch] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user_id: str, cases: List[Dict[str, Any]], mode: str = "pipeline") -> CaseBatch:
+        """
+        Queue a batch of cases.
+
+        Args:
+            user_id: Owner of the batch and its stored results
+            cases: Cases as {"case_text": ..., "case_id": optional caller reference}
+            mode: Analysis mode for every case
+
+        Returns:
+            CaseBatch: The queued batch
+
+        Raises:
+            ValueError: If the batch is empty, too large, or a case has no text
+        """
+        if not cases:
+            raise ValueError("A batch needs at least one case")
+        if len(cases) > BATCH_MAX_CASES:
+            raise ValueError(f"A batch can have at most {BATCH_MAX_CASES} cases")
+        if any(not isinstance(case, dict) or not case.get('case_text') for case in cases):
+            raise ValueError("Every case needs case_text")
+
+        batch = CaseBatch(user_id, cases, mode)
+        with self._lock:
+            self._evict_finished()
+            self._batches[batch.id] = batch
+        logger.info(f"Queued batch {batch.id} with {len(cases)} cases ({self.concurrency} run at once)")
+        for case in batch.cases:
+            self._enqueue(batch, case['index'])
+        return batch
+
+    def get(self, user_id: str, batch_id: str) -> Optional[CaseBatch]:
+        """The user's batch with this ID, if it exists."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        return batch if batch and batch.user_id == user_id else None
+
+    def cancel(self, batch: CaseBatch):
+        """Stop a batch: queued cases are skipped and running ones stop after their current step."""
+        with batch.cond:
+            batch.cancelled = True
+            queued = [case['index'] for case in batch.cases if case['status'] == QUEUED]
+        for index in queued:
+            batch.set_status(index, CANCELLED, expected=QUEUED)
+
+    def resume(self, batch: CaseBatch) -> int:
+        """
+        Queue a batch's cancelled and failed cases again.
+
+        Steps that completed before are stored, so resumed cases only compute what is missing.
+
+        Returns:
+            int: Number of cases queued
+        """
+        with batch.cond:
+            batch.cancelled = False
+            indexes = [case['index'] for case in batch.cases if case['status'] in (CANCELLED, FAILED)]
+            if not indexes:
+                return 0
+            for index in indexes:
+                batch.cases[index]['status'] = QUEUED
+                batch.errors.pop(index, None)
+            batch.finished_at = None
+            batch._emit({'type': 'resumed', 'queued': len(indexes)})
+        for index in indexes:
+            self._enqueue(batch, index)
+        return len(indexes)
+
+    def _enqueue(self, batch: CaseBatch, index: int):
+        # Cases keep the submitter's context, e.g. its request ID for telemetry
+        self._executor.submit(contextvars.copy_context().run, self._run_case, batch, index)
+
+    def _run_case(self, batch: CaseBatch, index: int):
+        if batch.cancelled or not batch.set_status(index, RUNNING, expected=QUEUED):
+            return
+        try:
+            results = {}
+            steps = self.agent.iter_case_results(batch.cases[index]['case_text'], batch.mode, batch.user_id)
+            try:
+                for key, value in steps:
+                    results[key] = value
+                    if batch.cancelled:
+                        raise _CaseStopped()
+            finally:
+                # Cancels the case's steps that have not started
+                steps.close()
+            batch.set_status(index, DONE, result=results)
+        except _CaseStopped:
+            batch.set_status(index, CANCELLED)
+        except Exception as e:
+            logger.error(f"Case {index} of batch {batch.id} failed: {str(e)}")
+            batch.set_status(index, FAILED, error=str(e))
+
+    def _evict_finished(self):
+        """Forget batches that finished long ago. Caller must hold the lock."""
+        now = time.time()
+        expired = [
+            batch_id for batch_id, batch in self._batches.items()
+            if batch.finished_at is not None and now - batch.finished_at > BATCH_TTL_SECONDS
+        ]
+        for batch_id in expired:
+            del self._batches[batch_id]
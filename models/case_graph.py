@@ -0,0 +1,122 @@
+"""
+The business case pipeline as a memoized dependency graph.
+
+Each step is a node that declares which inputs it reads. A node's output is
+memoized by a hash of those inputs, so re-evaluating an edited case only
+runs the nodes whose inputs changed: editing the solutions re-runs only the
+recommendation, and a case edit that normalizes to the same text re-runs
+nothing. Edited node outputs are taken as given instead of being computed.
+"""
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from concurrent.futures import wait, FIRST_COMPLETED
+from models.case_store import normalize_case_text
+import hashlib
+import json
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Node name -> (BusinessCaseAgent method, inputs it reads)
+CASE_NODES = {
+    'problem_statement': ('identify_problem', ['case_description']),
+    'key_factors': ('analyze_key_factors', ['case_description']),
+    'constraints': ('identify_constraints', ['case_description']),
+    'solutions': ('generate_solutions', ['case_description']),
+    'recommendation': ('formulate_recommendation', ['solutions']),
+}
+
+# Where each node's output came from
+EDITED = 'edited'
+REUSED = 'reused'
+COMPUTED = 'computed'
+
+
+def node_input_hash(node: str, inputs: Dict[str, Any], version: str) -> str:
+    """
+    Hash the inputs a node reads, so equal inputs map to the same memoized output.
+
+    Args:
+        node: Node name
+        inputs: Values of at least the node's inputs, by name
+        version: Agent version; outputs from other versions are not reused
+
+    Returns:
+        str: Hex digest
+    """
+    values = {}
+    for name in CASE_NODES[node][1]:
+        value = inputs[name]
+        values[name] = normalize_case_text(value) if name == 'case_description' else value
+    raw = json.dumps({"node": node, "version": version, "inputs": values}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CaseGraph:
+    """Evaluates the case nodes concurrently, reusing memoized outputs."""
+
+    def __init__(self, agent, store, user_id: str, version: str):
+        """
+        Args:
+            agent: BusinessCaseAgent whose step methods compute the nodes
+            store: Case store holding the memo
+            user_id: Owner of the memoized outputs
+            version: Agent version the memo is keyed by
+        """
+        self.agent = agent
+        self.store = store
+        self.user_id = user_id
+        self.version = version
+
+    def evaluate(self, case_description: str, edits: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Any, str]]:
+        """
+        Evaluate every node, running only those without a memoized output.
+
+        Args:
+            case_description: The business case text
+            edits: Node outputs supplied by the user, by node name
+
+        Yields:
+            Tuple[str, Any, str]: (node, output, source) in completion order, where
+            source is EDITED, REUSED or COMPUTED
+        """
+        edits = edits or {}
+        values: Dict[str, Any] = {'case_description': case_description}
+        remaining: List[str] = list(CASE_NODES)
+        running = {}
+
+        try:
+            while remaining or running:
+                # Resolve every node whose inputs are ready, from edits or the memo if possible
+                for node in list(remaining):
+                    method, inputs = CASE_NODES[node]
+                    if not all(name in values for name in inputs):
+                        continue
+                    remaining.remove(node)
+                    if node in edits:
+                        values[node] = edits[node]
+                        yield node, edits[node], EDITED
+                        continue
+                    input_hash = node_input_hash(node, values, self.version)
+                    memoized = self.store.get_memo(self.user_id, node, input_hash)
+                    if memoized is not None:
+                        values[node] = memoized
+                        yield node, memoized, REUSED
+                        continue
+                    argument = values[inputs[0]]
+                    running[self.agent.submit_step(method, argument)] = (node, input_hash)
+
+                if not running:
+                    # Resolving outputs may have made more nodes ready
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node, input_hash = running.pop(future)
+                    value = future.result()
+                    self.store.save_memo(self.user_id, node, input_hash, value)
+                    values[node] = value
+                    yield node, value, COMPUTED
+        finally:
+            for future in running:
+                future.cancel()
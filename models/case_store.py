@@ -0,0 +1,232 @@
+"""
+Persisted business case results, addressed by a hash of the case.
+
+Each user's results are keyed by a hash of the normalized case text and the
+agent version, so resubmitting the same case reuses what was already
+computed. Step outputs are saved as they complete, so an interrupted run can
+be resumed. Individual step outputs are also memoized by a hash of the
+step's inputs, so an edited case only recomputes the steps whose inputs
+changed (see models/case_graph.py).
+
+    CASE_STORE_BACKEND  "sqlite" (default) or "supabase"
+    CASE_STORE_PATH     SQLite file (default data/case_results.sqlite3 in the project root)
+
+The Supabase backend expects this table:
+
+    create table case_results (
+        user_id uuid not null,
+        case_hash text not null,
+        agent_version text not null,
+        case_text text not null,
+        steps jsonb not null default '{}',
+        created_at timestamptz not null default now(),
+        updated_at timestamptz not null default now(),
+        primary key (user_id, case_hash)
+    );
+
+    create table case_step_memo (
+        user_id uuid not null,
+        step text not null,
+        input_hash text not null,
+        value jsonb not null,
+        created_at timestamptz not null default now(),
+        primary key (user_id, step, input_hash)
+    );
+"""
+from typing import Dict, List, Any, Optional
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CASE_STORE_BACKEND = os.getenv("CASE_STORE_BACKEND", "sqlite")
+CASE_STORE_PATH = os.getenv("CASE_STORE_PATH", os.path.join(PROJECT_ROOT, "data", "case_results.sqlite3"))
+
+# Most results returned by one listing
+RESULT_LIMIT = 50
+
+
+def normalize_case_text(case_text: str) -> str:
+    """Normalize case text so whitespace and case differences map to the same case."""
+    return re.sub(r"\s+", " ", case_text or "").strip().lower()
+
+
+def case_hash(case_text: str, agent_version: str) -> str:
+    """Hash a case and the agent version that analyzes it."""
+    raw = json.dumps({"case": normalize_case_text(case_text), "version": agent_version}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SQLiteCaseStore:
+    """Case results in a local SQLite file."""
+
+    def __init__(self, path: str = CASE_STORE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS case_results (
+                    user_id TEXT NOT NULL,
+                    case_hash TEXT NOT NULL,
+                    agent_version TEXT NOT NULL,
+                    case_text TEXT NOT NULL,
+                    steps TEXT NOT NULL DEFAULT '{}',
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (user_id, case_hash)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS case_step_memo (
+                    user_id TEXT NOT NULL,
+                    step TEXT NOT NULL,
+                    input_hash TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (user_id, step, input_hash)
+                )
+            """)
+
+    @staticmethod
+    def _to_record(row) -> Dict[str, Any]:
+        return {
+            "case_hash": row[0],
+            "agent_version": row[1],
+            "case_text": row[2],
+            "steps": json.loads(row[3]),
+            "created_at": row[4],
+            "updated_at": row[5],
+        }
+
+    def get(self, user_id: str, case_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT case_hash, agent_version, case_text, steps, created_at, updated_at "
+                "FROM case_results WHERE user_id = ? AND case_hash = ?",
+                (user_id, case_hash)
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def save_steps(self, user_id: str, case_hash: str, agent_version: str, case_text: str,
+                   steps: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT steps FROM case_results WHERE user_id = ? AND case_hash = ?", (user_id, case_hash)
+            ).fetchone()
+            now = _now()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO case_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, case_hash, agent_version, case_text, json.dumps(steps), now, now)
+                )
+            else:
+                merged = {**json.loads(row[0]), **steps}
+                self._conn.execute(
+                    "UPDATE case_results SET steps = ?, updated_at = ? WHERE user_id = ? AND case_hash = ?",
+                    (json.dumps(merged), now, user_id, case_hash)
+                )
+
+    def list_results(self, user_id: str, limit: int = RESULT_LIMIT) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT case_hash, agent_version, case_text, steps, created_at, updated_at "
+                "FROM case_results WHERE user_id = ? ORDER BY updated_at DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def get_memo(self, user_id: str, step: str, input_hash: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM case_step_memo WHERE user_id = ? AND step = ? AND input_hash = ?",
+                (user_id, step, input_hash)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_memo(self, user_id: str, step: str, input_hash: str, value: Any) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO case_step_memo VALUES (?, ?, ?, ?, ?)",
+                (user_id, step, input_hash, json.dumps(value), _now())
+            )
+
+
+class SupabaseCaseStore:
+    """Case results in the Supabase case_results table."""
+
+    COLUMNS = "case_hash, agent_version, case_text, steps, created_at, updated_at"
+
+    def __init__(self, client=None):
+        if client is None:
+            from supabase import create_client
+            client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+        self.client = client
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, case_hash: str) -> Optional[Dict[str, Any]]:
+        response = self.client.table("case_results").select(self.COLUMNS) \
+            .eq("user_id", user_id).eq("case_hash", case_hash).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def save_steps(self, user_id: str, case_hash: str, agent_version: str, case_text: str,
+                   steps: Dict[str, Any]) -> None:
+        # Steps of one case complete concurrently; merge them one at a time
+        with self._lock:
+            existing = self.get(user_id, case_hash)
+            merged = {**(existing or {}).get("steps", {}), **steps}
+            self.client.table("case_results").upsert({
+                "user_id": user_id,
+                "case_hash": case_hash,
+                "agent_version": agent_version,
+                "case_text": case_text,
+                "steps": merged,
+                "updated_at": _now(),
+            }).execute()
+
+    def list_results(self, user_id: str, limit: int = RESULT_LIMIT) -> List[Dict[str, Any]]:
+        response = self.client.table("case_results").select(self.COLUMNS) \
+            .eq("user_id", user_id).order("updated_at", desc=True).limit(limit).execute()
+        return response.data or []
+
+    def get_memo(self, user_id: str, step: str, input_hash: str) -> Optional[Any]:
+        response = self.client.table("case_step_memo").select("value") \
+            .eq("user_id", user_id).eq("step", step).eq("input_hash", input_hash).limit(1).execute()
+        return response.data[0]["value"] if response.data else None
+
+    def save_memo(self, user_id: str, step: str, input_hash: str, value: Any) -> None:
+        self.client.table("case_step_memo").upsert({
+            "user_id": user_id,
+            "step": step,
+            "input_hash": input_hash,
+            "value": value,
+        }).execute()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_case_store():
+    """Get the configured case result store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if CASE_STORE_BACKEND == "supabase":
+                _store = SupabaseCaseStore()
+            else:
+                _store = SQLiteCaseStore()
+            logger.info(f"Using {type(_store).__name__} for business case results")
+        return _store
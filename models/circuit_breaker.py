@@ -0,0 +1,176 @@
+from typing import Dict, Any
+from collections import deque
+from anthropic import APIConnectionError, APIStatusError
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Trip once this fraction of recent calls failed...
+BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+# ...out of at least this many calls...
+BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+# ...within this rolling window
+BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60"))
+# How long to fail fast before letting a probe request through
+BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream model whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"The AI service ({name}) is temporarily unavailable due to high demand. "
+            f"Please try again in {int(retry_after) + 1} seconds."
+        )
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Whether an error means the upstream is unhealthy (overloaded, 5xx, unreachable)."""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def error_event_fields(error: Exception) -> Dict[str, Any]:
+    """Extra SSE error fields that let clients tell an open circuit apart from other errors."""
+    if isinstance(error, CircuitOpenError):
+        return {"code": "circuit_open", "retry_after": round(error.retry_after, 1)}
+    return {}
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker for an upstream model.
+
+    Closed: calls go through and outcomes are recorded in a rolling window.
+    Open: calls fail fast with CircuitOpenError until the open period ends.
+    Half-open: a single probe call is let through; success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_rate: float = BREAKER_FAILURE_RATE,
+                 min_calls: int = BREAKER_MIN_CALLS, window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+        self._stats = {"rejected": 0, "trips": 0}
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def before_call(self):
+        """Check whether a call may proceed. Raises CircuitOpenError if not."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"[{self.name}] Circuit half-open, allowing a probe request")
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                logger.info(f"[{self.name}] Probe succeeded, closing circuit")
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._probe_in_flight = False
+            now = time.monotonic()
+            self._outcomes.append((now, True))
+            self._prune(now)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._trip(now)
+                return
+            self._outcomes.append((now, False))
+            self._prune(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls and
+                    failures / len(self._outcomes) >= self.failure_rate):
+                self._trip(now)
+
+    def record_ignored(self):
+        """Release a half-open probe whose outcome says nothing about upstream health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self, now: float):
+        """Open the circuit. Caller must hold the lock."""
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._stats["trips"] += 1
+        logger.warning(f"[{self.name}] Circuit opened for {self.open_seconds:.0f}s after upstream failures")
+
+    def get_state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def get_stats(self) -> Dict[str, Any]:
+        state = self.get_state()
+        with self._lock:
+            self._prune(time.monotonic())
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                "state": state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": failures,
+                "trips": self._stats["trips"],
+                "rejected": self._stats["rejected"],
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get the process-wide circuit breaker for an upstream model."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+        return breaker
+
+
+def get_circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """Get the state of every circuit breaker created so far."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.get_stats() for breaker in breakers}
@@ -0,0 +1,155 @@
+from typing import Dict, List, Any, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, SystemMessage
+from models.llm_client import create_llm
+from models.token_budget import token_counter
+from models.telemetry import llm_step
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cheap model used to compress older turns, off the response path
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "claude-3-haiku-20240307")
+# Start summarizing once unsummarized history passes this many tokens
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "2000"))
+# Number of most recent messages that are always kept verbatim
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+# Maximum number of threads whose summaries are kept in memory
+SUMMARY_MAX_THREADS = int(os.getenv("SUMMARY_MAX_THREADS", "1000"))
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a client and an expert business consultant.
+Update the existing summary with the new messages. Preserve the client's goals, key facts and figures, decisions made,
+recommendations given and open questions. Be concise and write in plain prose. Return only the updated summary."""
+
+
+def _message_fingerprint(message: Dict[str, Any]) -> str:
+    """Hash a message so a thread's summary can be checked against the client's history."""
+    raw = f"{message.get('role', '')}\x00{message.get('content', '')}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ConversationSummaryMemory:
+    """
+    Per-thread rolling summary of older conversation turns.
+
+    Clients send their full chat history on every request. For each thread the
+    memory remembers how many leading messages are already folded into the
+    summary, so prompts only need the summary plus the unsummarized tail.
+    Summaries are updated in a background thread with a cheap model.
+    """
+
+    def __init__(self, llm=None, trigger_tokens: int = SUMMARY_TRIGGER_TOKENS,
+                 keep_recent: int = SUMMARY_KEEP_RECENT, max_threads: int = SUMMARY_MAX_THREADS):
+        self.llm = llm
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = keep_recent
+        self.max_threads = max_threads
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary-memory")
+
+    def _get_llm(self):
+        """Lazily create the summarization model."""
+        if self.llm is None:
+            self.llm = create_llm(
+                model=SUMMARY_MODEL,
+                anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+                temperature=0,
+                max_tokens=1024,
+                timeout=60,
+                max_retries=2
+            )
+        return self.llm
+
+    def _get_state(self, thread_key: str) -> Dict[str, Any]:
+        """Get (or create) the summary state for a thread. Caller must hold the lock."""
+        state = self._threads.get(thread_key)
+        if state is None:
+            state = {"summary": "", "summarized_count": 0, "boundary": None, "pending": False}
+            self._threads[thread_key] = state
+            if len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        else:
+            self._threads.move_to_end(thread_key)
+        return state
+
+    def get_context(self, thread_key: str, chat_history: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Split chat history into a running summary and the recent turns.
+
+        Args:
+            thread_key: Identifies the conversation thread
+            chat_history: Full chat history sent by the client
+
+        Returns:
+            Tuple[str, List[Dict[str, Any]]]: The summary (may be empty) and the unsummarized messages
+        """
+        chat_history = [msg for msg in chat_history or [] if isinstance(msg, dict)]
+
+        with self._lock:
+            state = self._get_state(thread_key)
+            count = state["summarized_count"]
+            # Reset if the client's history no longer starts with what we summarized
+            if count and (len(chat_history) < count or
+                          _message_fingerprint(chat_history[count - 1]) != state["boundary"]):
+                logger.info(f"Chat history for thread {thread_key} diverged from its summary, resetting")
+                state.update({"summary": "", "summarized_count": 0, "boundary": None})
+                count = 0
+            summary = state["summary"]
+            recent = chat_history[count:]
+            should_schedule = not state["pending"] and len(recent) > self.keep_recent
+            if should_schedule:
+                recent_tokens = sum(token_counter.count_message(msg) for msg in recent)
+                should_schedule = recent_tokens > self.trigger_tokens
+            if should_schedule:
+                state["pending"] = True
+
+        if should_schedule:
+            to_summarize = recent[:-self.keep_recent]
+            # Carry the request's telemetry tags into the background thread
+            self._executor.submit(
+                contextvars.copy_context().run, self._summarize, thread_key, summary, count, to_summarize
+            )
+
+        return summary, recent
+
+    @llm_step("summarize")
+    def _summarize(self, thread_key: str, previous_summary: str, start: int, messages: List[Dict[str, Any]]):
+        """Fold messages into the thread's summary. Runs in the background."""
+        try:
+            transcript = "\n".join(
+                f"{'User' if msg.get('role') == 'user' else 'Assistant'}: {msg.get('content', '')}"
+                for msg in messages
+            )
+            response = self._get_llm().invoke([
+                SystemMessage(content=SUMMARY_PROMPT),
+                HumanMessage(content=f"Existing summary:\n{previous_summary or 'None'}\n\nNew messages:\n{transcript}")
+            ])
+            new_summary = response.content.strip()
+
+            with self._lock:
+                state = self._get_state(thread_key)
+                # Only apply if nothing reset the thread while we were summarizing
+                if state["summarized_count"] == start:
+                    state["summary"] = new_summary
+                    state["summarized_count"] = start + len(messages)
+                    state["boundary"] = _message_fingerprint(messages[-1])
+                    logger.info(f"Summarized {len(messages)} messages for thread {thread_key}")
+        except Exception as e:
+            logger.error(f"Error summarizing conversation for thread {thread_key}: {str(e)}")
+        finally:
+            with self._lock:
+                state = self._threads.get(thread_key)
+                if state is not None:
+                    state["pending"] = False
+
+    def clear(self, thread_key: str):
+        """Forget the summary for a thread."""
+        with self._lock:
+            self._threads.pop(thread_key, None)
@@ -0,0 +1,119 @@
+"""
+Per-request deadlines.
+
+A route creates one Deadline for the whole request and makes it active with
+deadline_scope(). Everything run in that context, including threads started
+with a copy of it, budgets from the time that is left instead of from its
+own fixed limit:
+
+- model calls made through create_llm cap their HTTP timeout at the time
+  left, keep only as many SDK retries as fit in it, and stop streaming when
+  it passes;
+- the rate limiter queue stops waiting when it passes;
+- retry helpers do not back off past it;
+- agents stop iterating early enough to leave a reserve for writing up
+  what they found.
+
+Once the deadline passes, DeadlineExceeded is raised. Pipelines catch it and
+return what they have so far as a partial answer.
+
+    REQUEST_DEADLINE_SECONDS   deadline for a streamed request, and the most a client may ask for (default 300)
+    DEADLINE_RESERVE_SECONDS   time an agent leaves for its partial answer (default 30)
+"""
+from typing import Optional
+from contextlib import contextmanager
+import contextvars
+import os
+import time
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "300"))
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "30"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the work finished."""
+
+
+class Deadline:
+    """A point in time that a request, and everything it starts, must finish by."""
+
+    def __init__(self, seconds: float, expires_at: Optional[float] = None):
+        """
+        Args:
+            seconds: Time allowed from now
+            expires_at: Absolute expiry on the time.monotonic() clock, instead of seconds from now
+        """
+        self.expires_at = expires_at if expires_at is not None else time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls, seconds: Optional[float] = None) -> "Deadline":
+        """The deadline a client asked for, limited to REQUEST_DEADLINE_SECONDS."""
+        try:
+            seconds = float(seconds) if seconds else REQUEST_DEADLINE_SECONDS
+        except (TypeError, ValueError):
+            seconds = REQUEST_DEADLINE_SECONDS
+        return cls(min(max(seconds, 1.0), REQUEST_DEADLINE_SECONDS))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def budget(self, limit: Optional[float] = None) -> float:
+        """The time left, or limit if that is shorter."""
+        remaining = self.remaining()
+        return min(limit, remaining) if limit else remaining
+
+    def child(self, seconds: float) -> "Deadline":
+        """A deadline for part of the work: seconds from now, but never after this one."""
+        return Deadline(0, expires_at=min(self.expires_at, time.monotonic() + seconds))
+
+    def reserve(self, seconds: float = DEADLINE_RESERVE_SECONDS) -> "Deadline":
+        """A deadline that leaves seconds for what comes after, and at least half the time left for the work."""
+        remaining = self.remaining()
+        return self.child(remaining - min(seconds, remaining / 2))
+
+    def raise_if_expired(self):
+        if self.expired:
+            raise DeadlineExceeded("The request ran out of time")
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Make deadline the active deadline for the block; None lifts any deadline."""
+    reset = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(reset)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The active deadline, if any."""
+    return _current_deadline.get()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the active deadline has passed."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.raise_if_expired()
+
+
+def time_budget(limit: Optional[float] = None) -> Optional[float]:
+    """The time left under the active deadline, capped at limit; limit itself if there is no deadline."""
+    deadline = _current_deadline.get()
+    return deadline.budget(limit) if deadline is not None else limit
+
+
+def sleep_within_deadline(seconds: float):
+    """Sleep before a retry, or raise DeadlineExceeded if the deadline would pass first."""
+    budget = time_budget(seconds)
+    if budget is not None and budget < seconds:
+        raise DeadlineExceeded("The request ran out of time before it could be retried")
+    time.sleep(seconds)
@@ -0,0 +1,85 @@
+"""
+Pools of pre-built agent executors.
+
+Building an AgentExecutor validates its tools and prompt and allocates the
+chain objects on every request. A pool builds a few once and lends them
+out; callbacks are passed per run through the invoke config instead of
+being baked into the executor, so a pooled executor carries no request
+state between runs. When every executor is lent out, a temporary one is
+built rather than making the request wait.
+
+    AGENT_EXECUTOR_POOL_SIZE  executors built per pool (default 4)
+    AGENT_VERBOSE             "1" prints agent steps to stdout (default "0")
+"""
+from typing import Dict, List, Any, Callable, Iterator
+from contextlib import contextmanager
+import logging
+import os
+import queue
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+AGENT_EXECUTOR_POOL_SIZE = int(os.getenv("AGENT_EXECUTOR_POOL_SIZE", "4"))
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "0") == "1"
+
+
+class ExecutorPool:
+    """A fixed set of reusable executors, with temporary ones built on overflow."""
+
+    def __init__(self, name: str, factory: Callable[[], Any], size: int = AGENT_EXECUTOR_POOL_SIZE):
+        """
+        Args:
+            name: Pool name, for reporting
+            factory: Builds one executor
+            size: Executors built up front and reused
+        """
+        self.name = name
+        self.factory = factory
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(factory())
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "overflow_builds": 0}
+        with _pools_lock:
+            _pools.append(self)
+
+    @contextmanager
+    def checkout(self) -> Iterator[Any]:
+        """Borrow an executor for one run."""
+        try:
+            executor = self._idle.get_nowait()
+            pooled = True
+        except queue.Empty:
+            executor = self.factory()
+            pooled = False
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["overflow_builds"] += 0 if pooled else 1
+        try:
+            yield executor
+        finally:
+            if pooled:
+                self._idle.put(executor)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "size": self.size, "idle": self._idle.qsize()}
+
+
+_pools: List[ExecutorPool] = []
+_pools_lock = threading.Lock()
+
+
+def get_executor_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Get statistics for every executor pool, adding up pools that share a name."""
+    with _pools_lock:
+        pools = list(_pools)
+    stats: Dict[str, Dict[str, Any]] = {}
+    for pool in pools:
+        totals = stats.setdefault(pool.name, {})
+        for key, value in pool.get_stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return stats
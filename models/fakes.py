@@ -0,0 +1,515 @@
+"""
+Offline stand-ins for Anthropic, Cohere and SerpAPI, for load testing.
+
+Set FAKE_UPSTREAMS=1 and every model, embedding and search created through
+create_llm, create_embeddings and get_search_wrapper is replaced by a local
+fake. The LLM fake replaces the Anthropic SDK client underneath ChatAnthropic,
+so streaming, response parsing, rate limiting and the circuit breaker all run
+exactly as they do against the real API.
+
+Outputs are deterministic for a given prompt and follow the formats our
+parsers expect. Latency, token rate and error rates are configurable:
+
+    FAKE_LLM_LATENCY            seconds to first token (default 0.5)
+    FAKE_LLM_TOKENS_PER_SECOND  streaming rate (default 60)
+    FAKE_LLM_TAIL_RATE          fraction of calls that are slow (default 0)
+    FAKE_LLM_TAIL_MULTIPLIER    how much slower those calls are (default 8)
+    FAKE_LLM_429_RATE           fraction of calls that fail with 429 (default 0)
+    FAKE_LLM_529_RATE           fraction of calls that fail with 529 (default 0)
+    FAKE_SEARCH_LATENCY         seconds per search (default 0.3)
+    FAKE_SEARCH_429_RATE        fraction of searches that fail (default 0)
+    FAKE_EMBED_LATENCY          seconds per embedding request (default 0.05)
+    FAKE_REACT_SEARCHES         searches a fake ReAct agent makes before answering (default 2)
+    FAKE_SEED                   seed for latency jitter and error injection
+"""
+from typing import Dict, List, Any, Iterator, AsyncIterator, Optional, Tuple
+from functools import cached_property
+from langchain_core.embeddings import Embeddings
+from anthropic import APITimeoutError, RateLimitError
+from anthropic._exceptions import OverloadedError
+from anthropic.types import (
+    Message,
+    TextBlock,
+    ToolUseBlock,
+    Usage,
+    MessageDeltaUsage,
+    TextDelta,
+    InputJSONDelta,
+    RawMessageStartEvent,
+    RawContentBlockStartEvent,
+    RawContentBlockDeltaEvent,
+    RawContentBlockStopEvent,
+    RawMessageDeltaEvent,
+    RawMessageStopEvent,
+)
+from anthropic.types.raw_message_delta_event import Delta
+from models.token_budget import token_counter
+import asyncio
+import hashlib
+import httpx
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def fakes_enabled() -> bool:
+    """Whether upstream services should be replaced by local fakes."""
+    return os.getenv("FAKE_UPSTREAMS", "").lower() in ("1", "true", "yes")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+_rng = random.Random(os.getenv("FAKE_SEED", "0"))
+_rng_lock = threading.Lock()
+
+
+def _roll() -> float:
+    with _rng_lock:
+        return _rng.random()
+
+
+def _seeded(text: str) -> random.Random:
+    """A random generator that is deterministic for a given prompt."""
+    return random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+def _first_token_delay() -> float:
+    delay = _env_float("FAKE_LLM_LATENCY", 0.5) * (0.75 + 0.5 * _roll())
+    if _roll() < _env_float("FAKE_LLM_TAIL_RATE", 0.0):
+        delay *= _env_float("FAKE_LLM_TAIL_MULTIPLIER", 8.0)
+    return delay
+
+
+def _error(error_class, status_code: int, error_type: str, message: str) -> Exception:
+    """Build an SDK error carrying the same response body and headers the real API sends."""
+    body = {"type": "error", "error": {"type": error_type, "message": message}}
+    response = httpx.Response(
+        status_code,
+        json=body,
+        headers={"retry-after": "1"},
+        request=httpx.Request("POST", "https://fake.anthropic/v1/messages")
+    )
+    return error_class(message, response=response, body=body)
+
+
+def _timeout_error() -> Exception:
+    """Build the error the SDK raises when a request times out."""
+    return APITimeoutError(request=httpx.Request("POST", "https://fake.anthropic/v1/messages"))
+
+
+def _maybe_fail_llm():
+    """Inject upstream errors at the configured rates."""
+    roll = _roll()
+    rate_429 = _env_float("FAKE_LLM_429_RATE", 0.0)
+    if roll < rate_429:
+        raise _error(RateLimitError, 429, "rate_limit_error", "Fake rate limit exceeded")
+    if roll < rate_429 + _env_float("FAKE_LLM_529_RATE", 0.0):
+        raise _error(OverloadedError, 529, "overloaded_error", "Overloaded")
+
+
+# ---------------------------------------------------------------------------
+# Deterministic replies in the formats our parsers expect
+# ---------------------------------------------------------------------------
+
+_WORDS = [
+    "market", "growth", "customers", "pricing", "adoption", "competition", "margin", "segment",
+    "channel", "retention", "demand", "regulation", "investment", "operations", "capacity", "brand",
+]
+
+
+def _text_of(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, dict):
+                parts.append(str(block.get("text") or block.get("content") or block.get("input") or ""))
+            else:
+                parts.append(str(block))
+        return "\n".join(parts)
+    return str(content or "")
+
+
+def _topic(prompt: str) -> str:
+    match = re.findall(r"Question:\s*(.+)", prompt)
+    text = match[-1] if match else prompt.strip().split("\n")[-1]
+    words = text.split()[:8]
+    return " ".join(words) or "the business"
+
+
+def _sentence(rng: random.Random, topic: str) -> str:
+    words = rng.sample(_WORDS, 3)
+    return (f"For {topic}, {words[0]} and {words[1]} drive {words[2]}, "
+            f"with {rng.randint(5, 45)}% year-over-year change reported in {rng.randint(2022, 2024)}.")
+
+
+def _paragraph(rng: random.Random, topic: str, sentences: int = 3) -> str:
+    return " ".join(_sentence(rng, topic) for _ in range(sentences))
+
+
+def _bullets(rng: random.Random, topic: str, count: int = 5) -> str:
+    return "\n".join(f"- {_sentence(rng, topic)}" for _ in range(count))
+
+
+def _research_report(rng: random.Random, topic: str) -> str:
+    sections = [
+        "Executive Summary", "Research Objectives", "Methodology Overview", "Market Overview",
+        "Exploratory Findings", "Descriptive Analysis", "Predictive Insights", "Competitive Analysis",
+        "Consumer Insights", "Recommendations", "Implementation Plan", "Success Metrics",
+    ]
+    return "\n\n".join(f"{i}. {name}\n{_paragraph(rng, topic, 2)}" for i, name in enumerate(sections, 1))
+
+
+def _fake_reply(system: str, prompt: str) -> str:
+    """Build a deterministic reply shaped like what the real model returns for this prompt."""
+    rng = _seeded(system + "\x00" + prompt)
+    combined = f"{system}\n{prompt}"
+    topic = _topic(prompt)
+
+    if "Team members:" in combined and "JSON object" in combined:
+        members = re.search(r"Team members:\s*(.+)", combined)
+        names = [name.strip() for name in members.group(1).split(",")] if members else ["researcher"]
+        return json.dumps({"next": names[0], "reason": f"{names[0]} should handle {topic}", "is_complete": False})
+
+    if "Action Input:" in combined and "Final Answer:" in combined:
+        # ReAct agent: search FAKE_REACT_SEARCHES times, then answer. The prompt's own
+        # format description has an "Observation: [search result]" line, which is not a search
+        observations = len(re.findall(r"\nObservation: (?!\[search result\])", combined))
+        if observations < int(_env_float("FAKE_REACT_SEARCHES", 2)):
+            query = f"{topic} market size {2023 + observations}"
+            return f"Thought: I need data on {query}.\nAction: Search\nAction Input: {query}"
+        return f"Thought: I now have enough information.\nFinal Answer: {_research_report(rng, topic)}"
+
+    if "search queries" in combined and "one per line" in combined:
+        angles = ["market size", "growth forecast", "key competitors", "customer segments", "pricing trends", "regulation"]
+        return "\n".join(f"{topic} {angle} {rng.randint(2023, 2024)}" for angle in angles)
+
+    if "Write a comprehensive research report" in combined:
+        return _research_report(rng, topic)
+
+    if "running summary" in combined:
+        return _paragraph(rng, "the client", 2)
+
+    if "Generate 3 potential solutions" in combined:
+        return "\n".join(
+            f"Solution {i}: {_sentence(rng, topic)}\n"
+            f"Pros: lower {rng.choice(_WORDS)} risk, faster {rng.choice(_WORDS)}\n"
+            f"Cons: higher {rng.choice(_WORDS)} cost\n"
+            f"Implementation: Pilot in one {rng.choice(_WORDS)} then scale\n"
+            f"Timeline: {rng.randint(3, 18)} months\n"
+            for i in range(1, 4)
+        )
+
+    if "Formulate a final recommendation" in combined:
+        return (
+            f"Recommended Solution:\nSolution {rng.randint(1, 3)}\n"
+            f"Rationale:\n{_paragraph(rng, topic, 2)}\n"
+            f"Implementation Plan:\n{_paragraph(rng, topic, 1)}\n"
+            f"Timeline:\n{rng.randint(6, 24)} months\n"
+            f"Success Metrics:\n{_bullets(rng, topic, 3)}"
+        )
+
+    if "key factors" in combined or "constraints" in combined:
+        return _bullets(rng, topic, 5)
+
+    if "EXECUTIVE SUMMARY:" in combined:
+        headers = [
+            "EXECUTIVE SUMMARY", "RESEARCH OBJECTIVES", "RESEARCH METHODOLOGY", "RESEARCH INSTRUMENTS",
+            "ANALYSIS PLAN", "IMPLEMENTATION PLAN", "DELIVERABLES",
+        ]
+        return "\n\n".join(f"{header}:\n{_paragraph(rng, topic, 2)}" for header in headers)
+
+    return _paragraph(rng, topic, 4)
+
+
+def _fill_schema(schema: Dict[str, Any], defs: Dict[str, Any], rng: random.Random, prompt: str, depth: int) -> Any:
+    """Build a value matching a JSON schema. Top-level strings echo the topic, nested ones are prose."""
+    if "$ref" in schema:
+        schema = defs.get(schema["$ref"].split("/")[-1], {})
+    if "anyOf" in schema:
+        schema = next((option for option in schema["anyOf"] if option.get("type") != "null"), {})
+    kind = schema.get("type")
+    if kind == "object" or "properties" in schema:
+        return {
+            name: _fill_schema(prop, defs, rng, prompt, depth + 1)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [_fill_schema(schema.get("items", {}), defs, rng, prompt, depth + 1) for _ in range(3)]
+    if kind in ("integer", "number"):
+        return rng.randint(1, 10)
+    if kind == "boolean":
+        return True
+    return _topic(prompt) if depth <= 1 else _sentence(rng, _topic(prompt))
+
+
+def _tool_input(tool: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+    """Fill a tool's arguments from its input schema and the prompt."""
+    schema = tool.get("input_schema", {})
+    return _fill_schema(schema, schema.get("$defs", {}), _seeded(prompt), prompt, 0)
+
+
+def _split_tokens(text: str) -> List[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+# ---------------------------------------------------------------------------
+# Fake Anthropic SDK client
+# ---------------------------------------------------------------------------
+
+class _FakeMessages:
+    """Implements client.messages.create for the payloads ChatAnthropic sends."""
+
+    def __init__(self, model: str, timeout: Optional[float] = None):
+        self.model = model
+        self.timeout = timeout
+
+    def _first_token_wait(self) -> Tuple[float, bool]:
+        """Seconds to wait for the first token, and whether the client's timeout cuts the wait short."""
+        delay = _first_token_delay()
+        if self.timeout is not None and delay > self.timeout:
+            return self.timeout, True
+        return delay, False
+
+    def _plan(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        system = _text_of(payload.get("system"))
+        messages = payload.get("messages", [])
+        prompt = "\n".join(_text_of(message.get("content")) for message in messages)
+        input_tokens = token_counter.count(system) + token_counter.count(prompt)
+
+        tools = payload.get("tools") or []
+        # Tool definitions count towards input tokens, as they do upstream
+        input_tokens += token_counter.count(json.dumps(tools)) if tools else 0
+        last_content = messages[-1].get("content") if messages else ""
+        has_tool_result = isinstance(last_content, list) and any(
+            isinstance(block, dict) and block.get("type") == "tool_result" for block in last_content
+        )
+        if tools and not has_tool_result and payload.get("tool_choice", {}).get("type") != "none":
+            tool = tools[0]
+            tool_id = "toolu_fake_" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+            return {"tool": tool, "tool_id": tool_id, "input": _tool_input(tool, prompt),
+                    "input_tokens": input_tokens}
+
+        text = _fake_reply(system, prompt)
+        stop_reason = "end_turn"
+        for stop in payload.get("stop_sequences") or []:
+            if stop in text:
+                text = text[:text.index(stop)]
+                stop_reason = "stop_sequence"
+        text = " ".join(text.split(" ")[:max(1, payload.get("max_tokens", 4096))])
+        return {"text": text, "stop_reason": stop_reason, "input_tokens": input_tokens}
+
+    def _message(self, plan: Dict[str, Any]) -> Message:
+        if "tool" in plan:
+            content = [ToolUseBlock(type="tool_use", id=plan["tool_id"], name=plan["tool"]["name"], input=plan["input"])]
+            output_tokens = token_counter.count(json.dumps(plan["input"]))
+            stop_reason = "tool_use"
+        else:
+            content = [TextBlock(type="text", text=plan["text"])]
+            output_tokens = len(_split_tokens(plan["text"]))
+            stop_reason = plan["stop_reason"]
+        return Message(
+            id="msg_fake", type="message", role="assistant", model=self.model, content=content,
+            stop_reason=stop_reason, stop_sequence=None,
+            usage=Usage(input_tokens=plan["input_tokens"], output_tokens=output_tokens)
+        )
+
+    def _events(self, plan: Dict[str, Any], first_token_delay: float = 0.0) -> Iterator[Any]:
+        """Yield (delay, event) pairs for a streamed response; the first delta waits first_token_delay."""
+        start = self._message(plan).model_copy(update={"content": [], "stop_reason": None})
+        start.usage = Usage(input_tokens=plan["input_tokens"], output_tokens=1)
+        yield 0.0, RawMessageStartEvent(type="message_start", message=start)
+
+        per_token = 1.0 / max(_env_float("FAKE_LLM_TOKENS_PER_SECOND", 60.0), 1e-6)
+        if "tool" in plan:
+            block = ToolUseBlock(type="tool_use", id=plan["tool_id"], name=plan["tool"]["name"], input={})
+            yield 0.0, RawContentBlockStartEvent(type="content_block_start", index=0, content_block=block)
+            arguments = json.dumps(plan["input"])
+            # Roughly one token per four characters of JSON
+            for start in range(0, len(arguments), 4):
+                yield per_token + (first_token_delay if start == 0 else 0.0), RawContentBlockDeltaEvent(
+                    type="content_block_delta", index=0,
+                    delta=InputJSONDelta(type="input_json_delta", partial_json=arguments[start:start + 4])
+                )
+            stop_reason, output_tokens = "tool_use", token_counter.count(arguments)
+        else:
+            yield 0.0, RawContentBlockStartEvent(
+                type="content_block_start", index=0, content_block=TextBlock(type="text", text="")
+            )
+            tokens = _split_tokens(plan["text"])
+            for index, token in enumerate(tokens):
+                yield per_token + (first_token_delay if index == 0 else 0.0), RawContentBlockDeltaEvent(
+                    type="content_block_delta", index=0, delta=TextDelta(type="text_delta", text=token)
+                )
+            stop_reason, output_tokens = plan["stop_reason"], len(tokens)
+
+        yield 0.0, RawContentBlockStopEvent(type="content_block_stop", index=0)
+        yield 0.0, RawMessageDeltaEvent(
+            type="message_delta",
+            delta=Delta(stop_reason=stop_reason, stop_sequence=None),
+            usage=MessageDeltaUsage(output_tokens=output_tokens)
+        )
+        yield 0.0, RawMessageStopEvent(type="message_stop")
+
+    def create(self, **payload: Any) -> Any:
+        plan = self._plan(payload)
+        delay, timed_out = self._first_token_wait()
+        if payload.get("stream"):
+            # Like the real API, the stream opens at once and the wait is for its first token
+            _maybe_fail_llm()
+            return _FakeStream(self._events(plan, delay), timed_out)
+        time.sleep(delay)
+        if timed_out:
+            raise _timeout_error()
+        _maybe_fail_llm()
+        per_token = 1.0 / max(_env_float("FAKE_LLM_TOKENS_PER_SECOND", 60.0), 1e-6)
+        message = self._message(plan)
+        time.sleep(per_token * message.usage.output_tokens)
+        return message
+
+
+
+class _FakeStream:
+    """A streamed response that, like the SDK's Stream, can be closed from another thread."""
+
+    def __init__(self, events: Iterator[Any], timed_out: bool = False):
+        self._events = events
+        self._timed_out = timed_out
+        self._closed = threading.Event()
+
+    def __iter__(self) -> Iterator[Any]:
+        waited = False
+        for delay, event in self._events:
+            if delay and self._closed.wait(delay):
+                raise httpx.StreamClosed()
+            if self._timed_out and delay and not waited:
+                # The client's timeout ran out waiting for the first token
+                raise _timeout_error()
+            waited = waited or bool(delay)
+            yield event
+
+    def close(self):
+        self._closed.set()
+
+
+class _FakeAsyncMessages(_FakeMessages):
+    async def create(self, **payload: Any) -> Any:
+        plan = self._plan(payload)
+        delay, timed_out = self._first_token_wait()
+        await asyncio.sleep(delay)
+        if timed_out:
+            raise _timeout_error()
+        _maybe_fail_llm()
+        if payload.get("stream"):
+            return self._astream(plan)
+        per_token = 1.0 / max(_env_float("FAKE_LLM_TOKENS_PER_SECOND", 60.0), 1e-6)
+        message = self._message(plan)
+        await asyncio.sleep(per_token * message.usage.output_tokens)
+        return message
+
+    async def _astream(self, plan: Dict[str, Any]) -> AsyncIterator[Any]:
+        for delay, event in self._events(plan):
+            if delay:
+                await asyncio.sleep(delay)
+            yield event
+
+
+class FakeAnthropicClient:
+    """Drop-in for anthropic.Client as used by ChatAnthropic."""
+
+    def __init__(self, model: str, timeout: Optional[float] = None):
+        self.model = model
+        self.messages = _FakeMessages(model, timeout)
+
+    def with_options(self, timeout: Optional[float] = None, **kwargs: Any) -> "FakeAnthropicClient":
+        """A copy with a request timeout; the fake makes no retries, so max_retries is ignored."""
+        return FakeAnthropicClient(self.model, timeout)
+
+
+class FakeAsyncAnthropicClient:
+    """Drop-in for anthropic.AsyncClient as used by ChatAnthropic."""
+
+    def __init__(self, model: str, timeout: Optional[float] = None):
+        self.model = model
+        self.messages = _FakeAsyncMessages(model, timeout)
+
+    def with_options(self, timeout: Optional[float] = None, **kwargs: Any) -> "FakeAsyncAnthropicClient":
+        return FakeAsyncAnthropicClient(self.model, timeout)
+
+
+def make_fake_chat_model_class(base_class):
+    """Subclass a ChatAnthropic class so it talks to the fake client."""
+
+    class FakeChatAnthropic(base_class):
+        """ChatAnthropic backed by a local fake of the Anthropic API."""
+
+        @cached_property
+        def _fake_client(self):
+            return FakeAnthropicClient(self.model)
+
+        @property
+        def _client(self):
+            # Keeps any per-request options the base class sets, e.g. a deadline's timeout
+            bound_client = getattr(base_class, "_bound_client", None)
+            return bound_client(self, self._fake_client) if bound_client else self._fake_client
+
+        @cached_property
+        def _async_client(self):
+            return FakeAsyncAnthropicClient(self.model)
+
+    return FakeChatAnthropic
+
+
+# ---------------------------------------------------------------------------
+# Fake embeddings and search
+# ---------------------------------------------------------------------------
+
+class FakeEmbeddings(Embeddings):
+    """Drop-in for CohereEmbeddings producing deterministic unit vectors."""
+
+    def __init__(self, dimensions: int = 1024, **kwargs: Any):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        rng = _seeded(text)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(_env_float("FAKE_EMBED_LATENCY", 0.05))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(_env_float("FAKE_EMBED_LATENCY", 0.05))
+        return self._embed(text)
+
+
+class FakeSearchWrapper:
+    """Drop-in for SerpAPIWrapper returning deterministic result snippets."""
+
+    def run(self, query: str, **kwargs: Any) -> str:
+        time.sleep(_env_float("FAKE_SEARCH_LATENCY", 0.3) * (0.75 + 0.5 * _roll()))
+        if _roll() < _env_float("FAKE_SEARCH_429_RATE", 0.0):
+            raise ValueError("Got error from SerpAPI: Your account has run out of searches.")
+        rng = _seeded(query)
+        topic = " ".join(query.split()[:8])
+        snippets = [
+            f"{_sentence(rng, topic)} Source: example-{rng.randint(1, 99)}.com ({rng.randint(2022, 2024)})"
+            for _ in range(3)
+        ]
+        return str(snippets)
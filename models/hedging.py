@@ -0,0 +1,310 @@
+"""
+Hedged LLM requests.
+
+A hedged call streams its request and waits for the first chunk. If none
+has arrived by a high percentile of the model's recent time to first token,
+an identical request is sent. The first of the two to produce a chunk wins,
+and the other's upstream stream is closed at once, even while it is still
+waiting for its first token, so it costs little more than its input tokens.
+A budget keeps hedges to a fraction of hedgeable calls over a sliding window.
+
+    LLM_HEDGE_PERCENTILE      TTFT percentile that triggers a hedge (default 95)
+    LLM_HEDGE_MIN_SAMPLES     recent TTFT samples needed before hedging (default 20)
+    LLM_HEDGE_MIN_DELAY       never hedge sooner than this, in seconds (default 0.5)
+    LLM_HEDGE_BUDGET          max hedges as a fraction of calls, 0 disables (default 0.1)
+    LLM_HEDGE_WINDOW_SECONDS  window the budget is measured over (default 300)
+"""
+from typing import Dict, List, Any, Optional, Callable, Iterator
+from collections import deque
+from models.telemetry import llm_metrics
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+HEDGE_WINDOW_SECONDS = float(os.getenv("LLM_HEDGE_WINDOW_SECONDS", "300"))
+
+_DONE = object()
+
+
+class HedgePolicy:
+    """Decides when to hedge, and caps how many extra requests hedging sends."""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 min_delay: float = HEDGE_MIN_DELAY, budget: float = HEDGE_BUDGET,
+                 window_seconds: float = HEDGE_WINDOW_SECONDS):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self.window_seconds = window_seconds
+        self._calls = deque()
+        self._hedges = deque()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0, "losers_cancelled": 0}
+
+    def delay_for(self, model: str) -> Optional[float]:
+        """Seconds to wait for a first chunk before hedging, or None if there is too little data."""
+        ttft = llm_metrics.ttft_percentile(model, self.percentile, self.min_samples)
+        if ttft is None:
+            return None
+        return max(ttft, self.min_delay)
+
+    def _trim(self, now: float):
+        for events in (self._calls, self._hedges):
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+            self._stats["calls"] += 1
+
+    def try_hedge(self) -> bool:
+        """Take a hedge from the budget, if there is one left."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) + 1 > self.budget * len(self._calls):
+                self._stats["budget_denied"] += 1
+                return False
+            self._hedges.append(now)
+            self._stats["hedges"] += 1
+            return True
+
+    def record_outcome(self, hedge_won: bool, loser_cancelled: bool):
+        with self._lock:
+            self._stats["hedge_wins"] += 1 if hedge_won else 0
+            self._stats["losers_cancelled"] += 1 if loser_cancelled else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                **self._stats,
+                "percentile": self.percentile,
+                "budget": self.budget,
+                "window_calls": len(self._calls),
+                "window_hedges": len(self._hedges),
+            }
+
+
+hedge_policy = HedgePolicy()
+
+
+def get_hedging_stats() -> Dict[str, Any]:
+    """Get how often calls were hedged and how often the hedge won."""
+    return hedge_policy.get_stats()
+
+
+def _has_token(chunk: Any) -> bool:
+    """Whether a chunk carries output, text or a tool call, rather than only metadata."""
+    message = getattr(chunk, "message", None)
+    return bool(getattr(chunk, "text", None) or getattr(message, "tool_call_chunks", None))
+
+
+class _AttemptStreams:
+    """Upstream streams opened by one attempt, so a losing attempt can be closed while it waits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: List[Any] = []
+        self.closed = False
+
+    def add(self, stream: Any):
+        with self._lock:
+            if not self.closed:
+                self._streams.append(stream)
+                return
+        # The attempt lost before its request returned
+        stream.close()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            streams, self._streams = self._streams, []
+        for stream in streams:
+            try:
+                stream.close()
+            except Exception as e:
+                logger.debug(f"Closing a losing hedge attempt failed: {str(e)}")
+
+
+_current_attempt: contextvars.ContextVar[Optional[_AttemptStreams]] = contextvars.ContextVar(
+    "hedge_attempt", default=None
+)
+
+
+class _TrackedMessages:
+    """client.messages that records the streams it opens with the current attempt."""
+
+    def __init__(self, messages: Any, attempt: _AttemptStreams):
+        self._messages = messages
+        self._attempt = attempt
+
+    def create(self, **kwargs: Any) -> Any:
+        response = self._messages.create(**kwargs)
+        if kwargs.get("stream"):
+            self._attempt.add(response)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._messages, name)
+
+
+class _TrackedClient:
+    """An SDK client whose streams can be closed from the hedging thread."""
+
+    def __init__(self, client: Any, attempt: _AttemptStreams):
+        self._client = client
+        self.messages = _TrackedMessages(client.messages, attempt)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def track_streams(client: Any) -> Any:
+    """The client, recording the streams it opens if it is used by a hedged attempt."""
+    attempt = _current_attempt.get()
+    return client if attempt is None else _TrackedClient(client, attempt)
+
+
+class _Race:
+    """Attempts at the same streamed request; the first to produce a chunk wins."""
+
+    def __init__(self, factory: Callable[[], Iterator[Any]]):
+        self.factory = factory
+        self.cond = threading.Condition()
+        self.winner: Optional[int] = None
+        self.errors: List[BaseException] = []
+        self.attempts = 0
+        self.streams: List[_AttemptStreams] = []
+        self.finished = set()
+        self.abandoned = False
+        self.chunks = queue.Queue()
+
+    def launch(self):
+        with self.cond:
+            attempt = self.attempts
+            self.attempts += 1
+            self.streams.append(_AttemptStreams())
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run, attempt),
+            name=f"llm-hedge-{attempt}",
+            daemon=True
+        ).start()
+
+    def _run(self, attempt: int):
+        stream = None
+        _current_attempt.set(self.streams[attempt])
+        try:
+            stream = self.factory()
+            # Chunks sent before the first token, e.g. usage, are held until the attempt wins
+            held = []
+            for chunk in stream:
+                with self.cond:
+                    if self.winner is None and _has_token(chunk):
+                        self.winner = attempt
+                        self.cond.notify_all()
+                    if (self.winner is not None and self.winner != attempt) or self.abandoned:
+                        return
+                    won = self.winner == attempt
+                held.append(chunk)
+                if won:
+                    for held_chunk in held:
+                        self.chunks.put(held_chunk)
+                    held = []
+            with self.cond:
+                # A response without any tokens still wins if it finishes first
+                if self.winner is None:
+                    self.winner = attempt
+                    self.cond.notify_all()
+                won = self.winner == attempt
+            if won:
+                for held_chunk in held:
+                    self.chunks.put(held_chunk)
+                self.chunks.put(_DONE)
+        except BaseException as e:
+            with self.cond:
+                self.errors.append(e)
+                self.cond.notify_all()
+                won = self.winner == attempt
+            if won:
+                self.chunks.put(e)
+        finally:
+            with self.cond:
+                self.finished.add(attempt)
+            if stream is not None:
+                stream.close()
+
+    def close_losers(self) -> int:
+        """Close the upstream streams of attempts that lost but are still running; returns how many."""
+        with self.cond:
+            losers = [
+                self.streams[attempt] for attempt in range(self.attempts)
+                if attempt != self.winner and attempt not in self.finished
+            ]
+        for streams in losers:
+            streams.close()
+        return len(losers)
+
+    def wait_for_winner(self, timeout: Optional[float]) -> bool:
+        """Wait until an attempt wins or every attempt has failed. Returns False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: self.winner is not None or len(self.errors) >= self.attempts,
+                timeout
+            )
+
+
+def hedged_stream(factory: Callable[[], Iterator[Any]], model: str,
+                  policy: HedgePolicy = hedge_policy) -> Iterator[Any]:
+    """
+    Stream a request, hedging it with a duplicate if the first chunk is slow.
+
+    Args:
+        factory: Starts the request and returns its chunk iterator; called once per attempt
+        model: Model name, to look up its recent TTFT
+        policy: Hedging policy and budget
+
+    Returns:
+        Iterator: Chunks of the winning attempt
+    """
+    policy.record_call()
+    delay = policy.delay_for(model)
+    race = _Race(factory)
+    race.launch()
+
+    if not race.wait_for_winner(delay) and delay is not None and policy.try_hedge():
+        logger.info(f"No first token from {model} after {delay:.2f}s, sending a hedged request")
+        race.launch()
+    race.wait_for_winner(None)
+
+    if race.winner is None:
+        raise race.errors[0]
+    if race.attempts > 1:
+        policy.record_outcome(hedge_won=race.winner == 1, loser_cancelled=race.close_losers() > 0)
+
+    try:
+        while True:
+            item = race.chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        with race.cond:
+            race.abandoned = True
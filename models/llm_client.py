@@ -0,0 +1,311 @@
+from typing import List, Optional, Any, Iterator, AsyncIterator
+from langchain_anthropic import ChatAnthropic
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult, ChatGenerationChunk
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from pydantic import Field
+from anthropic import RateLimitError
+from models.rate_limiter import get_rate_limiter, retry_after_seconds
+from models.circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker, is_upstream_failure
+from models.token_budget import token_counter
+from models.cancellation import check_cancelled
+from models.deadline import check_deadline, current_deadline, time_budget
+from models.fakes import fakes_enabled, make_fake_chat_model_class, FakeEmbeddings
+from models.telemetry import llm_telemetry
+from models.hedging import hedged_stream, track_streams
+import asyncio
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "claude-3-5-sonnet-20240620"
+
+
+def _estimate_input_tokens(messages: List[BaseMessage]) -> int:
+    """Estimate the input tokens of a request for rate limiting."""
+    return sum(token_counter.count(str(message.content)) + 4 for message in messages)
+
+
+def _input_tokens_from_message(message: BaseMessage) -> Optional[int]:
+    """Read the real input token count from a response message, if reported."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("input_tokens"):
+        return usage["input_tokens"]
+    return None
+
+
+class ManagedChatAnthropic(ChatAnthropic):
+    """
+    ChatAnthropic that goes through the process-wide client-side controls.
+
+    Every request acquires from the shared Anthropic rate limiter before it is
+    sent, and an upstream 429 pauses the limiter for all callers instead of
+    letting each agent retry on its own. Requests also pass through a circuit
+    breaker per model: while it is open they fail fast with CircuitOpenError,
+    or go to fallback_model if one is configured.
+
+    Calls can be hedged, either every invoke with hedge=True or per call with
+    invoke(..., hedge=True) or stream(..., hedge=True): see models/hedging.py.
+    This works for streaming=True models too.
+
+    Under a request deadline (models/deadline.py) the timeout and retries
+    configured here are upper bounds: each request gets at most the time
+    left, and only as many retries as fit in it.
+    """
+
+    provider: str = "anthropic"
+    fallback_model: Optional[str] = Field(default_factory=lambda: os.getenv("LLM_FALLBACK_MODEL") or None)
+    hedge: bool = False
+
+    def _breaker(self) -> CircuitBreaker:
+        return get_circuit_breaker(self.model)
+
+    @property
+    def _client(self):
+        return self._bound_client(ChatAnthropic._client.__get__(self))
+
+    def _bound_client(self, client):
+        """
+        The SDK client for this request: limited to the active deadline's time
+        left, and tracking its streams if it is a hedged attempt.
+        """
+        deadline = current_deadline()
+        if deadline is not None:
+            timeout = deadline.budget(self.default_request_timeout)
+            # Every attempt may take the whole timeout, so keep only the retries that fit before the deadline
+            retries = min(self.max_retries, max(0, int(deadline.remaining() // max(timeout, 1e-3)) - 1))
+            client = client.with_options(timeout=timeout, max_retries=retries)
+        return track_streams(client)
+
+    def _check_circuit(self) -> Optional["ManagedChatAnthropic"]:
+        """Return None if the call may go ahead, or the fallback model to use instead."""
+        try:
+            self._breaker().before_call()
+            return None
+        except CircuitOpenError:
+            if not self.fallback_model or self.fallback_model == self.model:
+                raise
+            logger.warning(f"Circuit open for {self.model}, falling back to {self.fallback_model}")
+            return self.model_copy(update={"model": self.fallback_model, "fallback_model": None})
+
+    def _record_error(self, error: Exception):
+        if isinstance(error, RateLimitError):
+            get_rate_limiter(self.provider).pause(retry_after_seconds(error))
+        deadline = current_deadline()
+        # A timeout cut short by the request's deadline says nothing about the upstream
+        if is_upstream_failure(error) and not (deadline is not None and deadline.expired):
+            self._breaker().record_failure()
+        else:
+            self._breaker().record_ignored()
+
+    def _acquire(self, messages: List[BaseMessage]) -> int:
+        # A cancelled run does not queue for the rate limit
+        check_cancelled()
+        check_deadline()
+        estimate = _estimate_input_tokens(messages)
+        get_rate_limiter(self.provider).acquire(estimate, timeout=time_budget())
+        return estimate
+
+    async def _aacquire(self, messages: List[BaseMessage]) -> int:
+        check_deadline()
+        estimate = _estimate_input_tokens(messages)
+        await asyncio.to_thread(get_rate_limiter(self.provider).acquire, estimate, time_budget())
+        return estimate
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        hedge = kwargs.pop("hedge", self.hedge)
+        # Checked first: a streaming model's invoke comes through here too
+        if hedge:
+            return self._generate_hedged(messages, stop=stop, run_manager=run_manager, **kwargs)
+        if self.streaming:
+            # Streaming requests are managed in _stream
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        fallback = self._check_circuit()
+        if fallback is not None:
+            return fallback._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            estimate = self._acquire(messages)
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as e:
+            self._record_error(e)
+            if isinstance(e, Exception):
+                check_deadline()
+            raise
+        self._breaker().record_success()
+        get_rate_limiter(self.provider).settle(
+            estimate, _input_tokens_from_message(result.generations[0].message)
+        )
+        return result
+
+    def _generate_hedged(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate by streaming, with a hedged duplicate request if the first token is slow."""
+        # Each attempt goes through _stream, so it has its own breaker check and rate limit
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, hedge=True, **kwargs))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if kwargs.pop("hedge", False):
+            # Each attempt is a plain _stream; the winner's tokens are reported here
+            for chunk in hedged_stream(lambda: self._stream(messages, stop=stop, **kwargs), self.model):
+                if run_manager and chunk.text:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+            return
+        fallback = self._check_circuit()
+        if fallback is not None:
+            yield from fallback._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        settled = False
+        try:
+            estimate = self._acquire(messages)
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                # Abandons the stream, and the upstream request with it, once the run is
+                # cancelled or out of time
+                check_cancelled()
+                check_deadline()
+                if not settled:
+                    actual = _input_tokens_from_message(chunk.message)
+                    if actual is not None:
+                        get_rate_limiter(self.provider).settle(estimate, actual)
+                        settled = True
+                yield chunk
+        except BaseException as e:
+            # Includes GeneratorExit when the consumer stops early
+            self._record_error(e)
+            if isinstance(e, Exception):
+                # A timeout at the deadline is reported as the deadline passing
+                check_deadline()
+            raise
+        self._breaker().record_success()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Async calls are not hedged
+        kwargs.pop("hedge", None)
+        if self.streaming:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        fallback = self._check_circuit()
+        if fallback is not None:
+            return await fallback._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            estimate = await self._aacquire(messages)
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as e:
+            self._record_error(e)
+            raise
+        self._breaker().record_success()
+        get_rate_limiter(self.provider).settle(
+            estimate, _input_tokens_from_message(result.generations[0].message)
+        )
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        kwargs.pop("hedge", None)
+        fallback = self._check_circuit()
+        if fallback is not None:
+            async for chunk in fallback._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        settled = False
+        try:
+            estimate = await self._aacquire(messages)
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                if not settled:
+                    actual = _input_tokens_from_message(chunk.message)
+                    if actual is not None:
+                        get_rate_limiter(self.provider).settle(estimate, actual)
+                        settled = True
+                yield chunk
+        except BaseException as e:
+            self._record_error(e)
+            raise
+        self._breaker().record_success()
+
+
+FakeManagedChatAnthropic = make_fake_chat_model_class(ManagedChatAnthropic)
+
+
+def create_llm(model: str = DEFAULT_MODEL, **kwargs: Any) -> ChatAnthropic:
+    """
+    Create a chat model for use by the agents.
+
+    Args:
+        model: Anthropic model name
+        **kwargs: Any other ChatAnthropic arguments
+
+    Returns:
+        ChatAnthropic: A rate-limited, circuit-broken chat model with telemetry,
+        backed by a local fake when FAKE_UPSTREAMS is set
+    """
+    kwargs["callbacks"] = [*(kwargs.get("callbacks") or []), llm_telemetry]
+    if fakes_enabled():
+        kwargs.pop("api_key", None)
+        kwargs["anthropic_api_key"] = "fake"
+        return FakeManagedChatAnthropic(model=model, **kwargs)
+    if "api_key" not in kwargs and "anthropic_api_key" not in kwargs:
+        kwargs["anthropic_api_key"] = os.getenv("ANTHROPIC_API_KEY")
+    return ManagedChatAnthropic(model=model, **kwargs)
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings wrapper that acquires from a provider's shared rate limiter."""
+
+    def __init__(self, embeddings: Embeddings, provider: str = "cohere"):
+        self.embeddings = embeddings
+        self.provider = provider
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        get_rate_limiter(self.provider).acquire(sum(token_counter.count(text) for text in texts))
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        get_rate_limiter(self.provider).acquire(token_counter.count(text))
+        return self.embeddings.embed_query(text)
+
+
+def create_embeddings(**kwargs: Any) -> Embeddings:
+    """
+    Create the Cohere embeddings used for document search.
+
+    Args:
+        **kwargs: CohereEmbeddings arguments
+
+    Returns:
+        Embeddings: Rate-limited embeddings, backed by a local fake when FAKE_UPSTREAMS is set
+    """
+    if fakes_enabled():
+        return RateLimitedEmbeddings(FakeEmbeddings())
+    from langchain_cohere import CohereEmbeddings
+    return RateLimitedEmbeddings(CohereEmbeddings(**kwargs))
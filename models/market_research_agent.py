@@ -1,13 +1,28 @@
-from typing import List, Dict, Any, Generator
-from langchain_anthropic import ChatAnthropic
-from langchain.agents import AgentExecutor, create_react_agent
+from typing import List, Dict, Any, Generator, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from models.llm_client import create_llm
+from langchain.agents import AgentExecutor, create_react_agent, create_tool_calling_agent
 from langchain_core.tools import Tool
-from langchain_community.utilities import SerpAPIWrapper
+from models.search_tools import run_search, run_search_for_agent
+from models.observation_compressor import observation_focus
+from models.cancellation import check_cancelled
+from models.deadline import (
+    DeadlineExceeded, check_deadline, sleep_within_deadline, current_deadline, deadline_scope, time_budget
+)
+from models.circuit_breaker import error_event_fields
+from models.telemetry import llm_step
+from models.session_history import get_session_history
+from models.executor_pool import ExecutorPool, AGENT_VERBOSE
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from pydantic import BaseModel, Field
 from langchain.callbacks.base import BaseCallbackHandler
+import contextvars
 import json
 import os
+import queue
+import re
+import threading
 from dotenv import load_dotenv
 import time
 import logging
@@ -16,10 +31,84 @@ from anthropic._exceptions import OverloadedError, RateLimitError, APIError
 # Configure logging
 logger = logging.getLogger(__name__)
 
+
+def _progress(message: str):
+    """Report agent progress: logged at debug level, and printed only when AGENT_VERBOSE is set."""
+    logger.debug(message.strip())
+    if AGENT_VERBOSE:
+        print(message)
+
+# Longest tool output streamed to the client as an observation
+OBSERVATION_PREVIEW_CHARS = 1000
+
+_DONE = object()
+
+# Previous messages of the session included in the research prompt
+HISTORY_CONTEXT_MESSAGES = 3
+
+# Longest an agent run may take when the request sets no deadline
+AGENT_MAX_EXECUTION_TIME = 600
+# A partial report is only written if at least this much of the deadline is left
+PARTIAL_REPORT_MIN_SECONDS = 5
+
+# "tools" is an agent that calls search as a native tool, several searches per iteration;
+# "react" parses one search per iteration from the model's text;
+# "plan" plans all searches up front and runs them concurrently
+RESEARCH_MODES = ('tools', 'react', 'plan')
+# Iteration and token (input + output) budget of a "tools" run; once spent, what was found is written up
+TOOL_AGENT_MAX_ITERATIONS = int(os.getenv("MARKET_RESEARCH_MAX_ITERATIONS", "5"))
+TOOL_AGENT_TOKEN_BUDGET = int(os.getenv("MARKET_RESEARCH_TOKEN_BUDGET", "50000"))
+PLAN_MAX_QUERIES = int(os.getenv("MARKET_RESEARCH_PLAN_QUERIES", "6"))
+PLAN_SEARCH_WORKERS = int(os.getenv("MARKET_RESEARCH_SEARCH_WORKERS", "6"))
+
+# Searches of planned research, shared by all requests
+_search_executor = ThreadPoolExecutor(max_workers=PLAN_SEARCH_WORKERS, thread_name_prefix="market-research-search")
+
+REPORT_STRUCTURE = """Research Report Structure:
+1. Executive Summary
+2. Research Objectives
+3. Methodology Overview
+   - Research Types Used
+   - Methods Applied
+   - Data Sources
+4. Market Overview
+5. Exploratory Findings
+6. Descriptive Analysis
+7. Predictive Insights
+8. Competitive Analysis
+9. Consumer Insights
+10. Recommendations
+    - Short-term Actions
+    - Long-term Strategy
+    - Risk Mitigation
+11. Implementation Plan
+12. Success Metrics
+"""
+
+PLAN_PROMPT = """You are an expert market research analyst planning web research. Write up to {max_queries}
+specific search queries that together cover what is needed to answer the question: market size and
+growth, trends, competitors, customers and risks. Use concrete terms, names and years.
+Return only the queries, one per line, without numbering or commentary."""
+
+TOOLS_PROMPT = """You are an expert market research analyst. Use the Search tool to gather evidence on
+market size and growth, trends, competitors, customers and risks. Request several searches at once when
+they do not depend on each other, and stop searching as soon as you can answer.
+Write a comprehensive research report that answers the question, citing sources and dates, using
+concrete numbers and statistics, and focusing on actionable insights.
+
+""" + REPORT_STRUCTURE
+
+SYNTHESIS_PROMPT = """You are an expert market research analyst. Write a comprehensive research report that
+answers the question using the search results provided. Always cite sources and dates, use concrete
+numbers and statistics, and focus on actionable insights.
+
+""" + REPORT_STRUCTURE
+
 def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
-    """Execute a function with exponential backoff retry logic."""
+    """Execute a function with exponential backoff retry logic, within the request deadline."""
     last_error = None
     for attempt in range(max_retries):
+        check_deadline()
         try:
             return func()
         except Exception as e:
@@ -32,7 +121,7 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
                         if attempt < max_retries - 1:
                             delay = min(base_delay * (2 ** attempt), max_delay)
                             logger.warning(f"Attempt {attempt + 1} failed with overloaded error. Retrying in {delay} seconds...")
-                            time.sleep(delay)
+                            sleep_within_deadline(delay)
                             continue
                         else:
                             raise Exception("The AI service is currently experiencing high demand. Please try again in a few moments.")
@@ -40,7 +129,7 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
                         if attempt < max_retries - 1:
                             delay = min(base_delay * (2 ** attempt), max_delay)
                             logger.warning(f"Attempt {attempt + 1} failed with rate limit error. Retrying in {delay} seconds...")
-                            time.sleep(delay)
+                            sleep_within_deadline(delay)
                             continue
                         else:
                             raise Exception("Rate limit exceeded. Please try again in a few moments.")
@@ -49,6 +138,8 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
                         error_message = error_data.get('error', {}).get('message', str(e))
                         logger.error(f"API Error: {error_message}")
                         raise Exception(error_message)
+                except DeadlineExceeded:
+                    raise
                 except Exception as parse_error:
                     logger.error(f"Error parsing API response: {str(parse_error)}")
                     raise Exception(str(e))
@@ -59,17 +150,77 @@ def retry_with_backoff(func, max_retries=3, base_delay=2, max_delay=10):
     if last_error:
         raise last_error
 
+class SearchInput(BaseModel):
+    """Arguments of the Search tool."""
+    query: str = Field(description="A specific search query, with names, markets and years where relevant")
+
+def _text_content(content: Any) -> str:
+    """The text of a message's content, which is a list of blocks when tools are bound."""
+    if isinstance(content, list):
+        return "".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or block.get("type") == "text"
+        )
+    return str(content)
+
+def _usage_of(response) -> Dict[str, int]:
+    """Token usage reported with an LLM result, if any."""
+    try:
+        return response.generations[0][0].message.usage_metadata or {}
+    except (AttributeError, IndexError):
+        return {}
+
+class ResearchBudgetExceeded(Exception):
+    """The agent spent its token budget before answering."""
+
+class TokenBudgetCallbackHandler(BaseCallbackHandler):
+    """Stops an agent before its next model call once it has spent its token budget."""
+
+    # Errors from this handler must reach the agent instead of being logged and ignored
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        if self.used >= self.budget:
+            raise ResearchBudgetExceeded(f"Token budget of {self.budget} spent")
+
+    def on_llm_end(self, response, **kwargs):
+        usage = _usage_of(response)
+        self.used += usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+
 class StreamingCallbackHandler(BaseCallbackHandler):
-    """Callback handler for streaming intermediate steps."""
+    """
+    Callback handler for streaming intermediate steps.
+
+    Each thought, action, observation and final answer is put on the events
+    queue as soon as it is complete, so a consumer in another thread can
+    stream it while the agent is still running.
+    """
     
-    def __init__(self):
+    def __init__(self, events: Optional[queue.Queue] = None):
         self.tokens = []
+        self.events = events
+        self._pending = None
+        # Type of the last token parsed from the LLM's own output since the last agent step
+        self._streamed_type = None
         self.current_content = ""
-        print("\n=== Starting new research session ===\n")
+        # (search, observation) for each tool call, for a partial answer if the run is cut short
+        self.findings = []
+        self._action_input = None
+        # Latency and token usage of each agent iteration, for the run's metrics
+        self.iterations = []
+        self._iteration_start = None
+        _progress("\n=== Starting new research session ===\n")
         
     def on_llm_start(self, *args, **kwargs):
         """Run when LLM starts running."""
-        print("\n🤔 LLM is thinking...\n")
+        self._iteration_start = time.monotonic()
+        _progress("\n🤔 LLM is thinking...\n")
 
     def on_llm_new_token(self, token: str, **kwargs):
         """Process tokens and emit complete thoughts/actions/observations."""
@@ -96,8 +247,8 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         elif lower_line.startswith("action:"):
             self._emit_token("action", line)
         elif lower_line.startswith("action input:"):
-            if self.tokens and self.tokens[-1]["type"] == "action":
-                self.tokens[-1]["content"] += f"\n{line}"
+            if self._pending and self._pending["type"] == "action":
+                self._pending["content"] += f"\n{line}"
             else:
                 self._emit_token("action", line)
         elif lower_line.startswith("observation:"):
@@ -105,9 +256,9 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         elif lower_line.startswith("final answer:"):
             self._emit_token("final", line[13:].strip())  # Remove "Final Answer:" prefix
         else:
-            # If it's a continuation of previous content
-            if self.tokens and self.tokens[-1]["type"] in ["thought", "observation", "action", "final"]:
-                self.tokens[-1]["content"] += f"\n{line}"
+            # If it's a continuation of content that has not been sent yet
+            if self._pending and self._pending["type"] in ["thought", "observation", "action", "final"]:
+                self._pending["content"] += f"\n{line}"
             else:
                 self._emit_token("thought", line)
     
@@ -115,42 +266,119 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         """Emit a token with proper formatting."""
         if not content.strip():
             return
-            
+
+        # A new token completes the previous one
+        self._flush()
         token = {
             "status": "streaming",
             "type": type_,
             "content": content.strip()
         }
         self.tokens.append(token)
-        print(f"\n💭 Emitting {type_}: {content.strip()}\n")
+        self._pending = token
+        self._streamed_type = type_
+        _progress(f"\n💭 Emitting {type_}: {content.strip()}\n")
+
+    def _flush(self):
+        """Send the token that was still collecting continuation lines."""
+        if self._pending is not None and self.events is not None:
+            self.events.put(self._pending)
+        self._pending = None
 
-    def on_llm_end(self, *args, **kwargs):
-        """Process any remaining content."""
+    def on_llm_end(self, response, **kwargs):
+        """Process any remaining content and record the iteration."""
         if self.current_content.strip():
             self._process_line(self.current_content.strip())
         self.current_content = ""
+        self._flush()
+        self._record_iteration(response)
+
+    def _record_iteration(self, response):
+        usage = _usage_of(response)
+        self.iterations.append({
+            "seconds": round(time.monotonic() - (self._iteration_start or time.monotonic()), 3),
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+        })
+
+    def get_run_metrics(self) -> Dict[str, Any]:
+        """Iterations, per-iteration latency and total tokens of the run so far."""
+        count = len(self.iterations)
+        seconds = sum(i["seconds"] for i in self.iterations)
+        return {
+            "iterations": count,
+            "seconds_per_iteration": round(seconds / count, 3) if count else 0.0,
+            "input_tokens": sum(i["input_tokens"] for i in self.iterations),
+            "output_tokens": sum(i["output_tokens"] for i in self.iterations),
+            "per_iteration": self.iterations,
+        }
 
     def on_agent_action(self, action, **kwargs):
         """Handle agent actions with proper formatting."""
-        action_str = f"Action: {action.tool}\nAction Input: {action.tool_input}"
-        self._emit_token("action", action_str)
+        tool_input = action.tool_input
+        # Tool calls carry their arguments as a dict
+        if isinstance(tool_input, dict) and len(tool_input) == 1:
+            tool_input = next(iter(tool_input.values()))
+        self._action_input = str(tool_input)
+        # Skip the action if it was already streamed from the LLM's output
+        if self._streamed_type != "action":
+            action_str = f"Action: {action.tool}\nAction Input: {tool_input}"
+            self._emit_token("action", action_str)
+        self._flush()
+        self._streamed_type = None
+
+    def on_tool_end(self, output, **kwargs):
+        """Emit the tool's result as an observation."""
+        observation = str(output)
+        self.findings.append((self._action_input or "", observation))
+        if len(observation) > OBSERVATION_PREVIEW_CHARS:
+            observation = observation[:OBSERVATION_PREVIEW_CHARS] + "..."
+        self._emit_token("observation", f"Observation: {observation}")
+        self._flush()
         
     def on_agent_finish(self, finish, **kwargs):
         """Handle agent completion with proper formatting."""
-        if finish.return_values and "output" in finish.return_values:
-            output = finish.return_values["output"]
+        output = _text_content((finish.return_values or {}).get("output") or "")
+        # A forced stop is not an answer; research_stream writes up what was found instead
+        if output and self._streamed_type != "final" and not output.startswith("Agent stopped"):
             if not output.lower().startswith("final answer:"):
                 output = "Final Answer: " + output
             self._emit_token("final", output)
-        print("\n=== Research session completed ===\n")
+        self._flush()
+        _progress("\n=== Research session completed ===\n")
+
+class ToolCallingCallbackHandler(StreamingCallbackHandler):
+    """
+    Callback handler for streaming a tool-calling agent's steps.
+
+    Nothing is parsed from the model's text: text that comes with tool calls
+    is the agent's reasoning and is sent as a thought, searches arrive as
+    structured agent actions, and the answer comes from the agent's finish.
+    """
+
+    def on_llm_new_token(self, token, **kwargs):
+        # With tools bound, tokens arrive as content blocks
+        self.current_content += _text_content(token)
+
+    def on_llm_end(self, response, **kwargs):
+        """Send the reasoning that came with the iteration's tool calls, and record the iteration."""
+        try:
+            tool_calls = response.generations[0][0].message.tool_calls
+        except (AttributeError, IndexError):
+            tool_calls = []
+        if tool_calls and self.current_content.strip():
+            self._emit_token("thought", f"Thought: {self.current_content.strip()}")
+        self.current_content = ""
+        self._flush()
+        self._record_iteration(response)
 
 class MarketResearchAgent:
     def __init__(self):
-        print("\n🔄 Initializing Market Research Agent...")
+        _progress("\n🔄 Initializing Market Research Agent...")
         
         # Initialize the language model with better error handling
         try:
-            self.llm = ChatAnthropic(
+            self.llm = create_llm(
                 model="claude-3-5-sonnet-20240620",
                 anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
                 temperature=0.7,
@@ -159,22 +387,18 @@ class MarketResearchAgent:
                 timeout=60,
                 max_retries=3
             )
-            print("✅ LLM initialized")
+            _progress("✅ LLM initialized")
         except Exception as e:
             logger.error(f"Failed to initialize LLM: {str(e)}")
             raise
         
-        # Initialize SerpAPI tool
-        self.search = SerpAPIWrapper(
-            serpapi_api_key=os.getenv("SERPAPI_API_KEY")
-        )
-        print("✅ Search tool initialized")
-        
-        # Define tools
+        # Define tools; searches go through the shared SerpAPI rate limiter and
+        # results are compressed before they enter the scratchpad
         self.tools = [
             Tool(
                 name="Search",
-                func=self.search.run,
+                func=run_search_for_agent,
+                args_schema=SearchInput,
                 description="A powerful search tool for finding recent market information, company data, industry trends, and statistics. Use specific search queries for best results."
             )
         ]
@@ -240,26 +464,7 @@ Observation: [search result]
 Thought: [final analysis reasoning]
 Final Answer: [structured analysis]
 
-Research Report Structure:
-1. Executive Summary
-2. Research Objectives
-3. Methodology Overview
-   - Research Types Used
-   - Methods Applied
-   - Data Sources
-4. Market Overview
-5. Exploratory Findings
-6. Descriptive Analysis
-7. Predictive Insights
-8. Competitive Analysis
-9. Consumer Insights
-10. Recommendations
-    - Short-term Actions
-    - Long-term Strategy
-    - Risk Mitigation
-11. Implementation Plan
-12. Success Metrics
-
+""" + REPORT_STRUCTURE + """
 Previous conversation (last 3):
 {chat_history}
 
@@ -268,7 +473,7 @@ Question: {input}
 
         # Create the prompt template with all required variables
         self.prompt = PromptTemplate.from_template(template)
-        print("✅ Prompt template created")
+        _progress("✅ Prompt template created")
         
         # Create the agent using create_react_agent
         self.agent = create_react_agent(
@@ -276,38 +481,298 @@ Question: {input}
             tools=self.tools,
             prompt=self.prompt
         )
-        print("✅ Agent created")
-        
-        self.chat_history = []
-        print("✅ Market Research Agent initialization complete\n")
+        _progress("✅ Agent created")
+
+        # The tool-calling agent gets the tools through the API, so its prompt needs no
+        # tool list or output format, and its tool calls need no parsing
+        self.tools_prompt = ChatPromptTemplate.from_messages([
+            ("system", TOOLS_PROMPT),
+            MessagesPlaceholder("chat_history", optional=True),
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad")
+        ])
+        self.tool_agent = create_tool_calling_agent(self.llm, self.tools, self.tools_prompt)
+        _progress("✅ Tool-calling agent created")
+
+        # Executors are built once and reused; each run passes its own callbacks
+        self.executor_pool = ExecutorPool("market_research", self._build_executor)
+        self.tool_executor_pool = ExecutorPool("market_research_tools", self._build_tool_executor)
+        _progress("✅ Agent executors built")
+        _progress("✅ Market Research Agent initialization complete\n")
+
+    def _build_executor(self) -> AgentExecutor:
+        """Build an executor for the ReAct agent, without per-request callbacks."""
+        return AgentExecutor.from_agent_and_tools(
+            agent=self.agent,
+            tools=self.tools,
+            handle_parsing_errors=True,
+            max_iterations=8,
+            max_execution_time=AGENT_MAX_EXECUTION_TIME,
+            early_stopping_method="force",
+            verbose=AGENT_VERBOSE
+        )
 
-    def research_stream(self, query: str) -> Generator[Dict[str, Any], None, None]:
+    def _build_tool_executor(self) -> AgentExecutor:
+        """Build an executor for the tool-calling agent, without per-request callbacks."""
+        return AgentExecutor.from_agent_and_tools(
+            agent=self.tool_agent,
+            tools=self.tools,
+            max_iterations=TOOL_AGENT_MAX_ITERATIONS,
+            max_execution_time=AGENT_MAX_EXECUTION_TIME,
+            early_stopping_method="force",
+            verbose=AGENT_VERBOSE
+        )
+
+    @llm_step()
+    def plan_queries(self, query: str) -> List[str]:
+        """
+        Plan the searches for a research question in a single call.
+
+        Args:
+            query: The research question
+
+        Returns:
+            List[str]: Up to PLAN_MAX_QUERIES distinct search queries
+        """
+        messages = [
+            SystemMessage(content=PLAN_PROMPT.format(max_queries=PLAN_MAX_QUERIES)),
+            HumanMessage(content=query)
+        ]
+        response = retry_with_backoff(lambda: self.llm.invoke(messages))
+        queries = []
+        for line in response.content.split('\n'):
+            # Drop numbering, bullets and quotes the model adds anyway
+            line = re.sub(r'^\s*(?:\d+[.)]|[-*•])\s*', '', line).strip().strip('"')
+            if line and line.lower() not in (q.lower() for q in queries):
+                queries.append(line)
+        return queries[:PLAN_MAX_QUERIES] or [query]
+
+    @llm_step()
+    def synthesize_report(self, query: str, results: Dict[str, str],
+                          chat_history: Optional[List[Dict[str, Any]]] = None) -> Generator[str, None, None]:
+        """
+        Write the research report from the search results, streaming its tokens.
+
+        Args:
+            query: The research question
+            results: Search result text by search query
+            chat_history: Previous messages of the session, oldest first
+
+        Yields:
+            str: Pieces of the report as they are generated
+        """
+        findings = "\n\n".join(f"Search: {search}\nResults: {result}" for search, result in results.items())
+        messages = [SystemMessage(content=SYNTHESIS_PROMPT)]
+        messages.extend(self._history_messages(chat_history))
+        messages.append(HumanMessage(content=f"Question: {query}\n\n{findings}"))
+        for chunk in self.llm.stream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    def _partial_report(self, query: str, findings: List[Any], chat_history, report: str = "") -> str:
+        """
+        Best-effort report for research cut short by the deadline or the agent's limits.
+
+        Args:
+            query: The research question
+            findings: (search, result) pairs gathered before the research stopped
+            chat_history: Previous messages of the session, oldest first
+            report: Report text already written, if synthesis was cut short
+
+        Returns:
+            str: The report so far, a report written in the time left, or the raw findings
+        """
+        budget = time_budget()
+        if not report and findings and (budget is None or budget >= PARTIAL_REPORT_MIN_SECONDS):
+            pieces = []
+            try:
+                for piece in self.synthesize_report(query, dict(findings), chat_history):
+                    pieces.append(piece)
+            except DeadlineExceeded:
+                pass
+            except Exception as e:
+                logger.warning(f"Partial report failed: {str(e)}")
+            report = "".join(pieces)
+        if report:
+            return report + "\n\n_This report is incomplete: the research was cut short._"
+        if not findings:
+            return "The research was cut short before any results came in. Please try again or narrow the question."
+        summary = "\n\n".join(
+            f"**{search}**\n{result[:OBSERVATION_PREVIEW_CHARS]}" for search, result in findings
+        )
+        return f"The research was cut short before a report could be written. What was found so far:\n\n{summary}"
+
+    def research_plan_stream(self, query: str,
+                             chat_history: Optional[List[Dict[str, Any]]] = None) -> Generator[Dict[str, Any], None, None]:
+        """
+        Research by planning every search up front, running them concurrently,
+        and writing the report in one call.
+
+        Takes two model calls however many searches are made, instead of one
+        per ReAct iteration. Events have the same shape as the ReAct stream,
+        plus "report" events with the report's text as it is written.
+
+        Args:
+            query: The research question
+            chat_history: Previous messages of the session, oldest first
+
+        Yields:
+            Dict[str, Any]: Thought, action, observation, report and final events
+        """
+        try:
+            yield from self._research_planned(query, chat_history)
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(error_msg)
+            yield {
+                "status": "error",
+                "type": "error",
+                "content": error_msg,
+                **error_event_fields(e)
+            }
+
+    def _research_planned(self, query: str, chat_history) -> Generator[Dict[str, Any], None, None]:
+        _progress(f"\n📝 Planning research for query: {query}")
+        deadline = current_deadline()
+        # Searches stop early enough to leave time for the report
+        search_deadline = deadline.reserve() if deadline is not None else None
+        try:
+            queries = self.plan_queries(query)
+        except DeadlineExceeded:
+            # Searching for the question itself is better than nothing
+            queries = [query]
+        yield {
+            "status": "streaming",
+            "type": "thought",
+            "content": "Thought: I will run these searches:\n" + "\n".join(f"- {q}" for q in queries)
+        }
+
+        futures = {
+            _search_executor.submit(contextvars.copy_context().run, run_search, search): search
+            for search in queries
+        }
+        results = {}
+        try:
+            for future in as_completed(futures, timeout=search_deadline.remaining() if search_deadline else None):
+                search = futures[future]
+                try:
+                    results[search] = future.result()
+                except Exception as e:
+                    logger.warning(f"Search failed for '{search}': {str(e)}")
+                    results[search] = f"Search failed: {str(e)}"
+                observation = results[search]
+                if len(observation) > OBSERVATION_PREVIEW_CHARS:
+                    observation = observation[:OBSERVATION_PREVIEW_CHARS] + "..."
+                yield {
+                    "status": "streaming",
+                    "type": "action",
+                    "content": f"Action: Search\nAction Input: {search}"
+                }
+                yield {
+                    "status": "streaming",
+                    "type": "observation",
+                    "content": f"Observation: {observation}"
+                }
+        except TimeoutError:
+            logger.warning(f"Research ran out of time with {len(futures) - len(results)} searches unfinished")
+
+        # Nothing to synthesize for if the client has gone away
+        check_cancelled()
+        # Keep the planned order so the report prompt does not depend on search timing
+        findings = [(q, results[q]) for q in queries if q in results]
+        partial = len(findings) < len(queries)
+        pieces = []
+        try:
+            if findings:
+                # The report streams as it is written; the final event carries all of it
+                for piece in self.synthesize_report(query, dict(findings), chat_history):
+                    pieces.append(piece)
+                    yield {
+                        "status": "streaming",
+                        "type": "report",
+                        "content": piece
+                    }
+        except DeadlineExceeded:
+            partial = True
+        report = "".join(pieces)
+        if partial:
+            _progress("\n⏱️ Research ran out of time, writing up what was found")
+            report = self._partial_report(query, findings, chat_history, report)
+        _progress("\n=== Research session completed ===\n")
+
+        event = {
+            "status": "complete",
+            "type": "final",
+            "content": "Final Answer: " + report
+        }
+        if partial:
+            event["partial"] = True
+        yield event
+
+    @staticmethod
+    def _history_messages(chat_history: Optional[List[Dict[str, Any]]]) -> List[Any]:
+        """The session's most recent messages as chat messages."""
+        return [
+            HumanMessage(content=msg["content"]) if msg.get("role") == "human" else AIMessage(content=msg["content"])
+            for msg in (chat_history or [])[-HISTORY_CONTEXT_MESSAGES:]
+        ]
+
+    @llm_step()
+    def research_stream(self, query: str, mode: str = "tools",
+                        chat_history: Optional[List[Dict[str, Any]]] = None) -> Generator[Dict[str, Any], None, None]:
         """
         Stream the research process and results.
+
+        Args:
+            query: The research question
+            mode: "tools" for the tool-calling agent, "react" for the text-parsed ReAct agent,
+                or "plan" for planned concurrent searches
+            chat_history: Previous messages of the session, oldest first, as returned by get_chat_history
         """
+        if mode not in RESEARCH_MODES:
+            raise ValueError(f"Unknown research mode: {mode}")
+        if mode == "plan":
+            yield from self.research_plan_stream(query, chat_history)
+            return
+
         try:
-            print(f"\n📝 Starting comprehensive research for query: {query}")
-            handler = StreamingCallbackHandler()
-            
-            agent_executor = AgentExecutor.from_agent_and_tools(
-                agent=self.agent,
-                tools=self.tools,
-                handle_parsing_errors=True,
-                max_iterations=8,
-                max_execution_time=600,
-                callbacks=[handler],
-                early_stopping_method="force",
-                verbose=True
-            )
+            _progress(f"\n📝 Starting comprehensive research for query: {query}")
+            events = queue.Queue()
+            if mode == "tools":
+                handler = ToolCallingCallbackHandler(events)
+                callbacks = [handler, TokenBudgetCallbackHandler(TOOL_AGENT_TOKEN_BUDGET)]
+                pool = self.tool_executor_pool
+            else:
+                handler = StreamingCallbackHandler(events)
+                callbacks = [handler]
+                pool = self.executor_pool
+            # The agent stops early enough to leave time for a partial answer
+            deadline = current_deadline()
+            agent_deadline = deadline.reserve() if deadline is not None else None
             
             try:
                 # Run the agent with enhanced retry logic
                 def _execute_research():
                     try:
-                        return agent_executor.invoke({
-                            "input": query,
-                            "chat_history": self.chat_history[-3:]
-                        })
+                        # Passed per run so the agent's LLM calls and tools report to the handler too
+                        with pool.checkout() as agent_executor:
+                            if agent_deadline is None:
+                                return agent_executor.invoke({
+                                    "input": query,
+                                    "chat_history": self._history_messages(chat_history)
+                                }, config={"callbacks": callbacks})
+                            # Pooled executors are shared between runs, so the limit is put back afterwards
+                            agent_executor.max_execution_time = agent_deadline.remaining()
+                            try:
+                                with deadline_scope(agent_deadline):
+                                    return agent_executor.invoke({
+                                        "input": query,
+                                        "chat_history": self._history_messages(chat_history)
+                                    }, config={"callbacks": callbacks})
+                            finally:
+                                agent_executor.max_execution_time = AGENT_MAX_EXECUTION_TIME
+                    except (DeadlineExceeded, ResearchBudgetExceeded):
+                        raise
                     except Exception as e:
                         if hasattr(e, 'response'):
                             response = e.response
@@ -321,59 +786,111 @@ Question: {input}
                                 raise Exception(error_message)
                         raise
                 
-                response = retry_with_backoff(_execute_research)
-                
-                # Update chat history
-                self.chat_history.extend([
-                    HumanMessage(content=query),
-                    AIMessage(content=response["output"])
-                ])
-                
-                # Stream tokens
-                for token in handler.tokens:
+                # The agent runs in its own thread and the handler queues each step as it completes
+                outcome = {}
+
+                def _run():
+                    try:
+                        outcome["response"] = retry_with_backoff(_execute_research)
+                    except Exception as e:
+                        outcome["error"] = e
+                    finally:
+                        events.put(_DONE)
+
+                # Observations are ranked against the research question
+                with observation_focus(query):
+                    agent_thread = threading.Thread(
+                        target=contextvars.copy_context().run,
+                        args=(_run,),
+                        name="market-research-agent",
+                        daemon=True
+                    )
+                agent_thread.start()
+
+                # Stream tokens while the agent runs, but no longer than it has
+                while True:
+                    try:
+                        token = events.get(timeout=agent_deadline.remaining() if agent_deadline else None)
+                    except queue.Empty:
+                        # Whatever the agent is blocked on is left to fail at the deadline on its own
+                        outcome.setdefault("error", DeadlineExceeded("The research ran out of time"))
+                        break
+                    if token is _DONE:
+                        break
                     yield token
-                
+
+                output = _text_content(outcome.get("response", {}).get("output") or "")
+                # Out of time or tokens, or stopped by the agent's own time or iteration limit
+                stopped_early = isinstance(outcome.get("error"), (DeadlineExceeded, ResearchBudgetExceeded)) or (
+                    output.startswith("Agent stopped")
+                )
+                if stopped_early:
+                    _progress("\n⏱️ Research stopped early, writing up what was found")
+                    metrics = handler.get_run_metrics()
+                    yield {
+                        "status": "complete",
+                        "type": "final",
+                        "content": "Final Answer: " + self._partial_report(query, list(handler.findings), chat_history),
+                        "partial": True,
+                        "metrics": metrics
+                    }
+                    return
+                if "error" in outcome:
+                    raise outcome["error"]
+
                 # Ensure final response is sent
-                if response.get("output"):
-                    final_content = response["output"]
+                if output:
+                    final_content = output
                     if not final_content.lower().startswith("final answer:"):
                         final_content = "Final Answer: " + final_content
                         
+                    metrics = handler.get_run_metrics()
+                    logger.info(
+                        f"Research run: {metrics['iterations']} iterations, "
+                        f"{metrics['seconds_per_iteration']}s per iteration, "
+                        f"{metrics['input_tokens']} input / {metrics['output_tokens']} output tokens"
+                    )
                     yield {
                         "status": "complete",
                         "type": "final",
-                        "content": final_content
+                        "content": final_content,
+                        "metrics": metrics
                     }
                 
             except Exception as e:
                 error_msg = str(e)
-                print(f"\n❌ {error_msg}")
+                logger.error(error_msg)
                 yield {
                     "status": "error",
                     "type": "error",
-                    "content": error_msg
+                    "content": error_msg,
+                    **error_event_fields(e)
                 }
             
         except Exception as e:
             error_msg = f"Critical error in research_stream: {str(e)}"
-            print(f"\n❌ {error_msg}")
+            logger.error(error_msg)
             yield {
                 "status": "error",
                 "type": "error",
                 "content": error_msg
             }
 
-    def get_chat_history(self) -> List[Dict[str, str]]:
+    def get_chat_history(self, user_id: Optional[str] = None, thread_id: Optional[str] = None) -> List[Dict[str, str]]:
         """
-        Get the chat history in a structured format.
+        Get a session's chat history in a structured format.
+
+        Args:
+            user_id: Owner of the session, or None for anonymous requests
+            thread_id: Conversation within the user's sessions
         
         Returns:
-            List[Dict[str, str]]: List of messages with role and content
+            List[Dict[str, str]]: List of messages with role, content and timestamp
         """
-        return [
-            {
-                "role": "human" if isinstance(msg, HumanMessage) else "ai",
-                "content": msg.content
-            }
-            for msg in self.chat_history[-5:]  # Only return last 5 messages
-        ] 
\ No newline at end of file
+        return get_session_history().get(user_id, thread_id, limit=5)  # Only return last 5 messages
+
+    def record_exchange(self, user_id: Optional[str], thread_id: Optional[str], query: str, answer: str):
+        """Add a research question and its answer to the session's history."""
+        history = get_session_history()
+        history.append(user_id, thread_id, "human", query)
+        history.append(user_id, thread_id, "ai", answer)
@@ -0,0 +1,178 @@
+from typing import Dict, List, Any, Optional, Callable
+from langchain_core.messages import BaseMessage
+from models.llm_client import create_llm
+from models.telemetry import estimate_cost
+from models.deadline import DeadlineExceeded
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Model used for each tier, cheapest first
+MODEL_TIERS = {
+    "fast": os.getenv("MODEL_TIER_FAST", "claude-3-haiku-20240307"),
+    "balanced": os.getenv("MODEL_TIER_BALANCED", "claude-3-5-sonnet-20240620"),
+    "deep": os.getenv("MODEL_TIER_DEEP", "claude-3-opus-20240229"),
+}
+TIER_ORDER = ["fast", "balanced", "deep"]
+
+class _RoutingReport:
+    """Per-route record of which tier served each step, and what it cost."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        # Latency of every model across all routes, to estimate baseline latency
+        self._model_latency: Dict[str, List[float]] = {}
+
+    def record(self, route: str, step: str, tier: str, model: str, baseline_model: str,
+               latency: float, input_tokens: int, output_tokens: int, escalated: bool):
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                "calls": 0,
+                "escalations": 0,
+                "tiers": {},
+                "steps": {},
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+                "baseline_cost_usd": 0.0,
+                "latency_by_model": {},
+            })
+            entry["calls"] += 1
+            entry["escalations"] += 1 if escalated else 0
+            entry["tiers"][tier] = entry["tiers"].get(tier, 0) + 1
+            entry["steps"].setdefault(step, {})
+            entry["steps"][step][tier] = entry["steps"][step].get(tier, 0) + 1
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["cost_usd"] += estimate_cost(model, input_tokens, output_tokens)
+            entry["baseline_cost_usd"] += estimate_cost(baseline_model, input_tokens, output_tokens)
+            latency_entry = entry["latency_by_model"].setdefault(model, [0, 0.0])
+            latency_entry[0] += 1
+            latency_entry[1] += latency
+            self._model_latency.setdefault(model, [0, 0.0])
+            self._model_latency[model][0] += 1
+            self._model_latency[model][1] += latency
+            entry["baseline_model"] = baseline_model
+
+    def get_report(self) -> Dict[str, Any]:
+        with self._lock:
+            report = {}
+            for route, entry in self._routes.items():
+                baseline_model = entry["baseline_model"]
+                baseline_latency = self._model_latency.get(baseline_model)
+                baseline_avg = baseline_latency[1] / baseline_latency[0] if baseline_latency else None
+
+                total_latency = sum(total for _, total in entry["latency_by_model"].values())
+                latency_saved = None
+                if baseline_avg is not None:
+                    latency_saved = round(baseline_avg * entry["calls"] - total_latency, 3)
+
+                report[route] = {
+                    "calls": entry["calls"],
+                    "escalations": entry["escalations"],
+                    "tiers": dict(entry["tiers"]),
+                    "steps": {step: dict(tiers) for step, tiers in entry["steps"].items()},
+                    "input_tokens": entry["input_tokens"],
+                    "output_tokens": entry["output_tokens"],
+                    "avg_latency_seconds": {
+                        model: round(total / count, 3)
+                        for model, (count, total) in entry["latency_by_model"].items()
+                    },
+                    "baseline_model": baseline_model,
+                    "estimated_cost_usd": round(entry["cost_usd"], 4),
+                    "estimated_savings_usd": round(entry["baseline_cost_usd"] - entry["cost_usd"], 4),
+                    "estimated_latency_saved_seconds": latency_saved,
+                }
+            return report
+
+
+routing_report = _RoutingReport()
+
+
+def get_routing_report() -> Dict[str, Any]:
+    """Get the per-route latency and savings report."""
+    return routing_report.get_report()
+
+
+class ModelRouter:
+    """
+    Picks a model per agent step by tier (fast, balanced, deep).
+
+    Each step declares the cheapest tier that is usually good enough. If the
+    output fails the step's validator the call is retried one tier up, until
+    max_tier. Every call is recorded in the routing report against what it
+    would have cost on the baseline tier.
+    """
+
+    def __init__(self, route: str, baseline_tier: str = "balanced", **llm_kwargs: Any):
+        self.route = route
+        self.baseline_tier = baseline_tier
+        self.llm_kwargs = llm_kwargs
+        self._llms = {}
+        self._lock = threading.Lock()
+
+    def get_llm(self, tier: str):
+        """Get the chat model for a tier."""
+        with self._lock:
+            if tier not in self._llms:
+                self._llms[tier] = create_llm(model=MODEL_TIERS[tier], **self.llm_kwargs)
+            return self._llms[tier]
+
+    def invoke(self, messages: Any, step: str, tier: str = "balanced", max_tier: Optional[str] = None,
+               validate: Optional[Callable[[BaseMessage], bool]] = None, hedge: bool = False) -> BaseMessage:
+        """
+        Invoke the model for a step, escalating when validation fails.
+
+        Args:
+            messages: Prompt to send (string or list of messages)
+            step: Name of the agent step, for reporting
+            tier: Starting tier
+            max_tier: Highest tier to escalate to, defaults to the baseline tier
+            validate: Returns True if the response is usable
+            hedge: Hedge each call against a slow first token
+
+        Returns:
+            BaseMessage: The first valid response, or the last one if none validated or
+            the request's deadline passed while escalating
+        """
+        max_tier = max_tier or self.baseline_tier
+        tiers = TIER_ORDER[TIER_ORDER.index(tier):TIER_ORDER.index(max_tier) + 1] or [tier]
+        baseline_model = MODEL_TIERS[self.baseline_tier]
+
+        response = None
+        for attempt, current_tier in enumerate(tiers):
+            llm = self.get_llm(current_tier)
+            start = time.monotonic()
+            try:
+                response = llm.invoke(messages, config={"metadata": {"step": step}}, hedge=hedge)
+            except DeadlineExceeded:
+                if response is None:
+                    raise
+                # An answer that failed validation beats none at all
+                logger.warning(f"{self.route}.{step}: ran out of time escalating to {current_tier}")
+                return response
+            latency = time.monotonic() - start
+
+            usage = getattr(response, "usage_metadata", None) or {}
+            routing_report.record(
+                self.route, step, current_tier, llm.model, baseline_model, latency,
+                usage.get("input_tokens", 0), usage.get("output_tokens", 0), attempt > 0
+            )
+
+            if validate is None:
+                return response
+            try:
+                if validate(response):
+                    return response
+            except Exception as e:
+                logger.debug(f"Validator for {self.route}.{step} raised: {str(e)}")
+            if attempt < len(tiers) - 1:
+                logger.info(f"{self.route}.{step}: {current_tier} output failed validation, escalating")
+
+        logger.warning(f"{self.route}.{step}: no tier produced a valid response")
+        return response
@@ -1,6 +1,5 @@
 from langchain.agents import Tool
 from langchain_community.utilities import SerpAPIWrapper
-from langchain_anthropic import ChatAnthropic
 from config.settings import ANTHROPIC_API_KEY
 import logging
 from datetime import datetime
@@ -17,22 +16,45 @@ from dotenv import load_dotenv
 import os
 from models.agent_teams import create_report_generator, create_research_team, create_writing_team
 from models.market_research_agent import MarketResearchAgent
+from models.token_budget import get_history_budget, trim_chat_history
+from models.session_history import get_session_history
+from models.circuit_breaker import error_event_fields
+from models.cancellation import check_cancelled
+from models.deadline import DeadlineExceeded, current_deadline, deadline_scope
+from models.model_router import ModelRouter
+from models.telemetry import llm_step
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Tier used for research design; escalates to "deep" only when sections are missing
+RESEARCH_MODEL_TIER = os.getenv("RESEARCH_MODEL_TIER", "balanced")
+
+RESEARCH_SECTIONS = [
+    "Executive Summary",
+    "Research Objectives",
+    "Research Methodology",
+    "Research Instruments",
+    "Analysis Plan",
+    "Implementation Plan",
+    "Deliverables"
+]
+
 class ResearchAssistantSystem:
     """A comprehensive research assistant system with multiple specialized agents."""
     
     def __init__(self):
         """Initialize the research assistant system with multiple specialized agents."""
-        # Initialize the primary language model
-        self.llm = ChatAnthropic(
-            model="claude-3-opus-20240229",
+        # Initialize the model router; this system used Opus for everything before,
+        # so savings are reported against the deep tier
+        self.router = ModelRouter(
+            "multi_agent",
+            baseline_tier="deep",
             anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
             temperature=0.7,
             max_tokens=4000
         )
+        self.llm = self.router.get_llm(RESEARCH_MODEL_TIER)
         
         # Initialize the market research agent
         self.market_research_agent = MarketResearchAgent()
@@ -46,9 +68,6 @@ class ResearchAssistantSystem:
         # Initialize the writing team
         self.writing_team = create_writing_team(self.llm)
         
-        # Initialize chat history
-        self.chat_history = []
-        
         # Enhanced prompt for research design with more detailed instructions
         self.research_prompt = """You are an expert research consultant specializing in designing comprehensive research studies. Your role is to create detailed research proposals and study designs based on the client's query.
 
@@ -144,6 +163,7 @@ For each section, provide specific, actionable details that can be directly impl
 
 Remember to tailor your response to the specific research query provided. Focus on creating a research design that will yield valuable insights for the client's specific needs. Be thorough, precise, and professional in your recommendations."""
 
+    @llm_step()
     def generate_research_plan(self, query, client_info=None):
         """Generate a comprehensive research proposal with a single API call."""
         try:
@@ -176,7 +196,14 @@ Remember to tailor your response to the specific research query provided. Focus
                 HumanMessage(content=query)
             ]
             
-            response = self.llm.invoke(messages)
+            response = self.router.invoke(
+                messages,
+                step="generate_research_plan",
+                tier=RESEARCH_MODEL_TIER,
+                max_tier="deep",
+                validate=self._has_research_sections,
+                hedge=True
+            )
             
             # Parse the response into sections
             content = response.content
@@ -202,6 +229,11 @@ Remember to tailor your response to the specific research query provided. Focus
             logger.error(f"Error generating research plan: {str(e)}")
             return {"error": str(e)}
 
+    def _has_research_sections(self, response, minimum=5):
+        """Validate that a research design contains most of the required sections."""
+        found = sum(1 for name in RESEARCH_SECTIONS if self._extract_section(response.content, name))
+        return found >= minimum
+
     def _extract_section(self, text, section_name):
         """Extract specific sections from the response text."""
         try:
@@ -235,6 +267,7 @@ Remember to tailor your response to the specific research query provided. Focus
             logger.error(f"Error extracting section {section_name}: {str(e)}")
             return ""
 
+    @llm_step()
     def get_answer(self, query: str, user_id: str, chat_history: list = None) -> dict:
         """Get answer with a single API call."""
         try:
@@ -257,6 +290,29 @@ Remember to tailor your response to the specific research query provided. Focus
                 "status": "error"
             }
 
+    def get_chat_history(self, user_id: str = None, thread_id: str = None) -> list:
+        """
+        Get a session's stored chat history in the format clients send it.
+
+        Args:
+            user_id: Owner of the session, or None for anonymous requests
+            thread_id: Conversation within the user's sessions
+
+        Returns:
+            list: Messages with role "user" or "assistant" and content
+        """
+        return [
+            {"role": "user" if msg["role"] == "human" else "assistant", "content": msg["content"]}
+            for msg in get_session_history().get(user_id, thread_id)
+        ]
+
+    def record_exchange(self, user_id: str, thread_id: str, query: str, sections: list):
+        """Add a research question and the designed study's sections to the session's history."""
+        answer = "\n\n".join(f"{section['title'].upper()}:\n{section['content']}" for section in sections)
+        history = get_session_history()
+        history.append(user_id, thread_id, "human", query)
+        history.append(user_id, thread_id, "ai", answer)
+
     def _determine_query_type(self, query: str) -> str:
         """Determine the type of research query based on keywords."""
         focus_group_keywords = ["focus group", "focus groups", "group discussion", "group interview"]
@@ -272,6 +328,7 @@ Remember to tailor your response to the specific research query provided. Focus
         else:
             return "general"
 
+    @llm_step()
     def research_stream(self, query: str, chat_history: list = None) -> Generator[Dict[str, Any], None, None]:
         """Stream research design results with a multi-agent approach."""
         try:
@@ -287,21 +344,25 @@ Remember to tailor your response to the specific research query provided. Focus
                 "content": "Gathering market insights and research context..."
             }
             
-            # Stream market research insights
+            # Stream market research insights, leaving at least half the time left for the design
             market_insights = ""
+            deadline = current_deadline()
             try:
-                for chunk in self.market_research_agent.research_stream(query):
-                    if chunk.get("type") == "final":
-                        # Extract key insights from market research
-                        market_insights = chunk.get("content", "")
-                        yield {
-                            "type": "status",
-                            "content": "Market research complete. Designing research methodology..."
-                        }
-                        break
+                with deadline_scope(deadline.child(deadline.remaining() / 2) if deadline else None):
+                    for chunk in self.market_research_agent.research_stream(query):
+                        if chunk.get("type") == "final":
+                            # Extract key insights from market research
+                            market_insights = chunk.get("content", "")
+                            yield {
+                                "type": "status",
+                                "content": "Market research complete. Designing research methodology..."
+                            }
+                            break
             except Exception as e:
                 logger.warning(f"Error in market research: {str(e)}")
                 market_insights = "Market research data unavailable."
+            # Market research fails softly, so a cancelled run has to stop here
+            check_cancelled()
             
             # Create a comprehensive prompt with market insights
             combined_prompt = f"""
@@ -342,9 +403,9 @@ Remember to tailor your response to the specific research query provided. Focus
                 HumanMessage(content=query)
             ]
             
-            # Add chat history if provided
+            # Add chat history if provided, trimmed to the route's token budget
             if chat_history and isinstance(chat_history, list):
-                for msg in chat_history:
+                for msg in trim_chat_history(chat_history, get_history_budget("multi_agent")):
                     if msg.get('role') == 'user':
                         messages.append(HumanMessage(content=msg.get('content', '')))
                     elif msg.get('role') == 'assistant':
@@ -352,7 +413,13 @@ Remember to tailor your response to the specific research query provided. Focus
             
             # Stream the response
             try:
-                response = self.llm.invoke(messages)
+                response = self.router.invoke(
+                    messages,
+                    step="research_stream",
+                    tier=RESEARCH_MODEL_TIER,
+                    max_tier="deep",
+                    validate=self._has_research_sections
+                )
                 
                 # Yield the response in chunks
                 content = response.content
@@ -417,11 +484,25 @@ Remember to tailor your response to the specific research query provided. Focus
                 
                 # Log completion
                 logger.info("Research stream completed successfully")
+            except DeadlineExceeded:
+                logger.warning("Research design ran out of time, returning the market research only")
+                yield {
+                    "type": "final",
+                    "content": {
+                        "sections": [{"title": "Market Research", "content": market_insights}],
+                        "metadata": {
+                            "query": query,
+                            "timestamp": datetime.now().isoformat()
+                        }
+                    },
+                    "partial": True
+                }
             except Exception as e:
                 logger.error(f"Error in LLM response: {str(e)}")
                 yield {
                     "type": "error",
-                    "content": f"Error generating research design: {str(e)}"
+                    "content": f"Error generating research design: {str(e)}",
+                    **error_event_fields(e)
                 }
         except Exception as e:
             logger.error(f"Error in research_stream: {str(e)}")
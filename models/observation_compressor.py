@@ -0,0 +1,203 @@
+"""
+Compression of long tool outputs before they enter an agent's scratchpad.
+
+A ReAct agent re-sends every earlier observation on each iteration, so raw
+search results and scraped pages make the prompt grow with the square of
+the iteration count. Observations over the token budget are cut down to the
+snippets most relevant to the query: first by a local keyword-overlap
+score, and only when that finds nothing relevant in a long text, by a small
+model asked to extract the relevant facts. Either way the result is capped
+at the budget.
+
+    OBSERVATION_MAX_TOKENS        token budget per observation, 0 disables compression (default 400)
+    OBSERVATION_SUMMARY_MODEL     model for extraction when the heuristic fails (default claude-3-haiku-20240307)
+    OBSERVATION_LLM_MIN_TOKENS    only use the model for observations longer than this (default 1500)
+"""
+from typing import Dict, List, Any, Optional
+from contextlib import contextmanager
+from langchain_core.messages import HumanMessage, SystemMessage
+from models.llm_client import create_llm
+from models.token_budget import token_counter
+from models.telemetry import llm_step
+import ast
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+OBSERVATION_MAX_TOKENS = int(os.getenv("OBSERVATION_MAX_TOKENS", "400"))
+OBSERVATION_SUMMARY_MODEL = os.getenv("OBSERVATION_SUMMARY_MODEL", "claude-3-haiku-20240307")
+OBSERVATION_LLM_MIN_TOKENS = int(os.getenv("OBSERVATION_LLM_MIN_TOKENS", "1500"))
+
+EXTRACT_PROMPT = """Extract the facts relevant to the research question from the text below: figures, dates,
+names, trends and their sources. Quote numbers exactly. Return only the facts as short bullet points."""
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on",
+    "or", "that", "the", "to", "what", "which", "who", "with", "why", "vs", "about", "does", "do",
+}
+
+# What the current agent run is researching, for tools whose input is not a query
+_observation_focus: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("observation_focus", default=None)
+
+
+@contextmanager
+def observation_focus(question: str):
+    """Use a research question to rank the snippets of observations made inside the block."""
+    token = _observation_focus.set(question)
+    try:
+        yield
+    finally:
+        _observation_focus.reset(token)
+
+
+def _terms(text: str) -> set:
+    return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in _STOPWORDS and len(word) > 1}
+
+
+def _snippets(text: str) -> List[str]:
+    """Split an observation into snippets: search results, paragraphs, then sentences."""
+    stripped = text.strip()
+    # SerpAPIWrapper returns several results as the repr of a list of strings
+    if stripped.startswith("[") and stripped.endswith("]"):
+        try:
+            parsed = ast.literal_eval(stripped)
+            if isinstance(parsed, list):
+                return [str(item).strip() for item in parsed if str(item).strip()]
+        except (ValueError, SyntaxError):
+            pass
+    snippets = []
+    for paragraph in re.split(r"\n\s*\n", stripped):
+        snippets.extend(s.strip() for s in re.split(r"(?<=[.!?])\s+(?=[A-Z0-9])", paragraph) if s.strip())
+    return snippets
+
+
+def _score(snippet: str, terms: set) -> float:
+    """Share of query terms in the snippet, with a small bonus for figures."""
+    if not terms:
+        return 0.0
+    overlap = len(terms & _terms(snippet)) / len(terms)
+    figures = 0.1 if re.search(r"\d", snippet) else 0.0
+    return overlap + figures if overlap else 0.0
+
+
+class ObservationCompressor:
+    """Cuts observations down to their relevant snippets within a token budget."""
+
+    def __init__(self, max_tokens: int = OBSERVATION_MAX_TOKENS, llm_min_tokens: int = OBSERVATION_LLM_MIN_TOKENS,
+                 llm=None):
+        self.max_tokens = max_tokens
+        self.llm_min_tokens = llm_min_tokens
+        self.llm = llm
+        self._lock = threading.Lock()
+        self._stats = {
+            "observations": 0,
+            "compressed": 0,
+            "llm_extractions": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "seconds": 0.0,
+        }
+
+    def _get_llm(self):
+        """Lazily create the extraction model."""
+        if self.llm is None:
+            self.llm = create_llm(
+                model=OBSERVATION_SUMMARY_MODEL,
+                anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+                temperature=0,
+                max_tokens=self.max_tokens,
+                timeout=30,
+                max_retries=1
+            )
+        return self.llm
+
+    def _select(self, snippets: List[str], terms: set) -> Optional[str]:
+        """Best-scoring snippets in their original order, within the budget, or None if none are relevant."""
+        ranked = sorted(range(len(snippets)), key=lambda i: _score(snippets[i], terms), reverse=True)
+        if not ranked or _score(snippets[ranked[0]], terms) == 0:
+            return None
+        chosen, used = [], 0
+        for i in ranked:
+            if _score(snippets[i], terms) == 0:
+                break
+            cost = token_counter.count(snippets[i])
+            if used + cost > self.max_tokens:
+                continue
+            chosen.append(i)
+            used += cost
+        if not chosen:
+            # Even the best snippet is over budget on its own
+            return token_counter.truncate(snippets[ranked[0]], self.max_tokens)
+        return "\n".join(snippets[i] for i in sorted(chosen))
+
+    @llm_step("compress_observation")
+    def _extract(self, text: str, query: str) -> str:
+        response = self._get_llm().invoke([
+            SystemMessage(content=EXTRACT_PROMPT),
+            HumanMessage(content=f"Research question: {query}\n\nText:\n{text}")
+        ])
+        return response.content
+
+    def compress(self, text: str, query: Optional[str] = None) -> str:
+        """
+        Cut an observation down to what is relevant to the query.
+
+        Args:
+            text: The tool output
+            query: What the tool was asked, defaults to the current observation focus
+
+        Returns:
+            str: The observation, at most max_tokens long
+        """
+        start = time.monotonic()
+        text = str(text)
+        tokens_in = token_counter.count(text)
+        result, used_llm = text, False
+        if self.max_tokens and tokens_in > self.max_tokens:
+            query = query or _observation_focus.get() or ""
+            result = self._select(_snippets(text), _terms(query))
+            if result is None and query and tokens_in >= self.llm_min_tokens:
+                try:
+                    result = self._extract(text, query)
+                    used_llm = True
+                except Exception as e:
+                    logger.warning(f"Observation extraction failed, truncating instead: {str(e)}")
+            if result is None:
+                result = text
+            result = token_counter.truncate(result, self.max_tokens)
+
+        with self._lock:
+            self._stats["observations"] += 1
+            self._stats["compressed"] += 1 if result is not text else 0
+            self._stats["llm_extractions"] += 1 if used_llm else 0
+            self._stats["tokens_in"] += tokens_in
+            self._stats["tokens_out"] += token_counter.count(result) if result is not text else tokens_in
+            self._stats["seconds"] += time.monotonic() - start
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["seconds"] = round(stats["seconds"], 4)
+        stats["max_tokens"] = self.max_tokens
+        stats["saved_tokens"] = stats["tokens_in"] - stats["tokens_out"]
+        return stats
+
+
+observation_compressor = ObservationCompressor()
+
+
+def compress_observation(text: str, query: Optional[str] = None) -> str:
+    """Compress a tool output with the shared compressor."""
+    return observation_compressor.compress(text, query)
+
+
+def get_observation_stats() -> Dict[str, Any]:
+    """Get how many observations were compressed and the tokens saved."""
+    return observation_compressor.get_stats()
@@ -0,0 +1,205 @@
+from typing import Dict, Any, Optional
+from collections import deque
+from models.deadline import DeadlineExceeded
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Client-side limits per upstream provider. Set a value to 0 to disable that bucket.
+# Anthropic tokens are input tokens, which is what its per-minute limit counts.
+PROVIDER_LIMITS = {
+    "anthropic": {
+        "requests_per_minute": int(os.getenv("ANTHROPIC_RPM", "50")),
+        "tokens_per_minute": int(os.getenv("ANTHROPIC_TPM", "80000")),
+    },
+    "cohere": {
+        "requests_per_minute": int(os.getenv("COHERE_RPM", "1000")),
+        "tokens_per_minute": int(os.getenv("COHERE_TPM", "0")),
+    },
+    "serpapi": {
+        "requests_per_minute": int(os.getenv("SERPAPI_RPM", "60")),
+        "tokens_per_minute": 0,
+    },
+}
+
+# Waits longer than this are logged as warnings
+SLOW_WAIT_SECONDS = 1.0
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket limiter on requests/min and tokens/min with a FIFO queue.
+
+    Callers take a ticket and are served strictly in arrival order, so a large
+    request cannot be starved by a stream of small ones. Token usage can be
+    settled after the call once the real count is known.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_level = float(requests_per_minute)
+        self._token_level = float(tokens_per_minute)
+        self._paused_until = 0.0
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._stats = {
+            "acquired": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "throttled_by_upstream": 0,
+            "timed_out": 0,
+        }
+
+    def _refill(self, now: float):
+        """Top up both buckets for the time elapsed. Caller must hold the lock."""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_level = min(
+                float(self.requests_per_minute),
+                self._request_level + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_level = min(
+                float(self.tokens_per_minute),
+                self._token_level + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _time_until_available(self, tokens: int, now: float) -> float:
+        """Seconds until a request of this size fits. Caller must hold the lock."""
+        wait = max(0.0, self._paused_until - now)
+        if self.requests_per_minute and self._request_level < 1:
+            wait = max(wait, (1 - self._request_level) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_level < tokens:
+            wait = max(wait, (tokens - self._token_level) * 60.0 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> float:
+        """
+        Block until the request may be sent.
+
+        Args:
+            tokens: Estimated tokens the request will consume
+            timeout: Longest time to wait, e.g. what is left of the request's deadline
+
+        Returns:
+            float: Seconds spent waiting in the queue
+
+        Raises:
+            DeadlineExceeded: If the request could not be sent within timeout
+        """
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        # A request larger than the whole bucket would never fit
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        start = time.monotonic()
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    left = None if timeout is None else timeout - (now - start)
+                    if self._queue[0] is ticket:
+                        self._refill(now)
+                        wait = self._time_until_available(tokens, now)
+                        if wait <= 0:
+                            self._request_level -= 1
+                            self._token_level -= tokens
+                            break
+                    else:
+                        wait = None
+                    if left is not None and left <= 0:
+                        self._stats["timed_out"] += 1
+                        raise DeadlineExceeded(f"Timed out after {timeout:.1f}s waiting for the {self.name} rate limit")
+                    if left is not None:
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self._stats["acquired"] += 1
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+
+        if waited > SLOW_WAIT_SECONDS:
+            logger.warning(f"[{self.name}] Waited {waited:.2f}s for rate limit ({len(self._queue)} still queued)")
+        return waited
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the real usage of a request is known."""
+        if not self.tokens_per_minute or actual_tokens is None:
+            return
+        with self._cond:
+            self._token_level -= actual_tokens - estimated_tokens
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold every queued caller after the upstream reported a rate limit."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats["throttled_by_upstream"] += 1
+        logger.warning(f"[{self.name}] Upstream rate limit hit, pausing all callers for {seconds:.1f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue and wait-time statistics."""
+        with self._cond:
+            acquired = self._stats["acquired"]
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "queued": len(self._queue),
+                "acquired": acquired,
+                "avg_wait_seconds": round(self._stats["total_wait_seconds"] / acquired, 4) if acquired else 0.0,
+                "max_wait_seconds": round(self._stats["max_wait_seconds"], 4),
+                "throttled_by_upstream": self._stats["throttled_by_upstream"],
+            }
+
+
+_limiters: Dict[str, TokenBucketLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> TokenBucketLimiter:
+    """Get the process-wide limiter for an upstream provider."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limits = PROVIDER_LIMITS.get(provider, {})
+            limiter = TokenBucketLimiter(
+                provider,
+                requests_per_minute=limits.get("requests_per_minute", 0),
+                tokens_per_minute=limits.get("tokens_per_minute", 0)
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Get statistics for every limiter created so far."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.get_stats() for limiter in limiters}
+
+
+def retry_after_seconds(error: Exception, default: float = 5.0) -> float:
+    """Read the retry-after header from an upstream 429, if there is one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            return float(headers.get("retry-after", default))
+        except (TypeError, ValueError):
+            pass
+    return default
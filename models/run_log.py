@@ -0,0 +1,410 @@
+"""
+Resumable streamed runs.
+
+A run executes a stream of events in a background thread and appends each
+event to an append-only log, so the work is not tied to the request that
+started it. A client that drops can reconnect with the Last-Event-ID of the
+last event it received, get the events it missed, then follow the live
+ones. Finished runs stay replayable for the TTL.
+
+When its last client disconnects, a run is cancelled (see
+models/cancellation.py) unless it was started as resumable. A resumable run
+with no client attached keeps going for the grace period and is stopped at
+its next event after that.
+
+With the SQLite backend every event is also written to disk, so a run can
+still be replayed after a restart; a run that was going when the process
+stopped is replayed as interrupted. Live runs are only followed on the
+process running them, so multi-process deployments need sticky sessions.
+
+    RUN_LOG_BACKEND          "memory" (default) or "sqlite"
+    RUN_LOG_PATH             SQLite file (default data/run_log.sqlite3 in the project root)
+    RUN_GRACE_SECONDS        how long a resumable run continues with no client attached (default 300)
+    RUN_TTL_SECONDS          how long finished runs stay replayable (default 3600)
+    RUN_HEARTBEAT_SECONDS    keep-alive interval for idle streams (default 15)
+"""
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
+from models.cancellation import CancellationToken, RunCancelled, cancellation_scope
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RUN_LOG_BACKEND = os.getenv("RUN_LOG_BACKEND", "memory")
+RUN_LOG_PATH = os.getenv("RUN_LOG_PATH", os.path.join(PROJECT_ROOT, "data", "run_log.sqlite3"))
+RUN_GRACE_SECONDS = float(os.getenv("RUN_GRACE_SECONDS", "300"))
+RUN_TTL_SECONDS = float(os.getenv("RUN_TTL_SECONDS", "3600"))
+RUN_HEARTBEAT_SECONDS = float(os.getenv("RUN_HEARTBEAT_SECONDS", "15"))
+
+# Run states
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STOPPED = 'stopped'
+CANCELLED = 'cancelled'
+INTERRUPTED = 'interrupted'
+
+
+class Run:
+    """One streamed run and the events it has produced so far."""
+
+    def __init__(self, kind: str, user_id: Optional[str] = None, run_id: Optional[str] = None, store=None,
+                 resumable: bool = False):
+        """
+        Args:
+            kind: What is being run, e.g. "market_research"
+            user_id: Owner of the run, or None for anonymous requests
+            run_id: ID of a run loaded from the store; new runs get a fresh one
+            store: SQLiteRunStore to write events to, or None to keep them in memory only
+            resumable: Keep running when the last client disconnects, instead of cancelling
+        """
+        self.id = run_id or uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.store = store
+        self.resumable = resumable
+        self.token = CancellationToken()
+        self.status = RUNNING
+        self.events: List[Any] = []
+        self.cond = threading.Condition()
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self._detached_at = time.monotonic()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != RUNNING
+
+    def append(self, event: Any) -> int:
+        """
+        Add an event to the log and wake the streams.
+
+        Returns:
+            int: The event's position, which clients send back as Last-Event-ID
+        """
+        with self.cond:
+            position = len(self.events)
+            self.events.append(event)
+            self.cond.notify_all()
+        if self.store is not None:
+            self.store.append_event(self.id, position, event)
+        return position
+
+    def finish(self, status: str):
+        with self.cond:
+            self.status = status
+            self.finished_at = time.time()
+            self.cond.notify_all()
+        if self.store is not None:
+            self.store.finish_run(self.id, status, self.finished_at)
+
+    def idle_seconds(self) -> float:
+        """How long the run has had no client attached, 0 while one is."""
+        with self.cond:
+            return 0.0 if self.subscribers else time.monotonic() - self._detached_at
+
+    def stream(self, after: int = 0, heartbeat: Optional[float] = None) -> Iterator[Tuple[Optional[int], Any]]:
+        """
+        Yield the run's events from position `after`, then live ones until the run finishes.
+
+        The caller counts as an attached client until it stops iterating. When
+        the last client stops before the run finishes, a run that is not
+        resumable is cancelled.
+
+        Args:
+            after: Number of events the caller has already seen
+            heartbeat: Yield (None, None) after this many seconds without an event, so the
+                caller can write a keep-alive and notice a closed connection
+
+        Yields:
+            Tuple[Optional[int], Any]: Each event's position and the event
+        """
+        with self.cond:
+            self.subscribers += 1
+        try:
+            position = after
+            while True:
+                with self.cond:
+                    if position >= len(self.events):
+                        if self.finished:
+                            return
+                        if not self.cond.wait(heartbeat):
+                            pending = None
+                        else:
+                            continue
+                    else:
+                        pending = self.events[position:]
+                if pending is None:
+                    yield None, None
+                    continue
+                for event in pending:
+                    yield position, event
+                    position += 1
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+                if not self.subscribers:
+                    self._detached_at = time.monotonic()
+                abandoned = not self.subscribers and not self.finished and not self.resumable
+            if abandoned:
+                self.token.cancel(f"client disconnected from run {self.id}")
+
+    def summary(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                'run_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'resumable': self.resumable,
+                'events': len(self.events),
+                'subscribers': self.subscribers,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class SQLiteRunStore:
+    """Run event logs in a local SQLite file."""
+
+    def __init__(self, path: str = RUN_LOG_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    user_id TEXT,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS run_events (
+                    run_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    PRIMARY KEY (run_id, position)
+                )
+            """)
+
+    def create_run(self, run: Run):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, NULL)",
+                (run.id, run.kind, run.user_id, run.status, run.created_at)
+            )
+
+    def append_event(self, run_id: str, position: int, event: Any):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO run_events VALUES (?, ?, ?)",
+                    (run_id, position, json.dumps(event, default=str))
+                )
+        except Exception as e:
+            logger.warning(f"Writing event {position} of run {run_id} failed: {str(e)}")
+
+    def finish_run(self, run_id: str, status: str, finished_at: float):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?", (status, finished_at, run_id)
+                )
+        except Exception as e:
+            logger.warning(f"Finishing run {run_id} failed: {str(e)}")
+
+    def load_run(self, run_id: str) -> Optional[Run]:
+        """A stored run with all its events, or None if it is not stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, user_id, status, created_at, finished_at FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+            if not row:
+                return None
+            events = self._conn.execute(
+                "SELECT event FROM run_events WHERE run_id = ? ORDER BY position", (run_id,)
+            ).fetchall()
+        run = Run(row[0], row[1], run_id=run_id)
+        run.events = [json.loads(event) for (event,) in events]
+        run.status, run.created_at, run.finished_at = row[2], row[3], row[4]
+        return run
+
+    def delete_finished_before(self, cutoff: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM run_events WHERE run_id IN "
+                "(SELECT run_id FROM runs WHERE finished_at IS NOT NULL AND finished_at < ?)",
+                (cutoff,)
+            )
+            self._conn.execute("DELETE FROM runs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+
+
+class RunManager:
+    """Starts runs in the background and keeps their logs for reconnecting clients."""
+
+    def __init__(self, store: Optional[SQLiteRunStore] = None, grace_seconds: float = RUN_GRACE_SECONDS,
+                 ttl_seconds: float = RUN_TTL_SECONDS):
+        """
+        Args:
+            store: Where to persist run logs, or None to keep them in memory only
+            grace_seconds: How long a run continues with no client attached
+            ttl_seconds: How long finished runs stay replayable
+        """
+        self.store = store
+        self.grace_seconds = grace_seconds
+        self.ttl_seconds = ttl_seconds
+        self._runs: Dict[str, Run] = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, DONE: 0, FAILED: 0, STOPPED: 0, CANCELLED: 0, "loaded": 0}
+
+    def start(self, kind: str, user_id: Optional[str], factory: Callable[[], Iterable[Any]],
+              resumable: bool = False) -> Run:
+        """
+        Start a run in the background.
+
+        Args:
+            kind: What is being run, e.g. "market_research"
+            user_id: Owner of the run, or None for anonymous requests
+            factory: Produces the run's events; every event must be JSON serializable
+            resumable: Keep running for the grace period when the last client disconnects
+
+        Returns:
+            Run: The started run
+        """
+        run = Run(kind, user_id, store=self.store, resumable=resumable)
+        if self.store is not None:
+            self.store.create_run(run)
+        with self._lock:
+            self._evict_finished()
+            self._runs[run.id] = run
+            self._stats["started"] += 1
+        # The run keeps the request's context, e.g. its telemetry tags
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._produce, run, factory),
+            name=f"run-{kind}",
+            daemon=True
+        ).start()
+        return run
+
+    def _produce(self, run: Run, factory: Callable[[], Iterable[Any]]):
+        # Model calls and agent steps of the run stop once its token is cancelled
+        with cancellation_scope(run.token):
+            events = None
+            try:
+                # A factory that raises fails the run rather than leaving it running
+                events = iter(factory())
+                status = self._consume(run, events)
+            except RunCancelled:
+                status = CANCELLED
+            except Exception as e:
+                logger.error(f"Run {run.id} failed: {str(e)}")
+                run.append({'type': 'error', 'status': 'error', 'run_id': run.id, 'content': str(e)})
+                status = FAILED
+            finally:
+                close = getattr(events, 'close', None)
+                if close is not None:
+                    close()
+        if status == CANCELLED:
+            logger.info(f"Run {run.id} cancelled: {run.token.reason}")
+            run.append({'type': 'status', 'status': CANCELLED, 'run_id': run.id, 'content': run.token.reason})
+        run.finish(status)
+        with self._lock:
+            self._stats[status] += 1
+
+    def _consume(self, run: Run, events: Iterator[Any]) -> str:
+        """Log a run's events until they end, the run is cancelled or the grace period passes."""
+        for event in events:
+            # Whatever the run produced while being cancelled, e.g. errors from aborted calls, is dropped
+            run.token.raise_if_cancelled()
+            run.append(event)
+            if run.idle_seconds() > self.grace_seconds:
+                logger.info(f"Stopping run {run.id}: no client for {self.grace_seconds:.0f}s")
+                run.append({
+                    'type': 'status',
+                    'status': STOPPED,
+                    'run_id': run.id,
+                    'content': 'Run stopped because no client was connected'
+                })
+                run.token.cancel(f"no client connected to run {run.id}")
+                return STOPPED
+        run.token.raise_if_cancelled()
+        return DONE
+
+    def get(self, run_id: str) -> Optional[Run]:
+        """The run with this ID, loaded from the store if it is no longer in memory."""
+        with self._lock:
+            run = self._runs.get(run_id)
+        if run is not None or self.store is None:
+            return run
+        run = self.store.load_run(run_id)
+        if run is None:
+            return None
+        if run.status == RUNNING:
+            # Started by a process that is gone
+            run.events.append({
+                'type': 'status',
+                'status': INTERRUPTED,
+                'run_id': run.id,
+                'content': 'Run was interrupted by a server restart'
+            })
+            run.status = INTERRUPTED
+        with self._lock:
+            self._runs[run.id] = run
+            self._stats["loaded"] += 1
+        return run
+
+    def _evict_finished(self):
+        """Forget runs that finished long ago. Caller must hold the lock."""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            run_id for run_id, run in self._runs.items()
+            if run.finished_at is not None and run.finished_at < cutoff
+        ]
+        for run_id in expired:
+            del self._runs[run_id]
+        if self.store is not None:
+            self.store.delete_finished_before(cutoff)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for run in self._runs.values() if not run.finished)
+            return {
+                **self._stats,
+                "running": running,
+                "kept": len(self._runs),
+                "persistent": self.store is not None,
+                "grace_seconds": self.grace_seconds,
+            }
+
+
+_manager: Optional[RunManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_run_manager() -> RunManager:
+    """Get the shared run manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            store = SQLiteRunStore() if RUN_LOG_BACKEND == "sqlite" else None
+            _manager = RunManager(store=store)
+            logger.info(f"Run logs kept in {'SQLite' if store else 'memory'}")
+        return _manager
+
+
+def get_run_stats() -> Dict[str, Any]:
+    """Get the shared run manager's statistics."""
+    return get_run_manager().get_stats()
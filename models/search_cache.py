@@ -0,0 +1,192 @@
+"""
+Persistent cache for web search results.
+
+Results are keyed by the normalized query and the search engine parameters,
+and kept in a SQLite file so they survive restarts and are shared by every
+worker on the host. A result younger than the TTL is served as is. An older
+one is still served for up to the stale window while a background search
+refreshes it, so only the first search after the result fully expires waits
+for SerpAPI. The least recently used results are evicted past the size limit.
+
+    SEARCH_CACHE_ENABLED          "0" disables the cache (default "1")
+    SEARCH_CACHE_PATH             SQLite file (default data/search_cache.sqlite3 in the project root)
+    SEARCH_CACHE_TTL_SECONDS      how long a result is fresh (default 86400)
+    SEARCH_CACHE_STALE_SECONDS    how long after that it is served while refreshing (default 604800)
+    SEARCH_CACHE_MAX_ENTRIES      results kept before evicting (default 10000)
+"""
+from typing import Dict, Any, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") != "0"
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(PROJECT_ROOT, "data", "search_cache.sqlite3"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "86400"))
+SEARCH_CACHE_STALE_SECONDS = float(os.getenv("SEARCH_CACHE_STALE_SECONDS", "604800"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "10000"))
+
+# Evict once the cache is this much over its limit, so eviction is not run on every write
+EVICTION_SLACK = 0.1
+
+
+class SearchCache:
+    """TTL cache on SQLite with stale-while-revalidate and LRU size eviction."""
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+                 stale_seconds: float = SEARCH_CACHE_STALE_SECONDS, max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS search_results (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS search_results_accessed_at ON search_results (accessed_at)"
+            )
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+        # Background refreshes of stale results, one per key at a time
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-cache-refresh")
+        self._refreshing = set()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "evictions": 0,
+        }
+
+    def _read(self, key: str):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result, fetched_at FROM search_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE search_results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def _write(self, key: str, result: str):
+        now = time.time()
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO search_results VALUES (?, ?, ?, ?)", (key, result, now, now)
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    "UPDATE search_results SET result = ?, fetched_at = ?, accessed_at = ? WHERE key = ?",
+                    (result, now, now, key)
+                )
+            self._entries += inserted
+            if self._entries > self.max_entries * (1 + EVICTION_SLACK):
+                excess = self._entries - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM search_results WHERE key IN "
+                    "(SELECT key FROM search_results ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                )
+                self._entries -= excess
+                self._stats["evictions"] += excess
+
+    def _refresh(self, key: str, fetch: Callable[[], str]):
+        try:
+            result = fetch()
+            if result:
+                self._write(key, result)
+            with self._lock:
+                self._stats["refreshes"] += 1
+        except Exception as e:
+            logger.warning(f"Refreshing a stale search result failed: {str(e)}")
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], str]) -> str:
+        """
+        Get a search result from the cache, fetching it if it is missing or expired.
+
+        Args:
+            key: Cache key for the query and engine parameters
+            fetch: Runs the search; called in the background to refresh stale results
+
+        Returns:
+            str: The search result
+        """
+        row = self._read(key)
+        if row:
+            result, fetched_at = row
+            age = time.time() - fetched_at
+            if age < self.ttl_seconds:
+                with self._lock:
+                    self._stats["hits"] += 1
+                return result
+            if age < self.ttl_seconds + self.stale_seconds:
+                with self._lock:
+                    self._stats["stale_hits"] += 1
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if refresh:
+                    self._refresher.submit(contextvars.copy_context().run, self._refresh, key, fetch)
+                return result
+
+        with self._lock:
+            self._stats["misses"] += 1
+        result = fetch()
+        # Empty results are likely transient and are not kept
+        if result:
+            self._write(key, result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit, miss, refresh and eviction counts."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+            served = self._stats["hits"] + self._stats["stale_hits"]
+            return {
+                **self._stats,
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "hit_rate": round(served / lookups, 4) if lookups else 0.0,
+                "refreshing": len(self._refreshing),
+                "ttl_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+            }
+
+
+_cache: Optional[SearchCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> Optional[SearchCache]:
+    """Get the shared search cache, or None if it is disabled."""
+    global _cache
+    if not SEARCH_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchCache()
+        return _cache
+
+
+def get_search_cache_stats() -> Dict[str, Any]:
+    """Get the shared search cache's statistics."""
+    cache = get_search_cache()
+    return cache.get_stats() if cache else {"enabled": False}
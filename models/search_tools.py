@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.utilities import SerpAPIWrapper
+from models.rate_limiter import get_rate_limiter
+from models.single_flight import get_single_flight, make_key
+from models.search_cache import get_search_cache
+from models.observation_compressor import compress_observation
+from models.deadline import DeadlineExceeded, check_deadline, time_budget
+from models.fakes import fakes_enabled, FakeSearchWrapper
+import contextvars
+import logging
+import os
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_search = None
+_search_lock = threading.Lock()
+
+# SerpAPIWrapper takes no timeout, so searches under a deadline run here and the caller
+# stops waiting when it passes; the search itself finishes in the background and is cached
+SEARCH_DEADLINE_WORKERS = int(os.getenv("SEARCH_DEADLINE_WORKERS", "8"))
+_deadline_executor = ThreadPoolExecutor(max_workers=SEARCH_DEADLINE_WORKERS, thread_name_prefix="search-deadline")
+
+
+def get_search_wrapper() -> SerpAPIWrapper:
+    """Get the shared SerpAPI client, or its local fake when FAKE_UPSTREAMS is set."""
+    global _search
+    with _search_lock:
+        if _search is None:
+            if fakes_enabled():
+                _search = FakeSearchWrapper()
+            else:
+                _search = SerpAPIWrapper(serpapi_api_key=os.getenv("SERPAPI_API_KEY"))
+        return _search
+
+
+def _search_upstream(query: str) -> str:
+    get_rate_limiter("serpapi").acquire(timeout=time_budget())
+    return get_search_wrapper().run(query)
+
+
+def _engine_params() -> dict:
+    """Search engine parameters that change the results, e.g. engine, country and language."""
+    return dict(getattr(get_search_wrapper(), "params", None) or {})
+
+
+def run_search(query: str) -> str:
+    """
+    Run a web search, answering from the search cache when possible and sharing
+    the result with identical searches already in flight.
+    """
+    key = make_key("serpapi", query=query, params=_engine_params())
+
+    def _fetch():
+        return get_single_flight("serpapi").do(key, lambda: _search_upstream(query))
+
+    cache = get_search_cache()
+    if cache is None:
+        return _fetch()
+    return cache.get_or_fetch(key, _fetch)
+
+
+def run_search_within_deadline(query: str) -> str:
+    """
+    Run a web search, giving up when the request's deadline passes.
+
+    Raises:
+        DeadlineExceeded: If the search did not finish before the deadline
+    """
+    budget = time_budget()
+    if budget is None:
+        return run_search(query)
+    check_deadline()
+    future = _deadline_executor.submit(contextvars.copy_context().run, run_search, query)
+    try:
+        return future.result(timeout=budget)
+    except DeadlineExceeded:
+        raise
+    except TimeoutError:
+        raise DeadlineExceeded(f"The request ran out of time searching for '{query}'")
+
+
+def run_search_for_agent(query: str) -> str:
+    """Run a web search for an agent loop, keeping only the results relevant to the query."""
+    return compress_observation(run_search_within_deadline(query), query)
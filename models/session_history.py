@@ -0,0 +1,199 @@
+"""
+Per-session chat history for the research agents.
+
+Each (user, thread) session keeps a bounded ring buffer of its most recent
+messages, so history can neither leak between users nor grow without limit.
+Requests without a user have no session: nothing is read or recorded for
+them, since they could only share one.
+Sessions are evicted least recently used first, and once idle for longer
+than the idle timeout. With the Supabase backend every message is also
+written to the session_messages table, and an evicted session is reloaded
+from it on its next use.
+
+    SESSION_HISTORY_BACKEND        "memory" (default) or "supabase"
+    SESSION_HISTORY_MAX_MESSAGES   messages kept per session (default 20)
+    SESSION_HISTORY_MAX_SESSIONS   sessions kept in memory (default 1000)
+    SESSION_HISTORY_IDLE_SECONDS   sessions unused this long are evicted (default 3600)
+
+The Supabase backend expects this table:
+
+    create table session_messages (
+        id bigint generated always as identity primary key,
+        user_id text not null,
+        thread_id text not null,
+        role text not null,
+        content text not null,
+        created_at timestamptz not null default now()
+    );
+    create index on session_messages (user_id, thread_id, id desc);
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SESSION_HISTORY_BACKEND = os.getenv("SESSION_HISTORY_BACKEND", "memory")
+SESSION_HISTORY_MAX_MESSAGES = int(os.getenv("SESSION_HISTORY_MAX_MESSAGES", "20"))
+SESSION_HISTORY_MAX_SESSIONS = int(os.getenv("SESSION_HISTORY_MAX_SESSIONS", "1000"))
+SESSION_HISTORY_IDLE_SECONDS = float(os.getenv("SESSION_HISTORY_IDLE_SECONDS", "3600"))
+
+# Session of requests that do not name a thread
+DEFAULT_THREAD = "default"
+
+
+class SessionHistoryStore:
+    """Bounded per-session message history with LRU and idle eviction."""
+
+    def __init__(self, max_messages: int = SESSION_HISTORY_MAX_MESSAGES,
+                 max_sessions: int = SESSION_HISTORY_MAX_SESSIONS,
+                 idle_seconds: float = SESSION_HISTORY_IDLE_SECONDS, client=None):
+        """
+        Args:
+            max_messages: Messages kept per session
+            max_sessions: Sessions kept in memory
+            idle_seconds: Sessions unused this long are evicted
+            client: Supabase client to persist messages to, or None to keep them in memory only
+        """
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.client = client
+        self._sessions: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"evicted_lru": 0, "evicted_idle": 0, "loaded": 0, "persist_errors": 0}
+
+    @staticmethod
+    def _key(user_id: str, thread_id: Optional[str]) -> Tuple[str, str]:
+        return (str(user_id), str(thread_id or DEFAULT_THREAD))
+
+    def _evict(self, now: float):
+        """Drop idle sessions, then the least recently used past the limit. Caller must hold the lock."""
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session["last_used"] <= self.idle_seconds:
+                break
+            del self._sessions[key]
+            self._stats["evicted_idle"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._stats["evicted_lru"] += 1
+
+    def _load(self, key: Tuple[str, str]) -> List[Dict[str, Any]]:
+        """Read a session's most recent messages from Supabase."""
+        if self.client is None:
+            return []
+        try:
+            response = self.client.table("session_messages").select("role, content, created_at") \
+                .eq("user_id", key[0]).eq("thread_id", key[1]) \
+                .order("id", desc=True).limit(self.max_messages).execute()
+        except Exception as e:
+            logger.warning(f"Loading session history failed: {str(e)}")
+            return []
+        self._stats["loaded"] += 1
+        return [
+            {"role": row["role"], "content": row["content"], "timestamp": row["created_at"]}
+            for row in reversed(response.data or [])
+        ]
+
+    def _session(self, key: Tuple[str, str]) -> Dict[str, Any]:
+        """Get a session, loading it if it is not in memory."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                session["last_used"] = now
+                self._sessions.move_to_end(key)
+                return session
+        # Load outside the lock; a concurrent load of the same session keeps the first one
+        messages = self._load(key)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = {"messages": deque(messages, maxlen=self.max_messages), "last_used": now}
+                self._sessions[key] = session
+                self._evict(now)
+            return session
+
+    def append(self, user_id: Optional[str], thread_id: Optional[str], role: str, content: str):
+        """
+        Add a message to a session. Messages of anonymous requests are not recorded.
+
+        Args:
+            user_id: Owner of the session, or None for anonymous requests
+            thread_id: Conversation within the user's sessions
+            role: "human" or "ai"
+            content: Message text
+        """
+        if not user_id:
+            return
+        key = self._key(user_id, thread_id)
+        message = {"role": role, "content": content, "timestamp": datetime.now(timezone.utc).isoformat()}
+        session = self._session(key)
+        with self._lock:
+            session["messages"].append(message)
+        if self.client is not None:
+            try:
+                self.client.table("session_messages").insert({
+                    "user_id": key[0],
+                    "thread_id": key[1],
+                    "role": role,
+                    "content": content,
+                }).execute()
+            except Exception as e:
+                logger.warning(f"Persisting session history failed: {str(e)}")
+                with self._lock:
+                    self._stats["persist_errors"] += 1
+
+    def get(self, user_id: Optional[str], thread_id: Optional[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Get a session's most recent messages, oldest first.
+
+        Args:
+            user_id: Owner of the session, or None for anonymous requests
+            thread_id: Conversation within the user's sessions
+            limit: Most messages to return, default all that are kept
+
+        Returns:
+            List[Dict[str, Any]]: Messages with role, content and timestamp, none for anonymous requests
+        """
+        if not user_id:
+            return []
+        session = self._session(self._key(user_id, thread_id))
+        with self._lock:
+            messages = list(session["messages"])
+        return messages[-limit:] if limit else messages
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                **self._stats,
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "max_messages": self.max_messages,
+                "persistent": self.client is not None,
+            }
+
+
+_store: Optional[SessionHistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_history() -> SessionHistoryStore:
+    """Get the shared session history store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            client = None
+            if SESSION_HISTORY_BACKEND == "supabase":
+                from supabase import create_client
+                client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+            _store = SessionHistoryStore(client=client)
+            logger.info(f"Session history kept in {'Supabase' if client else 'memory'}")
+        return _store
@@ -0,0 +1,211 @@
+from typing import Dict, Any, Callable, Iterator, Iterable
+from models.cancellation import CancellationToken, RunCancelled, cancellation_scope, current_token
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    """Normalize request values so trivially different requests share a key."""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip().lower()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(namespace: str, **params: Any) -> str:
+    """Build a single-flight key from a namespace and the request parameters."""
+    raw = json.dumps(_normalize(params), sort_keys=True, default=str)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class _Call:
+    """An in-flight blocking computation."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """An in-flight streaming computation whose events are fanned out to subscribers."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.subscribers = 0
+        # Cancelled when every subscriber has left before the computation finished
+        self.token = CancellationToken()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent requests into one computation.
+
+    The first caller for a key runs the computation; callers arriving while it
+    is in flight attach to it and get the same result. Nothing is cached once
+    the computation finishes, so a later request starts a fresh one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn, or wait for the identical call already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            logger.info(f"[{self.name}] Attached to in-flight request {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key: str, factory: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        Subscribe to a streamed computation, starting it if none is in flight.
+
+        The producer runs in a background thread so it is not tied to any one
+        subscriber. Every subscriber receives every event from the start, in
+        order, including ones produced before it attached. Events are shared
+        between subscribers and must not be mutated.
+
+        A subscriber leaves when it stops iterating or its own cancellation
+        token is cancelled; once every subscriber has left, the producer is
+        cancelled.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is None or broadcast.token.cancelled:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                self._stats["executions"] += 1
+                # The producer keeps the leader's context, e.g. its telemetry tags
+                threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._produce, key, broadcast, factory),
+                    name=f"single-flight-{self.name}",
+                    daemon=True
+                ).start()
+            else:
+                self._stats["coalesced"] += 1
+                logger.info(f"[{self.name}] Attached to in-flight stream {key}")
+            with broadcast.cond:
+                broadcast.subscribers += 1
+
+        token = current_token()
+        if token is not None:
+            token.on_cancel(lambda: self._wake(broadcast))
+        try:
+            index = 0
+            while True:
+                with broadcast.cond:
+                    while index >= len(broadcast.events) and not broadcast.done:
+                        if token is not None and token.cancelled:
+                            raise RunCancelled(token.reason)
+                        broadcast.cond.wait()
+                    pending = broadcast.events[index:]
+                    index += len(pending)
+                    finished = broadcast.done and index >= len(broadcast.events)
+                for event in pending:
+                    yield event
+                if finished:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+        finally:
+            with broadcast.cond:
+                broadcast.subscribers -= 1
+                abandoned = not broadcast.subscribers and not broadcast.done
+            if abandoned:
+                broadcast.token.cancel(f"every subscriber left in-flight stream {key}")
+
+    @staticmethod
+    def _wake(broadcast: _Broadcast):
+        with broadcast.cond:
+            broadcast.cond.notify_all()
+
+    def _produce(self, key: str, broadcast: _Broadcast, factory: Callable[[], Iterable[Any]]):
+        try:
+            # The producer answers to its subscribers as a group, not to the leader's token
+            with cancellation_scope(broadcast.token):
+                for event in factory():
+                    with broadcast.cond:
+                        broadcast.events.append(event)
+                        broadcast.cond.notify_all()
+        except RunCancelled:
+            logger.info(f"[{self.name}] Cancelled in-flight stream {key}")
+        except Exception as e:
+            logger.error(f"[{self.name}] Error in in-flight stream {key}: {str(e)}")
+            broadcast.error = e
+        finally:
+            with self._lock:
+                # A cancelled stream may already have been replaced by a new one
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            with broadcast.cond:
+                broadcast.done = True
+                broadcast.cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
+
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Get the process-wide single-flight group with this name."""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = SingleFlight(name)
+            _flights[name] = flight
+        return flight
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """Get statistics for every single-flight group created so far."""
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {flight.name: flight.get_stats() for flight in flights}
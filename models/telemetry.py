@@ -0,0 +1,411 @@
+"""
+Per-call LLM telemetry.
+
+Every chat model created through create_llm carries llm_telemetry, a
+LangChain callback that records the route, agent, step, model, time to first
+token, total latency, input/output/cache tokens and estimated cost of each
+call. Calls are aggregated into histograms per (route, agent, step, model),
+served by /api/metrics, and each call is also written as one JSON log line
+tagged with the request ID.
+
+Route and request ID are set per HTTP request by the Flask app. Agents tag
+their steps with the llm_step decorator or telemetry_context.
+"""
+from typing import Dict, List, Any, Optional, Callable
+from contextlib import contextmanager
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from collections import deque
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Approximate USD per million (input, output) tokens, for cost and savings estimates
+MODEL_PRICES = {
+    "claude-3-haiku-20240307": (0.25, 1.25),
+    "claude-3-5-haiku-20241022": (0.80, 4.00),
+    "claude-3-sonnet-20240229": (3.00, 15.00),
+    "claude-3-5-sonnet-20240620": (3.00, 15.00),
+    "claude-3-opus-20240229": (15.00, 75.00),
+}
+
+# Prompt cache reads and writes are billed relative to the input price
+CACHE_READ_MULTIPLIER = 0.1
+CACHE_WRITE_MULTIPLIER = 1.25
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120]
+
+# Number of recent streamed TTFT samples kept per model, for percentiles
+TTFT_WINDOW = int(os.getenv("TELEMETRY_TTFT_WINDOW", "200"))
+
+_request_id = contextvars.ContextVar("llm_request_id", default=None)
+_route = contextvars.ContextVar("llm_route", default=None)
+_agent = contextvars.ContextVar("llm_agent", default=None)
+_step = contextvars.ContextVar("llm_step", default=None)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int,
+                  cache_read_tokens: int = 0, cache_creation_tokens: int = 0) -> float:
+    """
+    Estimate the USD cost of a call. Unknown models are priced as 0.
+
+    Args:
+        model: Anthropic model name
+        input_tokens: All input tokens, including cached ones
+        output_tokens: Output tokens
+        cache_read_tokens: Input tokens read from the prompt cache
+        cache_creation_tokens: Input tokens written to the prompt cache
+
+    Returns:
+        float: Estimated cost in USD
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    uncached = max(input_tokens - cache_read_tokens - cache_creation_tokens, 0)
+    input_cost = input_price * (
+        uncached
+        + cache_read_tokens * CACHE_READ_MULTIPLIER
+        + cache_creation_tokens * CACHE_WRITE_MULTIPLIER
+    )
+    return (input_cost + output_tokens * output_price) / 1_000_000
+
+
+def set_request_context(request_id: Optional[str], route: Optional[str]):
+    """Tag all LLM calls made for the current HTTP request."""
+    _request_id.set(request_id)
+    _route.set(route)
+    _agent.set(None)
+    _step.set(None)
+
+
+def get_request_id() -> Optional[str]:
+    """Get the ID of the HTTP request being served, if any."""
+    return _request_id.get()
+
+
+@contextmanager
+def telemetry_context(agent: Optional[str] = None, step: Optional[str] = None):
+    """Tag LLM calls made inside the block with an agent and step."""
+    tokens = []
+    if agent is not None:
+        tokens.append((_agent, _agent.set(agent)))
+    if step is not None:
+        tokens.append((_step, _step.set(step)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def llm_step(step: Optional[str] = None):
+    """
+    Decorator that tags LLM calls made by an agent method.
+
+    The agent is the class the method is defined on and the step defaults to
+    the method name. Generator methods are tagged for their whole lifetime,
+    including while the consumer is between items.
+    """
+    def decorator(func: Callable) -> Callable:
+        agent = func.__qualname__.split(".")[0] if "." in func.__qualname__ else None
+        step_name = step or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                context = contextvars.copy_context()
+
+                def _start():
+                    _agent.set(agent)
+                    _step.set(step_name)
+                    return func(*args, **kwargs)
+
+                generator = context.run(_start)
+                try:
+                    while True:
+                        try:
+                            item = context.run(next, generator)
+                        except StopIteration:
+                            return
+                        yield item
+                finally:
+                    context.run(generator.close)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with telemetry_context(agent=agent, step=step_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Histogram:
+    """Cumulative-bucket histogram with percentile estimates."""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Estimate a percentile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "p50": self._rounded(self.percentile(50)),
+            "p95": self._rounded(self.percentile(95)),
+            "p99": self._rounded(self.percentile(99)),
+            "buckets": buckets,
+        }
+
+    @staticmethod
+    def _rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 3) if value is not None else None
+
+
+class LLMMetrics:
+    """Process-wide aggregate of LLM calls per (route, agent, step, model)."""
+
+    LABELS = ("route", "agent", "step", "model")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[tuple, Dict[str, Any]] = {}
+        self._recent_ttft: Dict[str, deque] = {}
+
+    def record(self, call: Dict[str, Any]):
+        key = tuple(call.get(label) or "unknown" for label in self.LABELS)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {
+                    "calls": 0,
+                    "errors": 0,
+                    "latency": _Histogram(),
+                    "ttft": _Histogram(),
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "cache_read_tokens": 0,
+                    "cache_creation_tokens": 0,
+                    "cost_usd": 0.0,
+                }
+                self._series[key] = series
+            series["calls"] += 1
+            if call.get("error"):
+                series["errors"] += 1
+                return
+            series["latency"].observe(call["latency"])
+            if call.get("ttft") is not None:
+                series["ttft"].observe(call["ttft"])
+                if call.get("streaming"):
+                    self._recent_ttft.setdefault(call["model"], deque(maxlen=TTFT_WINDOW)).append(call["ttft"])
+            for field in ("input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens"):
+                series[field] += call.get(field, 0)
+            series["cost_usd"] += call.get("cost_usd", 0.0)
+
+    def ttft_percentile(self, model: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Get a percentile of the model's recent streamed time to first token.
+
+        Args:
+            model: Anthropic model name
+            pct: Percentile, 0-100
+            min_samples: Return None if fewer recent samples than this
+
+        Returns:
+            Optional[float]: TTFT in seconds, or None without enough samples
+        """
+        with self._lock:
+            samples = sorted(self._recent_ttft.get(model, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(int(pct / 100 * len(samples)), len(samples) - 1)]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get every series plus totals, as JSON-serializable data."""
+        with self._lock:
+            series_list = []
+            totals = {"calls": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0,
+                      "cache_read_tokens": 0, "cache_creation_tokens": 0, "cost_usd": 0.0}
+            for key, series in self._series.items():
+                entry = dict(zip(self.LABELS, key))
+                entry.update({
+                    "calls": series["calls"],
+                    "errors": series["errors"],
+                    "latency_seconds": series["latency"].snapshot(),
+                    "ttft_seconds": series["ttft"].snapshot(),
+                    "input_tokens": series["input_tokens"],
+                    "output_tokens": series["output_tokens"],
+                    "cache_read_tokens": series["cache_read_tokens"],
+                    "cache_creation_tokens": series["cache_creation_tokens"],
+                    "estimated_cost_usd": round(series["cost_usd"], 6),
+                })
+                series_list.append(entry)
+                for field in totals:
+                    totals[field] += series[field]
+            totals["cost_usd"] = round(totals["cost_usd"], 6)
+            return {"series": series_list, "totals": totals}
+
+    def render_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE llm_calls_total counter",
+            "# TYPE llm_errors_total counter",
+            "# TYPE llm_tokens_total counter",
+            "# TYPE llm_cost_usd_total counter",
+            "# TYPE llm_latency_seconds histogram",
+            "# TYPE llm_ttft_seconds histogram",
+        ]
+        with self._lock:
+            for key, series in self._series.items():
+                labels = ",".join(f'{name}="{value}"' for name, value in zip(self.LABELS, key))
+                lines.append(f"llm_calls_total{{{labels}}} {series['calls']}")
+                lines.append(f"llm_errors_total{{{labels}}} {series['errors']}")
+                for kind in ("input", "output", "cache_read", "cache_creation"):
+                    lines.append(f'llm_tokens_total{{{labels},type="{kind}"}} {series[kind + "_tokens"]}')
+                lines.append(f"llm_cost_usd_total{{{labels}}} {series['cost_usd']:.6f}")
+                for name in ("latency", "ttft"):
+                    histogram = series[name]
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f'llm_{name}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f"llm_{name}_seconds_sum{{{labels}}} {histogram.sum:.3f}")
+                    lines.append(f"llm_{name}_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+llm_metrics = LLMMetrics()
+
+
+def get_llm_metrics() -> Dict[str, Any]:
+    """Get the aggregated LLM call metrics."""
+    return llm_metrics.get_metrics()
+
+
+class LLMTelemetryCallback(BaseCallbackHandler):
+    """Records timing, token usage and cost of every chat model call."""
+
+    run_inline = True
+
+    def __init__(self, metrics: LLMMetrics = llm_metrics):
+        self.metrics = metrics
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any):
+        metadata = metadata or {}
+        invocation_params = kwargs.get("invocation_params") or {}
+        with self._lock:
+            self._runs[run_id] = {
+                "start": time.monotonic(),
+                "first_token": None,
+                "streaming": bool(invocation_params.get("stream") or invocation_params.get("streaming")),
+                "request_id": _request_id.get(),
+                "route": metadata.get("route") or _route.get(),
+                "agent": metadata.get("agent") or _agent.get(),
+                "step": metadata.get("step") or _step.get(),
+                "model": invocation_params.get("model") or metadata.get("ls_model_name"),
+            }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        if not token:
+            return
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run["first_token"] is None:
+                run["first_token"] = time.monotonic()
+                run["streaming"] = True
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        end = time.monotonic()
+        usage, model = {}, (response.llm_output or {}).get("model")
+        if response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+            usage = getattr(message, "usage_metadata", None) or {}
+            model = model or (getattr(message, "response_metadata", None) or {}).get("model")
+        details = usage.get("input_token_details") or {}
+
+        call = self._base_record(run, end)
+        call["model"] = model or run["model"]
+        # Without streaming the first token arrives with the whole response
+        first_token = run["first_token"] or (None if run["streaming"] else end)
+        call["ttft"] = round(first_token - run["start"], 3) if first_token else None
+        call["input_tokens"] = usage.get("input_tokens", 0)
+        call["output_tokens"] = usage.get("output_tokens", 0)
+        call["cache_read_tokens"] = details.get("cache_read") or 0
+        call["cache_creation_tokens"] = details.get("cache_creation") or 0
+        call["cost_usd"] = round(estimate_cost(
+            call["model"], call["input_tokens"], call["output_tokens"],
+            call["cache_read_tokens"], call["cache_creation_tokens"]
+        ), 6)
+        self._emit(call)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        call = self._base_record(run, time.monotonic())
+        call["error"] = type(error).__name__
+        self._emit(call)
+
+    @staticmethod
+    def _base_record(run: Dict[str, Any], end: float) -> Dict[str, Any]:
+        return {
+            "event": "llm_call",
+            "request_id": run["request_id"],
+            "route": run["route"],
+            "agent": run["agent"],
+            "step": run["step"],
+            "model": run["model"],
+            "streaming": run["streaming"],
+            "latency": round(end - run["start"], 3),
+        }
+
+    def _emit(self, call: Dict[str, Any]):
+        self.metrics.record(call)
+        logger.info(json.dumps(call))
+
+
+llm_telemetry = LLMTelemetryCallback()
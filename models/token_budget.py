@@ -0,0 +1,152 @@
+from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, fall back to a character heuristic
+    tiktoken = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Chat history token budgets per route. Override with CHAT_HISTORY_BUDGET_<ROUTE>,
+# e.g. CHAT_HISTORY_BUDGET_CONSULTANT=6000.
+DEFAULT_HISTORY_BUDGETS = {
+    "consultant": 3000,
+    "multi_agent": 4000,
+    "market_research": 1500,
+}
+DEFAULT_HISTORY_BUDGET = 2000
+
+# Older turns that only partially fit are cut down, unless less than this
+# many tokens of budget remain, in which case they are dropped.
+MIN_TRUNCATED_TOKENS = 50
+TRUNCATION_MARKER = " …[truncated]"
+
+
+def get_history_budget(route: str) -> int:
+    """Get the chat history token budget configured for a route."""
+    env_value = os.getenv(f"CHAT_HISTORY_BUDGET_{route.upper()}")
+    if env_value:
+        try:
+            return int(env_value)
+        except ValueError:
+            logger.warning(f"Invalid CHAT_HISTORY_BUDGET_{route.upper()}: {env_value}")
+    return DEFAULT_HISTORY_BUDGETS.get(route, DEFAULT_HISTORY_BUDGET)
+
+
+class TokenCounter:
+    """Approximate token counter with a bounded per-message cache."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                # Claude's tokenizer is not public; cl100k is a close enough estimate
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"Falling back to heuristic token counting: {str(e)}")
+
+    def count(self, text: str) -> int:
+        """Count the tokens in a piece of text."""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return max(1, len(text) // 4)
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        """Count the tokens in a chat message, caching the result by content."""
+        content = str(message.get("content", ""))
+        key = hashlib.sha1(f"{message.get('role', '')}\x00{content}".encode("utf-8")).hexdigest()
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        # Role label and separators cost a few tokens on top of the content
+        tokens = self.count(content) + 4
+
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to roughly max_tokens, keeping the beginning."""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens]) + TRUNCATION_MARKER
+        max_chars = max_tokens * 4
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars] + TRUNCATION_MARKER
+
+
+# Shared counter so cached message counts survive across requests
+token_counter = TokenCounter()
+
+
+def trim_chat_history(
+    chat_history: List[Dict[str, Any]],
+    budget: int,
+    counter: Optional[TokenCounter] = None
+) -> List[Dict[str, Any]]:
+    """
+    Trim chat history to fit a token budget.
+
+    The most recent turns are kept verbatim. The newest turn that does not fit
+    is truncated to the remaining budget and everything older is dropped.
+
+    Args:
+        chat_history: Messages in chronological order, as {"role", "content"} dicts
+        budget: Maximum number of history tokens
+        counter: Token counter to use, defaults to the shared one
+
+    Returns:
+        List[Dict[str, Any]]: The trimmed history in chronological order
+    """
+    if not chat_history:
+        return []
+    counter = counter or token_counter
+
+    kept = []
+    remaining = budget
+    # Walk from the newest message so cost is bounded by the budget, not the history length
+    for message in reversed(chat_history):
+        if not isinstance(message, dict):
+            continue
+        tokens = counter.count_message(message)
+        if tokens <= remaining:
+            kept.append(message)
+            remaining -= tokens
+            continue
+
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            truncated = dict(message)
+            truncated["content"] = counter.truncate(
+                str(message.get("content", "")),
+                remaining - 4 - counter.count(TRUNCATION_MARKER)
+            )
+            kept.append(truncated)
+        break
+
+    dropped = len(chat_history) - len(kept)
+    if dropped:
+        logger.info(f"Trimmed chat history to {len(kept)} messages ({dropped} older messages dropped) for a {budget} token budget")
+
+    kept.reverse()
+    return kept